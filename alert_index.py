@@ -0,0 +1,91 @@
+import threading
+from datetime import datetime
+from typing import Iterable
+
+import pytz
+from pymongo.collection import Collection
+
+from records import ID_EXPIRES_INDEX
+
+
+class AlertIndex:
+    """An in-memory index of every alert ID currently stored in the database along with
+    its expiration time.  This lets the updater skip alerts it has already seen without
+    a round trip to Mongo.
+    """
+
+    def __init__(self):
+        """Create an empty AlertIndex object."""
+        self._expires: dict[str, datetime] = dict()
+        self._lock = threading.Lock()
+
+    def load(self, coll: Collection) -> int:
+        """Rebuild the index from the alerts collection.  The scan is covered by the
+        `ID_EXPIRES_INDEX` index, so it never reads the alert documents themselves.
+
+        Args:
+            coll (Collection): The collection holding the alert records.
+
+        Returns:
+            int: The number of alerts loaded into the index.
+        """
+        expires = dict()
+        for doc in coll.find({}, {"_id": 0, "id": 1, "properties.expires": 1}, hint=ID_EXPIRES_INDEX):
+            expires[doc["id"]] = as_utc(doc["properties"]["expires"])
+        with self._lock:
+            self._expires = expires
+        return len(expires)
+
+    def add(self, alert_id: str, expires: datetime) -> None:
+        """Add an alert to the index.
+
+        Args:
+            alert_id (str): The NWS alert ID.
+            expires (datetime): When the alert expires.
+        """
+        with self._lock:
+            self._expires[alert_id] = as_utc(expires)
+
+    def update(self, alerts: Iterable[tuple[str, datetime]]) -> None:
+        """Add several alerts to the index at once.
+
+        Args:
+            alerts (Iterable[tuple[str, datetime]]): Pairs of alert IDs and expiration times.
+        """
+        with self._lock:
+            for alert_id, expires in alerts:
+                self._expires[alert_id] = as_utc(expires)
+
+    def expire(self, now: datetime) -> list[str]:
+        """Remove every alert from the index that expired before `now`.
+
+        Args:
+            now (datetime): The current time.
+
+        Returns:
+            list[str]: The IDs of the alerts that were removed.
+        """
+        with self._lock:
+            expired = [k for k, v in self._expires.items() if v < now]
+            for k in expired:
+                del self._expires[k]
+        return expired
+
+    def __contains__(self, alert_id: str) -> bool:
+        return alert_id in self._expires
+
+    def __len__(self) -> int:
+        return len(self._expires)
+
+
+def as_utc(dt: datetime) -> datetime:
+    """Attach the UTC timezone to a naive datetime.  Mongo hands back naive UTC datetimes
+    unless the client is timezone aware.
+
+    Args:
+        dt (datetime): The datetime to convert.
+
+    Returns:
+        datetime: The timezone aware datetime.
+    """
+    return dt if dt.tzinfo else dt.replace(tzinfo=pytz.UTC)
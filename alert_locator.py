@@ -0,0 +1,189 @@
+import math
+import threading
+from datetime import datetime
+from typing import Iterable
+
+import numpy as np
+import shapely
+
+import geometry
+from alert_index import as_utc
+from alerts import Alert
+from counties import CountyStore, same_to_fips
+
+
+class AlertLocator:
+    """An in-memory spatial index of the active alerts, answering which alerts cover a point or
+    a county.  Alert polygons, or the county geometries of county-based alerts, are bucketed
+    into a grid of `cell_size` degree cells, so alerts can be added and removed one at a time
+    and a lookup only tests the shapes in a single cell.  The shapes and bounds of each cell
+    are packed into arrays the first time the cell is searched after it changes, so a lookup
+    is a bounding box check and a single `shapely.contains_xy` call.
+
+    Alerts are keyed by their `properties.id`.
+
+    Attributes:
+        counties (CountyStore): The county geometries for alerts without polygons.
+        cell_size (float): The size of the grid cells in degrees.
+    """
+    counties: CountyStore
+    cell_size: float
+
+    def __init__(self, counties: CountyStore, cell_size: float = .5):
+        """Create an AlertLocator object.
+
+        Args:
+            counties (CountyStore): The county geometries for alerts without polygons.
+            cell_size (float, optional): The size of the grid cells in degrees. Defaults to 0.5.
+        """
+        self.counties = counties
+        self.cell_size = cell_size
+        self._lock = threading.Lock()
+        self._shapes: dict[str, np.ndarray] = dict()
+        self._bounds: dict[str, np.ndarray] = dict()
+        self._cells: dict[tuple[int, int], set[str]] = dict()
+        self._packed: dict[tuple[int, int], tuple[np.ndarray, np.ndarray, list[str]]] = dict()
+        self._by_county: dict[str, set[str]] = dict()
+        self._alerts: dict[str, tuple[datetime, list[tuple[int, int]], list[str]]] = dict()
+
+    def _grid(self, bounds: np.ndarray) -> list[tuple[int, int]]:
+        cells = set()
+        for west, south, east, north in bounds:
+            for x in range(math.floor(west / self.cell_size), math.floor(east / self.cell_size) + 1):
+                for y in range(math.floor(south / self.cell_size), math.floor(north / self.cell_size) + 1):
+                    cells.add((x, y))
+        return list(cells)
+
+    def add(self, alert: Alert) -> None:
+        """Add an alert to the index, replacing any alert with the same ID.
+
+        Args:
+            alert (Alert): The NWS alert, with its expiration already parsed.
+        """
+        fips = same_to_fips(alert.properties.geocode.get("SAME", []))
+        if alert.geometry:
+            shapes = geometry.shapes(alert)
+        else:
+            shapes = self.counties.geometries(fips)
+        shapes = np.array(shapes, dtype=object)
+        shapely.prepare(shapes)
+        bounds = shapely.bounds(shapes).reshape(-1, 4)
+        cells = self._grid(bounds)
+
+        alert_id = alert.properties.id
+        with self._lock:
+            self._remove(alert_id)
+            self._shapes[alert_id] = shapes
+            self._bounds[alert_id] = bounds
+            self._alerts[alert_id] = (as_utc(alert.properties.expires), cells, fips)
+            for cell in cells:
+                self._cells.setdefault(cell, set()).add(alert_id)
+                self._packed.pop(cell, None)
+            for code in fips:
+                self._by_county.setdefault(code, set()).add(alert_id)
+
+    def update(self, alerts: Iterable[Alert]) -> None:
+        """Add several alerts to the index.
+
+        Args:
+            alerts (Iterable[Alert]): The NWS alerts.
+        """
+        for alert in alerts:
+            self.add(alert)
+
+    def remove(self, alert_id: str) -> None:
+        """Remove an alert from the index.
+
+        Args:
+            alert_id (str): The alert's `properties.id`.
+        """
+        with self._lock:
+            self._remove(alert_id)
+
+    def _remove(self, alert_id: str) -> None:
+        if alert_id not in self._alerts:
+            return
+        _, cells, fips = self._alerts.pop(alert_id)
+        del self._shapes[alert_id]
+        del self._bounds[alert_id]
+        for cell in cells:
+            self._packed.pop(cell, None)
+        for key, index in [(c, self._cells) for c in cells] + [(f, self._by_county) for f in fips]:
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(alert_id)
+                if not ids:
+                    del index[key]
+
+    def expire(self, now: datetime) -> list[str]:
+        """Remove every alert that expired before `now`.
+
+        Args:
+            now (datetime): The current time.
+
+        Returns:
+            list[str]: The IDs of the alerts that were removed.
+        """
+        with self._lock:
+            expired = [k for k, (expires, _, _) in self._alerts.items() if expires < now]
+            for k in expired:
+                self._remove(k)
+        return expired
+
+    def at(self, lat: float, lon: float) -> list[str]:
+        """Return the alerts covering a point.
+
+        Args:
+            lat (float): The latitude.
+            lon (float): The longitude.
+
+        Returns:
+            list[str]: The IDs of the alerts.
+        """
+        cell = (math.floor(lon / self.cell_size), math.floor(lat / self.cell_size))
+        with self._lock:
+            packed = self._packed.get(cell)
+            if packed is None:
+                if cell not in self._cells:
+                    return list()
+                packed = self._packed[cell] = self._pack(self._cells[cell])
+        shapes, bounds, owners = packed
+
+        candidates = np.flatnonzero(
+            (bounds[:, 0] <= lon) & (bounds[:, 2] >= lon) & (bounds[:, 1] <= lat) & (bounds[:, 3] >= lat)
+        )
+        inside = candidates[shapely.contains_xy(shapes[candidates], lon, lat)]
+        return list(dict.fromkeys(owners[i] for i in inside))
+
+    def _pack(self, alert_ids: set[str]) -> tuple[np.ndarray, np.ndarray, list[str]]:
+        owners = [i for i in alert_ids for _ in range(len(self._shapes[i]))]
+        shapes = np.concatenate([self._shapes[i] for i in alert_ids])
+        bounds = np.concatenate([self._bounds[i] for i in alert_ids])
+        return shapes, bounds, owners
+
+    def in_county(self, fips: str) -> list[str]:
+        """Return the alerts issued for a county.
+
+        Args:
+            fips (str): The county FIPS code.
+
+        Returns:
+            list[str]: The IDs of the alerts.
+        """
+        with self._lock:
+            return list(self._by_county.get(fips, ()))
+
+    def ids(self) -> set[str]:
+        """Return the IDs of every alert in the index.
+
+        Returns:
+            set[str]: The alert IDs.
+        """
+        with self._lock:
+            return set(self._alerts)
+
+    def __contains__(self, alert_id: str) -> bool:
+        return alert_id in self._alerts
+
+    def __len__(self) -> int:
+        return len(self._alerts)
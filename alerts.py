@@ -0,0 +1,251 @@
+import json
+from dataclasses import dataclass, field, fields
+from datetime import datetime
+from typing import Any, Callable, Iterator, Optional, Union
+
+import numpy as np
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+
+@dataclass(slots=True)
+class Geometry:
+    """The polygons of an alert with every ring held as an (N, 2) array of longitude/latitude.
+
+    Attributes:
+        type (str): The GeoJSON geometry type.
+        polygons (list[list[np.ndarray]]): The polygons, each a list of rings with the exterior
+            ring first.
+    """
+    type: str
+    polygons: list[list[np.ndarray]]
+
+    @classmethod
+    def from_geojson(cls, geojson: Optional[dict]) -> Optional["Geometry"]:
+        """Create a Geometry from a GeoJSON geometry.
+
+        Args:
+            geojson (Optional[dict]): The GeoJSON geometry.
+
+        Returns:
+            Optional[Geometry]: The geometry, or None if there are no polygons in it.
+        """
+        if not geojson:
+            return None
+        polygons = list(_polygons(geojson))
+        if not polygons:
+            return None
+        return cls(type=geojson["type"], polygons=polygons)
+
+    def to_geojson(self) -> dict:
+        """Return the geometry as GeoJSON.
+
+        Returns:
+            dict: The GeoJSON geometry.
+        """
+        polygons = [[ring.tolist() for ring in polygon] for polygon in self.polygons]
+        if self.type == "Polygon" and len(polygons) == 1:
+            return {"type": "Polygon", "coordinates": polygons[0]}
+        return {"type": "MultiPolygon", "coordinates": polygons}
+
+
+def _polygons(geojson: dict) -> Iterator[list[np.ndarray]]:
+    if geojson["type"] == "Polygon":
+        yield [np.asarray(ring, dtype=np.float64) for ring in geojson["coordinates"]]
+    elif geojson["type"] == "MultiPolygon":
+        for polygon in geojson["coordinates"]:
+            yield [np.asarray(ring, dtype=np.float64) for ring in polygon]
+    elif geojson["type"] == "GeometryCollection":
+        for geometry in geojson["geometries"]:
+            yield from _polygons(geometry)
+
+
+@dataclass(slots=True)
+class AlertProperties:
+    """The properties of an NWS alert.  The properties used by the updater are attributes, the
+    rest are kept in `extra`.  Items can also be read and set by name like a dictionary.
+    """
+    id: str = ""
+    event: str = ""
+    headline: Optional[str] = None
+    description: Optional[str] = None
+    instruction: Optional[str] = None
+    areaDesc: str = ""
+    messageType: str = ""
+    severity: str = ""
+    geocode: dict = field(default_factory=dict)
+    parameters: dict = field(default_factory=dict)
+    sent: Union[str, datetime, None] = None
+    effective: Union[str, datetime, None] = None
+    onset: Union[str, datetime, None] = None
+    expires: Union[str, datetime, None] = None
+    ends: Union[str, datetime, None] = None
+    extra: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, properties: dict) -> "AlertProperties":
+        """Create an AlertProperties object from the properties of a GeoJSON feature.
+
+        Args:
+            properties (dict): The feature properties.
+
+        Returns:
+            AlertProperties: The alert properties.
+        """
+        known = {k: v for k, v in properties.items() if k in _PROPERTY_FIELDS}
+        extra = {k: v for k, v in properties.items() if k not in _PROPERTY_FIELDS}
+        return cls(**known, extra=extra)
+
+    def to_dict(self) -> dict:
+        """Return the properties as a dictionary.
+
+        Returns:
+            dict: The feature properties.
+        """
+        properties = {k: getattr(self, k) for k in _PROPERTY_FIELDS}
+        properties.update(self.extra)
+        return properties
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Return a property by name.
+
+        Args:
+            key (str): The property name.
+            default (Any, optional): The value to return if the property is missing. Defaults to None.
+
+        Returns:
+            Any: The property value.
+        """
+        if key in _PROPERTY_FIELDS:
+            return getattr(self, key)
+        return self.extra.get(key, default)
+
+    def __getitem__(self, key: str) -> Any:
+        if key in _PROPERTY_FIELDS:
+            return getattr(self, key)
+        return self.extra[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key in _PROPERTY_FIELDS:
+            setattr(self, key, value)
+        else:
+            self.extra[key] = value
+
+
+_PROPERTY_FIELDS = frozenset(f.name for f in fields(AlertProperties)) - {"extra"}
+
+
+@dataclass(slots=True)
+class Alert:
+    """An NWS alert decoded from the API.
+
+    Attributes:
+        id (str): The alert ID (the URL of the alert).
+        properties (AlertProperties): The alert properties.
+        geometry (Optional[Geometry]): The alert polygons, or None for county-based alerts.
+        received (Optional[float]): The `time.monotonic` value of the poll that found the alert,
+            used to measure delivery latency.  It is not stored.
+        destinations (list[str]): The names of the destinations the alert is sent to.  It is
+            not stored.
+    """
+    id: str
+    properties: AlertProperties
+    geometry: Optional[Geometry] = None
+    received: Optional[float] = None
+    destinations: list[str] = field(default_factory=list)
+
+    @classmethod
+    def from_feature(cls, feature: dict) -> "Alert":
+        """Create an Alert from a GeoJSON feature.
+
+        Args:
+            feature (dict): The feature from the NWS API.
+
+        Returns:
+            Alert: The alert.
+        """
+        return cls(
+            id=feature["id"],
+            properties=AlertProperties.from_dict(feature["properties"]),
+            geometry=Geometry.from_geojson(feature.get("geometry")),
+        )
+
+    def to_dict(self) -> dict:
+        """Return the alert as a GeoJSON feature.
+
+        Returns:
+            dict: The GeoJSON feature.
+        """
+        return {
+            "id": self.id,
+            "type": "Feature",
+            "geometry": self.geometry.to_geojson() if self.geometry else None,
+            "properties": self.properties.to_dict(),
+        }
+
+
+def as_alert(alert: Union[dict, Alert]) -> Alert:
+    """Return an alert as an Alert, decoding it if it is a GeoJSON feature.
+
+    Args:
+        alert (Union[dict, Alert]): The alert.
+
+    Returns:
+        Alert: The alert.
+    """
+    return alert if isinstance(alert, Alert) else Alert.from_feature(alert)
+
+
+def decode_features(content: Union[bytes, str], skip: Optional[Callable[[str], bool]] = None) -> Iterator[Alert]:
+    """Decode the features of an `/alerts/active` response one at a time.  Only one feature is
+    ever held as plain JSON, so the full FeatureCollection is never built.
+
+    Args:
+        content (Union[bytes, str]): The response body.
+        skip (Optional[Callable[[str], bool]], optional): Called with the ID of every feature,
+            features it returns True for are passed over without building an Alert. Defaults to None.
+
+    Raises:
+        ValueError: The response is not a JSON object.
+
+    Yields:
+        Alert: Each alert in the response.
+    """
+    text = content.decode() if isinstance(content, bytes) else content
+    i = _skip(text, 0)
+    if text[i:i + 1] != "{":
+        raise ValueError("Response is not a JSON object.")
+    i = _skip(text, i + 1)
+
+    while text[i:i + 1] != "}":
+        key, i = _decoder.raw_decode(text, i)
+        i = _skip(text, i)
+        if text[i:i + 1] != ":":
+            raise ValueError(f"Expected ':' at position {i}.")
+        i = _skip(text, i + 1)
+
+        if key == "features" and text[i:i + 1] == "[":
+            i = _skip(text, i + 1)
+            while text[i:i + 1] != "]":
+                feature, i = _decoder.raw_decode(text, i)
+                if skip is None or not skip(feature.get("id")):
+                    yield Alert.from_feature(feature)
+                i = _skip(text, i)
+                if text[i:i + 1] == ",":
+                    i = _skip(text, i + 1)
+            i += 1
+        else:
+            _, i = _decoder.raw_decode(text, i)
+
+        i = _skip(text, i)
+        if text[i:i + 1] == ",":
+            i = _skip(text, i + 1)
+        elif text[i:i + 1] != "}":
+            raise ValueError(f"Expected ',' or '}}' at position {i}.")
+
+
+def _skip(text: str, i: int) -> int:
+    while i < len(text) and text[i] in _WHITESPACE:
+        i += 1
+    return i
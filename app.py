@@ -0,0 +1,185 @@
+import gzip
+import hashlib
+import json
+import threading
+from typing import Callable, Optional
+
+import redis
+from flask import Flask, Response, request
+from flask_restx import Api, Namespace, Resource
+
+from alert_locator import AlertLocator
+from alerts import Alert
+from cache import AlertCache
+from config import Config
+from counties import county_store
+from normalize import parse_timestamp
+
+alert_cache = AlertCache(
+    redis.Redis.from_url(Config.REDIS_URI),
+    prefix=Config.REDIS_PREFIX,
+    response_ttl=Config.API_RESPONSE_CACHE_SECONDS,
+)
+alert_locator = AlertLocator(county_store)
+_locator_version: Optional[int] = None
+_locator_lock = threading.Lock()
+
+app = Flask(__name__)
+api = Api(
+    app,
+    version=Config.VERSION,
+    title="NWS Alerts",
+    description="A caching frontend for the active NWS alerts.",
+)
+ns = Namespace("alerts", description="Active NWS alerts")
+api.add_namespace(ns)
+
+# Compression level of the cached responses.
+GZIP_LEVEL = 6
+
+list_parser = ns.parser()
+list_parser.add_argument("event", type=str, help='The event name, e.g. "Tornado Warning".', location="args")
+list_parser.add_argument("area", type=str, help='A UGC code ("ARC119"), SAME code ("005119"), or state ("AR").', location="args")
+list_parser.add_argument("point", type=str, help='Only alerts covering this point, as "lat,lon".', location="args")
+list_parser.add_argument("county", type=str, help='Only alerts issued for this county FIPS code ("05119").', location="args")
+
+
+def sync_locator() -> AlertLocator:
+    """Bring the spatial index up to date with the cache.  Only the alerts added or removed
+    since the last sync are touched.
+
+    Returns:
+        AlertLocator: The spatial index of the active alerts.
+    """
+    global _locator_version
+    with _locator_lock:
+        version = alert_cache.version()
+        if version == _locator_version:
+            return alert_locator
+
+        active = set(alert_cache.ids())
+        for alert_id in alert_locator.ids() - active:
+            alert_locator.remove(alert_id)
+        for document in alert_cache.get_many(i for i in active if i not in alert_locator):
+            alert = Alert.from_feature(json.loads(document))
+            alert.properties.expires = parse_timestamp(alert.properties.expires)
+            alert_locator.add(alert)
+        _locator_version = version
+    return alert_locator
+
+
+def located_ids(point: Optional[str], county: Optional[str]) -> Optional[list[str]]:
+    """Return the IDs of the alerts covering a point and/or county.
+
+    Args:
+        point (Optional[str]): The point as "lat,lon".
+        county (Optional[str]): The county FIPS code.
+
+    Returns:
+        Optional[list[str]]: The alert IDs, or None if neither a point nor a county was given.
+    """
+    if not point and not county:
+        return None
+    locator = sync_locator()
+    ids = None
+    if point:
+        try:
+            lat, lon = (float(i) for i in point.split(","))
+        except ValueError:
+            ns.abort(400, f'Point "{point}" is not in the "lat,lon" format.')
+        ids = locator.at(lat, lon)
+    if county:
+        county_ids = set(locator.in_county(county))
+        ids = list(county_ids) if ids is None else [i for i in ids if i in county_ids]
+    return ids
+
+
+def cached_response(build: Callable[[], bytes]) -> Response:
+    """Answer a request from the response cache.  The ETag covers the alert version and the
+    request, so a client that already has the current response gets a 304 without any alerts
+    being read.
+
+    Args:
+        build (Callable[[], bytes]): Builds the JSON body on a cache miss.
+
+    Returns:
+        Response: The response.
+    """
+    version = alert_cache.version()
+    etag = hashlib.sha1(f"{version}|{request.full_path}".encode()).hexdigest()
+    if etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    body = alert_cache.get_response(etag)
+    if body is None:
+        body = gzip.compress(build(), GZIP_LEVEL)
+        alert_cache.put_response(etag, body)
+
+    response = Response(content_type="application/geo+json")
+    if "gzip" in request.accept_encodings:
+        response.set_data(body)
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response.set_data(gzip.decompress(body))
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = "no-cache"
+    response.set_etag(etag)
+    return response
+
+
+def feature_collection(features: list[bytes]) -> bytes:
+    """Join cached alerts into a GeoJSON FeatureCollection without decoding them.
+
+    Args:
+        features (list[bytes]): Each alert as GeoJSON.
+
+    Returns:
+        bytes: The FeatureCollection.
+    """
+    return b'{"type":"FeatureCollection","features":[' + b",".join(features) + b"]}"
+
+
+@ns.route("/active")
+class ActiveAlerts(Resource):
+    @ns.expect(list_parser)
+    @ns.response(200, "The active alerts as a GeoJSON FeatureCollection.")
+    @ns.response(304, "The alerts have not changed.")
+    def get(self):
+        """Return all active alerts, optionally filtered by event, area, point, and county."""
+        args = list_parser.parse_args()
+        return cached_response(lambda: feature_collection(
+            alert_cache.features(args.event, args.area, located_ids(args.point, args.county))
+        ))
+
+
+@ns.route("/active/event/<string:event>")
+class ActiveAlertsByEvent(Resource):
+    @ns.response(200, "The active alerts as a GeoJSON FeatureCollection.")
+    @ns.response(304, "The alerts have not changed.")
+    def get(self, event: str):
+        """Return the active alerts for an event."""
+        return cached_response(lambda: feature_collection(alert_cache.features(event=event)))
+
+
+@ns.route("/active/area/<string:area>")
+class ActiveAlertsByArea(Resource):
+    @ns.response(200, "The active alerts as a GeoJSON FeatureCollection.")
+    @ns.response(304, "The alerts have not changed.")
+    def get(self, area: str):
+        """Return the active alerts for a UGC code, SAME code, or state."""
+        return cached_response(lambda: feature_collection(alert_cache.features(area=area)))
+
+
+@ns.route("/<path:alert_id>")
+class AlertById(Resource):
+    @ns.response(200, "The alert as a GeoJSON Feature.")
+    @ns.response(304, "The alert has not changed.")
+    @ns.response(404, "The alert is not active.")
+    def get(self, alert_id: str):
+        """Return a single active alert by its ID or URL."""
+        feature = alert_cache.get(alert_id)
+        if feature is None:
+            ns.abort(404, f"Alert '{alert_id}' is not active.")
+        return cached_response(lambda: feature)
@@ -0,0 +1,460 @@
+import argparse
+import collections
+import gzip
+import json
+import logging
+import os
+import time
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import IO, Any, Iterable, Iterator, Optional
+
+import pytz
+from bson import ObjectId
+from pymongo import ASCENDING, MongoClient
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError
+
+from alert_index import as_utc
+from alerts import Alert
+from config import Config
+from dispatcher import get_dispatcher
+from generate import build_discord_embed, image_name, notify_discord_webhook
+from images import ImageRegistry
+from normalize import normalize_timestamps, parse_timestamp, process_description
+from records import create_indexes, expand_record, slim_record
+from renderer import RenderPool
+from routing import Router
+
+log = logging.getLogger("rich")
+
+# What happens to the webhooks of reprocessed alerts.
+NOTIFY_MODES = ["none", "file", "send"]
+
+
+def read_archive(path: str, after: Optional[list] = None) -> Iterator[tuple[list, Alert]]:
+    """Stream the alerts in a JSON lines archive.  Every line holds either a single NWS feature
+    or a whole FeatureCollection, such as a saved `/alerts` response.  Archives ending in `.gz`
+    are read through gzip.
+
+    Args:
+        path (str): The path to the archive.
+        after (Optional[list], optional): The position to resume after, as returned with an
+            earlier alert. Defaults to the start of the archive.
+
+    Yields:
+        tuple[list, Alert]: The position of the alert as the byte offset of its line and its
+            index in the line, and the alert with its description processed.
+    """
+    start, skip = after or (0, -1)
+    with (gzip.open if path.endswith(".gz") else open)(path, "rb") as f:
+        f.seek(start)
+        while True:
+            offset = f.tell()
+            line = f.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            try:
+                doc = json.loads(line)
+            except ValueError as e:
+                log.warning(f"Skipping undecodable archive line at byte {offset}: {e}")
+                continue
+            features = doc.get("features", []) if doc.get("type") == "FeatureCollection" else [doc]
+            for i, feature in enumerate(features):
+                if offset == start and i <= skip:
+                    continue
+                alert = Alert.from_feature(feature)
+                alert.properties.description = process_description(alert.properties.description)
+                yield [offset, i], alert
+
+
+def read_collection(coll: Collection, after: Optional[str] = None) -> Iterator[tuple[str, Alert]]:
+    """Stream the alerts stored in the database in the order they were inserted.
+
+    Args:
+        coll (Collection): The alerts collection.
+        after (Optional[str], optional): The position to resume after, as returned with an
+            earlier alert. Defaults to the first stored alert.
+
+    Yields:
+        tuple[str, Alert]: The position of the alert as its document ID, and the alert.
+    """
+    query = {"_id": {"$gt": ObjectId(after)}} if after else {}
+    for doc in coll.find(query).sort("_id", ASCENDING).batch_size(500):
+        yield str(doc["_id"]), expand_record(doc)
+
+
+class Checkpoint:
+    """Where a backfill left off, saved to a JSON file so an interrupted run picks up from there.
+
+    Attributes:
+        path (Path): The path to the checkpoint file.
+        source (str): The archive or collection being backfilled.
+    """
+    path: Path
+    source: str
+
+    def __init__(self, path: str, source: str):
+        """Create a Checkpoint object.
+
+        Args:
+            path (str): The path to the checkpoint file.
+            source (str): The archive or collection being backfilled.
+        """
+        self.path = Path(path)
+        self.source = source
+
+    def load(self) -> Optional[Any]:
+        """Return the position the last run left off at.
+
+        Raises:
+            ValueError: The checkpoint file belongs to a backfill of a different source.
+
+        Returns:
+            Optional[Any]: The position to resume after, or None to start from the beginning.
+        """
+        if not self.path.exists():
+            return None
+        state = json.loads(self.path.read_text())
+        if state["source"] != self.source:
+            raise ValueError(f'"{self.path}" is the checkpoint of a backfill of "{state["source"]}".')
+        return state["position"]
+
+    def save(self, position: Optional[Any], stats: dict[str, int]) -> None:
+        """Record the position every alert up to has been handled.
+
+        Args:
+            position (Optional[Any]): The position to resume after.
+            stats (dict[str, int]): The counts of how alerts were handled so far.
+        """
+        temp = self.path.with_suffix(".tmp")
+        temp.write_text(json.dumps({
+            "source": self.source,
+            "position": position,
+            "saved": datetime.now(pytz.UTC).isoformat(),
+            "stats": stats,
+        }))
+        temp.replace(self.path)
+
+
+class _RenderJob:
+    """An image being rendered, along with every alert waiting on it."""
+    __slots__ = ("name", "future", "alerts", "before")
+
+    def __init__(self, name: str, future: Future, alert: Alert, before: Optional[Any]):
+        self.name = name
+        self.future = future
+        self.alerts = [alert]
+        # The position of the alert read before this job's first alert.
+        self.before = before
+
+
+class Backfill:
+    """Reprocesses archived or stored alerts in bulk: every alert is routed, stored, rendered,
+    and optionally sent out again.  Maps are rendered on every core through a `RenderPool`
+    while the next alerts are read, and alerts that share a map only render it once.
+
+    Results are handled in the order alerts were read, so the checkpoint always points at an
+    alert every earlier alert has been handled before.  Alerts that were in flight when a run
+    stopped are handled again when it resumes.
+
+    Attributes:
+        router (Router): Decides which destinations each alert is sent to.
+        render_pool (RenderPool): The render worker processes.
+        registry (Optional[ImageRegistry]): The registry rendered images are recorded in.
+        coll (Optional[Collection]): The collection alerts are stored in, None to not store them.
+        notify (str): "none" to not send webhooks, "file" to write them to `sink`, or "send".
+        sink (Optional[IO[str]]): The file webhooks are written to as JSON lines.
+        destinations (Optional[set[str]]): Only send to these destinations, None for all of them.
+        force (bool): Render every map again even if it was already saved.
+        since (Optional[datetime]): Skip alerts sent before this time.
+        until (Optional[datetime]): Skip alerts sent after this time.
+        stats (collections.Counter): How many alerts were handled each way.
+    """
+    router: Router
+    render_pool: RenderPool
+    registry: Optional[ImageRegistry]
+    coll: Optional[Collection]
+    notify: str
+    sink: Optional[IO[str]]
+    destinations: Optional[set[str]]
+    force: bool
+    since: Optional[datetime]
+    until: Optional[datetime]
+    stats: collections.Counter
+
+    def __init__(self, router: Router, render_pool: RenderPool, registry: Optional[ImageRegistry] = None,
+                 coll: Optional[Collection] = None, notify: str = "none", sink: Optional[IO[str]] = None,
+                 destinations: Optional[Iterable[str]] = None, force: bool = False,
+                 since: Optional[datetime] = None, until: Optional[datetime] = None, batch_size: int = 500):
+        """Create a Backfill object.
+
+        Args:
+            router (Router): Decides which destinations each alert is sent to.
+            render_pool (RenderPool): The render worker processes.
+            registry (Optional[ImageRegistry], optional): The registry to record rendered images
+                in. Defaults to None.
+            coll (Optional[Collection], optional): The collection to store alerts in. Defaults to
+                None, which leaves the database alone.
+            notify (str, optional): "none" to not send webhooks, "file" to write them to `sink`,
+                or "send" to send them out. Defaults to "none".
+            sink (Optional[IO[str]], optional): The file to write webhooks to. Defaults to None.
+            destinations (Optional[Iterable[str]], optional): Only send to these destinations.
+                Defaults to every destination.
+            force (bool, optional): Render every map again even if it was already saved. Defaults to False.
+            since (Optional[datetime], optional): Skip alerts sent before this time. Defaults to None.
+            until (Optional[datetime], optional): Skip alerts sent after this time. Defaults to None.
+            batch_size (int, optional): The number of alerts stored with each insert. Defaults to 500.
+
+        Raises:
+            ValueError: The notify mode is unknown, or "file" was given without a sink.
+        """
+        if notify not in NOTIFY_MODES:
+            raise ValueError(f'Unknown notify mode "{notify}", expected one of {", ".join(NOTIFY_MODES)}.')
+        if notify == "file" and sink is None:
+            raise ValueError('The "file" notify mode needs a sink to write to.')
+        self.router = router
+        self.render_pool = render_pool
+        self.registry = registry
+        self.coll = coll
+        self.notify = notify
+        self.sink = sink
+        self.destinations = set(destinations) if destinations else None
+        self.force = force
+        self.since = since
+        self.until = until
+        self.stats = collections.Counter()
+        self._batch_size = batch_size
+        self._records: list[Alert] = list()
+        self._jobs: collections.deque[_RenderJob] = collections.deque()
+        self._rendering: dict[str, _RenderJob] = dict()
+        self._rendered: dict[str, Optional[str]] = dict()
+        self._last: Optional[Any] = None
+        self._renders = 0
+
+    @property
+    def position(self) -> Optional[Any]:
+        """Return the position every alert up to has been handled.
+
+        Returns:
+            Optional[Any]: The position to resume after, or None if no alerts have been handled.
+        """
+        return self._jobs[0].before if self._jobs else self._last
+
+    def run(self, alerts: Iterable[tuple[Any, Alert]], checkpoint: Optional[Checkpoint] = None,
+            interval: float = 10.) -> collections.Counter:
+        """Reprocess a stream of alerts, reporting the throughput and saving the checkpoint every
+        `interval` seconds.  An interrupted run still stores the alerts it read and saves the
+        checkpoint before stopping.
+
+        Args:
+            alerts (Iterable[tuple[Any, Alert]]): Pairs of positions and alerts from `read_archive`
+                or `read_collection`.
+            checkpoint (Optional[Checkpoint], optional): Where to save the progress. Defaults to None.
+            interval (float, optional): Seconds between progress reports. Defaults to 10.0.
+
+        Returns:
+            collections.Counter: How many alerts were handled each way.
+        """
+        start = time.monotonic()
+        next_report = start + interval
+        finished = False
+        try:
+            for position, alert in alerts:
+                self._handle(alert)
+                self._last = position
+                while self._jobs and self._jobs[0].future.done():
+                    self._finish_oldest()
+                if time.monotonic() >= next_report:
+                    self._flush()
+                    if checkpoint is not None:
+                        checkpoint.save(self.position, dict(self.stats))
+                    self._report(time.monotonic() - start)
+                    next_report = time.monotonic() + interval
+            while self._jobs:
+                self._finish_oldest()
+            finished = True
+        finally:
+            self._flush()
+            if checkpoint is not None:
+                checkpoint.save(self.position, dict(self.stats))
+            if not finished:
+                log.warning(f"Stopped with {len(self._jobs)} maps in flight, they are redone on the next run.")
+            self._report(time.monotonic() - start)
+        return self.stats
+
+    def _handle(self, alert: Alert) -> None:
+        self.stats["read"] += 1
+        if not normalize_timestamps(alert.properties):
+            self.stats["invalid"] += 1
+            return
+        sent = as_utc(alert.properties.sent)
+        if (self.since and sent < self.since) or (self.until and sent > self.until):
+            self.stats["skipped"] += 1
+            return
+
+        alert.destinations = self.router.route(alert)
+        if self.coll is not None and (alert.destinations or Config.STORE_FILTERED_ALERTS):
+            self._store(alert)
+        if self.destinations is not None:
+            alert.destinations = [d for d in alert.destinations if d in self.destinations]
+        if not alert.destinations:
+            self.stats["filtered"] += 1
+            return
+
+        name = image_name(alert)
+        if name in self._rendered:
+            self._notify(alert, self._rendered[name])
+        elif name in self._rendering:
+            self._rendering[name].alerts.append(alert)
+        else:
+            if self.force:
+                (Path(Config.IMAGE_SAVE_PATH) / name).unlink(missing_ok=True)
+            # Waiting on the oldest map first keeps a stuck render from blocking the pool forever.
+            while len(self._jobs) >= self.render_pool.max_pending:
+                self._finish_oldest()
+            job = _RenderJob(name, self.render_pool.submit(alert), alert, self._last)
+            self._jobs.append(job)
+            self._rendering[name] = job
+
+    def _finish_oldest(self) -> None:
+        # The job stays queued until its alerts are handled, so an interrupted run redoes it.
+        job = self._jobs[0]
+        image = self.render_pool.result(job.future)
+        self._rendered[job.name] = image
+        self._renders += 1
+        for alert in job.alerts:
+            self._notify(alert, image)
+        del self._rendering[job.name]
+        self._jobs.popleft()
+
+    def _notify(self, alert: Alert, image: Optional[str]) -> None:
+        if image is None:
+            log.warning(f'Unable to generate image for "{alert.properties.event}": {alert.id}')
+            self.stats["failed"] += 1
+            return
+        self.stats["rendered"] += 1
+        if self.registry is not None:
+            self.registry.register(image, alert.id, alert.properties.expires)
+        for name in alert.destinations:
+            destination = self.router.get(name)
+            if self.notify == "send":
+                notify_discord_webhook(alert, image=image, webhook_url=destination.webhook,
+                                       template=destination.template, colors=destination.colors)
+            elif self.notify == "file":
+                payload = build_discord_embed(alert, image=image, template=destination.template,
+                                              colors=destination.colors)
+                self.sink.write(json.dumps({"destination": name, "id": alert.id, "payload": payload}) + "\n")
+            self.stats["notified"] += 1
+
+    def _store(self, alert: Alert) -> None:
+        # The collection's TTL index would remove expired alerts right away.
+        if as_utc(alert.properties.expires) < datetime.now(pytz.UTC):
+            self.stats["expired"] += 1
+            return
+        self._records.append(alert)
+        if len(self._records) >= self._batch_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        records, self._records = self._records, list()
+        if self.sink is not None:
+            self.sink.flush()
+        if not records:
+            return
+        failed = 0
+        try:
+            self.coll.insert_many([slim_record(f) for f in records], ordered=False)
+        except BulkWriteError as e:
+            for error in e.details["writeErrors"]:
+                failed += 1
+                if error["code"] == 11000:
+                    self.stats["duplicate"] += 1
+                else:
+                    log.warning(f"Could not store record '{records[error['index']].id}': {error['errmsg']}")
+        self.stats["stored"] += len(records) - failed
+
+    def _report(self, elapsed: float) -> None:
+        elapsed = max(elapsed, 1e-9)
+        log.info(
+            f"{self.stats['read']} alerts read ({self.stats['read'] / elapsed:.1f}/s), "
+            f"{self._renders} maps ({self._renders / elapsed:.1f}/s), "
+            f"{self.stats['notified']} notifications, {self.stats['stored']} stored, "
+            f"{self.stats['filtered']} filtered, {self.stats['failed']} failed in {elapsed:.0f}s"
+        )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s', level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Reprocess archived or stored alerts in bulk.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--archive", help="A JSON lines archive of NWS features or FeatureCollections, optionally gzipped.")
+    source.add_argument("--stored", action="store_true", help="Reprocess the alerts already in the database.")
+    parser.add_argument("--notify", choices=NOTIFY_MODES, default="none",
+                        help="Don't send webhooks, write them to --sink, or send them out (default: none).")
+    parser.add_argument("--sink", default="backfill_webhooks.jsonl",
+                        help="The file webhooks are appended to with --notify file.")
+    parser.add_argument("--destination", action="append",
+                        help="Only send to this destination, can be given more than once.")
+    parser.add_argument("--no-store", action="store_true", help="Don't store archived alerts in the database.")
+    parser.add_argument("--force", action="store_true", help="Render maps again even if they were already saved.")
+    parser.add_argument("--since", type=lambda v: as_utc(parse_timestamp(v)), help="Skip alerts sent before this ISO-8601 time.")
+    parser.add_argument("--until", type=lambda v: as_utc(parse_timestamp(v)), help="Skip alerts sent after this ISO-8601 time.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Render worker processes (default: one per core).")
+    parser.add_argument("--checkpoint", default="backfill_checkpoint.json", help="The checkpoint file.")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start from the beginning.")
+    args = parser.parse_args()
+
+    db = MongoClient(Config.MONGO_URI)[Config.MONGO_ALERTS_DB]
+    coll = db["test"]
+    if args.archive:
+        name = f"archive:{Path(args.archive).resolve()}"
+    else:
+        name = f"collection:{Config.MONGO_ALERTS_DB}.test"
+    checkpoint = Checkpoint(args.checkpoint, name)
+    try:
+        after = None if args.restart else checkpoint.load()
+    except ValueError as e:
+        parser.error(f"{e} Pass --restart or another --checkpoint.")
+    if after is not None:
+        log.info(f'Resuming after {after} from "{args.checkpoint}".')
+
+    store = None
+    if args.archive and not args.no_store:
+        create_indexes(coll)
+        store = coll
+    registry = ImageRegistry(db["images"], Config.IMAGE_SAVE_PATH, timedelta(days=Config.IMAGE_RETENTION_DAYS),
+                             Config.IMAGE_THUMBNAIL_WIDTHS)
+    render_pool = RenderPool(workers=args.workers, timeout=Config.RENDER_TIMEOUT, max_pending=args.workers * 2)
+    sink = open(args.sink, "a") if args.notify == "file" else None
+
+    backfill = Backfill(
+        Router(Config.DESTINATIONS),
+        render_pool,
+        registry=registry,
+        coll=store,
+        notify=args.notify,
+        sink=sink,
+        destinations=args.destination,
+        force=args.force,
+        since=args.since,
+        until=args.until,
+    )
+    alerts = read_archive(args.archive, after) if args.archive else read_collection(coll, after)
+    interrupted = False
+    try:
+        backfill.run(alerts, checkpoint)
+    except KeyboardInterrupt:
+        interrupted = True
+        log.warning(f'Interrupted, rerun the same command to resume from "{args.checkpoint}".')
+    finally:
+        render_pool.shutdown(wait=not interrupted)
+        if sink is not None:
+            sink.close()
+        if args.notify == "send":
+            get_dispatcher().close()
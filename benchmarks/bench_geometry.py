@@ -0,0 +1,109 @@
+"""Micro-benchmarks for working out the map bounds of alerts, comparing the nested coordinate
+loops the renderer used to run per alert with the vectorized `geometry` kernel.
+
+Run it from the directory holding the county data in `data/`.
+
+Usage:
+    python benchmarks/bench_geometry.py [--features 500] [--vertices 2000] [--parts 3] [--number 5]
+"""
+import argparse
+import json
+import random
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np  # noqa: E402
+
+import geometry  # noqa: E402
+from alerts import decode_features  # noqa: E402
+from benchmarks.payloads import synthetic_payload  # noqa: E402
+from counties import county_store  # noqa: E402
+
+
+def multipolygon_payload(features: int, vertices: int, parts: int) -> dict:
+    """Build a synthetic outbreak where every warning is a MultiPolygon of `parts` polygons.
+
+    Args:
+        features (int): The number of alerts.
+        vertices (int): The number of vertices in each polygon.
+        parts (int): The number of polygons in each warning.
+
+    Returns:
+        dict: The FeatureCollection.
+    """
+    counties = list(county_store.load())
+    payload = synthetic_payload(features, vertices, counties=counties)
+    rng = random.Random(1)
+    for feature in payload["features"]:
+        if feature["geometry"] is None:
+            continue
+        ring = feature["geometry"]["coordinates"][0]
+        polygons = [[ring]]
+        for _ in range(parts - 1):
+            dx, dy = rng.uniform(-1, 1), rng.uniform(-1, 1)
+            polygons.append([[[x + dx, y + dy] for x, y in ring]])
+        feature["geometry"] = {"type": "MultiPolygon", "coordinates": polygons}
+    return payload
+
+
+def loop_bounds(feature: dict) -> tuple[float, float, float, float]:
+    """The bounds of a GeoJSON polygon alert the way the renderer used to find them, by
+    appending every coordinate to lists.
+
+    Args:
+        feature (dict): The alert as a GeoJSON feature.
+
+    Returns:
+        tuple[float, float, float, float]: The west, south, east, and north bounds.
+    """
+    lat, lon = list(), list()
+    geometry_ = feature["geometry"]
+    polygons = [geometry_["coordinates"]] if geometry_["type"] == "Polygon" else geometry_["coordinates"]
+    for polygon in polygons:
+        for coordinates in polygon:
+            for coordinate in coordinates:
+                lat.append(coordinate[1])
+                lon.append(coordinate[0])
+    return min(lon), min(lat), max(lon), max(lat)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the map bounds of alerts.")
+    parser.add_argument("--features", type=int, default=500, help="Alerts in the synthetic outbreak.")
+    parser.add_argument("--vertices", type=int, default=2000, help="Vertices in each polygon.")
+    parser.add_argument("--parts", type=int, default=3, help="Polygons in each warning.")
+    parser.add_argument("--number", type=int, default=5, help="Runs per benchmark.")
+    args = parser.parse_args()
+
+    payload = multipolygon_payload(args.features, args.vertices, args.parts)
+    features = [f for f in payload["features"] if f["geometry"]]
+    alerts = list(decode_features(json.dumps(payload)))
+    polygons = [a for a in alerts if a.geometry]
+    print(f"{len(alerts)} alerts, {len(polygons)} with {args.parts} polygons of {args.vertices} vertices")
+
+    expected = np.array([loop_bounds(f) for f in features])
+    if not np.allclose(geometry.alert_bounds(polygons), expected):
+        raise SystemExit("The geometry kernel disagrees with the coordinate loops.")
+
+    def batch():
+        return geometry.mercator_extent(geometry.zoom(geometry.alert_bounds(alerts), .7), 16 / 9)
+
+    def per_alert():
+        return [geometry.mercator_extent(geometry.zoom(geometry.alert_bounds([a]), .7), 16 / 9) for a in alerts]
+
+    benchmarks = [
+        ("coordinate loops", lambda: [loop_bounds(f) for f in features], len(features)),
+        ("kernel per alert", per_alert, len(alerts)),
+        ("kernel batch", batch, len(alerts)),
+        ("shapes", lambda: [geometry.shapes(a) for a in polygons], len(polygons)),
+    ]
+    for name, func, count in benchmarks:
+        seconds = min(timeit.repeat(func, number=1, repeat=args.number))
+        print(f"{name:18} {seconds * 1000:9.2f} ms  {seconds / count * 1e6:9.1f} us/alert")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Micro-benchmarks for looking up active alerts by point and county.
+
+Run it from the directory holding the county data in `data/`.
+
+Usage:
+    python benchmarks/bench_locator.py [--features 5000] [--lookups 10000]
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np  # noqa: E402
+
+from alert_locator import AlertLocator  # noqa: E402
+from alerts import decode_features  # noqa: E402
+from benchmarks.payloads import synthetic_payload  # noqa: E402
+from counties import county_store  # noqa: E402
+from normalize import parse_timestamp  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark active alert lookups.")
+    parser.add_argument("--features", type=int, default=5000, help="Active alerts to index.")
+    parser.add_argument("--lookups", type=int, default=10000, help="Lookups per benchmark.")
+    args = parser.parse_args()
+
+    counties = list(county_store.load())
+    payload = synthetic_payload(args.features, counties=counties)
+    alerts = list(decode_features(json.dumps(payload)))
+    for alert in alerts:
+        alert.properties.expires = parse_timestamp(alert.properties.expires)
+
+    locator = AlertLocator(county_store)
+    start = time.perf_counter()
+    locator.update(alerts)
+    elapsed = time.perf_counter() - start
+    print(f"{len(alerts)} alerts indexed in {elapsed * 1000:.1f} ms ({elapsed / len(alerts) * 1e6:.1f} us/alert)")
+
+    rng = random.Random(1)
+    points = [(rng.uniform(30, 45), rng.uniform(-103, -82)) for _ in range(args.lookups)]
+    report("at", [timed(locator.at, lat, lon) for lat, lon in points])
+    report("in_county", [timed(locator.in_county, rng.choice(counties)) for _ in range(args.lookups)])
+
+    start = time.perf_counter()
+    expired = locator.expire(datetime.now(timezone.utc) + timedelta(hours=3))
+    print(f"{len(expired)} alerts expired in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+def timed(func, *args) -> float:
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def report(name: str, seconds: list[float]) -> None:
+    p50, p95, p99 = np.percentile(seconds, [50, 95, 99]) * 1e6
+    print(f"{name:10} p50 {p50:8.1f} us  p95 {p95:8.1f} us  p99 {p99:8.1f} us")
+
+
+if __name__ == "__main__":
+    main()
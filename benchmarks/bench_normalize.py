@@ -0,0 +1,62 @@
+"""Micro-benchmarks for parsing the timestamps of NWS alerts.
+
+Usage:
+    python benchmarks/bench_normalize.py [--payload recorded_alerts.json] [--number 20]
+"""
+import argparse
+import copy
+import sys
+import time
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dateutil.parser import parse  # noqa: E402
+
+from benchmarks.payloads import load_payload, synthetic_payload  # noqa: E402
+from normalize import TIMESTAMP_FIELDS, normalize_timestamps, parse_timestamp  # noqa: E402
+
+
+def timestamps(payload: dict) -> list[str]:
+    return [
+        f["properties"][field]
+        for f in payload["features"]
+        for field in TIMESTAMP_FIELDS
+        if f["properties"].get(field)
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark NWS timestamp parsing.")
+    parser.add_argument("--payload", help="A recorded /alerts/active response (default: synthetic).")
+    parser.add_argument("--features", type=int, default=500, help="Synthetic alerts to generate.")
+    parser.add_argument("--number", type=int, default=20, help="Runs per benchmark.")
+    args = parser.parse_args()
+
+    payload = load_payload(args.payload) if args.payload else synthetic_payload(args.features)
+    values = timestamps(payload)
+    properties = [f["properties"] for f in payload["features"]]
+    print(f"{len(properties)} alerts, {len(values)} timestamps, {args.number} runs each")
+
+    report("dateutil.parse", timeit.timeit(lambda: [parse(v) for v in values], number=args.number), args, values)
+    report("parse_timestamp", timeit.timeit(lambda: [parse_timestamp(v) for v in values], number=args.number), args, values)
+
+    # Normalizing works in place, so every run gets a fresh copy of the properties.
+    total = 0.
+    for _ in range(args.number):
+        fresh = copy.deepcopy(properties)
+        start = time.perf_counter()
+        for p in fresh:
+            normalize_timestamps(p)
+        total += time.perf_counter() - start
+    report("normalize_timestamps", total, args, values)
+
+
+def report(name: str, total: float, args: argparse.Namespace, values: list[str]) -> None:
+    seconds = total / args.number
+    print(f"{name:22} {seconds * 1000:9.3f} ms/poll  {seconds / len(values) * 1e6:7.2f} us/timestamp")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""Replay `/alerts/active` snapshots through the whole updater and report the latency of every
+stage.  The NWS API, MapBox tiles, MongoDB, and the Discord webhook are replaced with local
+stand-ins, so the numbers only reflect the updater's own work.  Maps are rendered in this
+process since spawned render workers would not see the stand-in configuration.
+
+Run it from the directory holding `config.py`, `templates/`, and the county data in `data/`.
+
+Usage:
+    python benchmarks/bench_pipeline.py [--payload snapshot.json ...] [--features 500] [--rounds 1]
+                                        [--compare benchmarks/results/<earlier run>.json]
+"""
+import argparse
+import json
+import logging
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np  # noqa: E402
+import xyzservices  # noqa: E402
+
+from benchmarks.payloads import load_payload, synthetic_payload  # noqa: E402
+from benchmarks.standins import MemoryDatabase, NWSServer, TileServer, WebhookServer  # noqa: E402
+from config import Config  # noqa: E402
+
+REPO_PATH = Path(__file__).resolve().parent.parent
+RESULTS_PATH = Path(__file__).resolve().parent / "results"
+
+# Stages in the order an alert passes through them.
+STAGES = [
+    "get_alerts", "poll", "fetch_alerts", "route_alert", "add_records", "generate_image",
+    "notify_discord_webhook", "webhook_delivery",
+]
+
+
+class StageTimer:
+    """Collects the latency of every call made to each stage.
+
+    Attributes:
+        samples (dict[str, list[tuple[float, int]]]): The seconds taken and items handled by each call.
+    """
+    samples: dict[str, list[tuple[float, int]]]
+
+    def __init__(self):
+        """Create a StageTimer object."""
+        self.samples = dict()
+
+    def record(self, stage: str, seconds: float, items: int = 1) -> None:
+        """Record a single call to a stage.
+
+        Args:
+            stage (str): The stage name.
+            seconds (float): How long the call took.
+            items (int, optional): The number of alerts the call handled. Defaults to 1.
+        """
+        self.samples.setdefault(stage, list()).append((seconds, items))
+
+    def wrap(self, stage: str, func: Callable, items: Optional[Callable[..., int]] = None) -> Callable:
+        """Wrap a function so every call to it is recorded.
+
+        Args:
+            stage (str): The stage name.
+            func (Callable): The function to time.
+            items (Optional[Callable[..., int]], optional): Returns the number of alerts a call
+                handles from its arguments. Defaults to one alert per call.
+
+        Returns:
+            Callable: The timed function.
+        """
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start, items(*args, **kwargs) if items else 1)
+        return timed
+
+    def summary(self) -> dict[str, dict]:
+        """Return the throughput and latency percentiles of every stage.
+
+        Returns:
+            dict[str, dict]: The statistics keyed by stage.
+        """
+        results = dict()
+        for stage in sorted(self.samples, key=lambda s: STAGES.index(s) if s in STAGES else len(STAGES)):
+            seconds = np.array([s for s, _ in self.samples[stage]])
+            items = sum(i for _, i in self.samples[stage])
+            p50, p95, p99 = np.percentile(seconds, [50, 95, 99]) * 1000
+            results[stage] = {
+                "calls": len(seconds),
+                "items": items,
+                "total_s": float(seconds.sum()),
+                "per_second": items / seconds.sum() if seconds.sum() else float("inf"),
+                "mean_ms": float(seconds.mean() * 1000),
+                "p50_ms": float(p50),
+                "p95_ms": float(p95),
+                "p99_ms": float(p99),
+            }
+        return results
+
+
+class InlineRenderPool:
+    """Stands in for `RenderPool` by rendering in the calling thread."""
+
+    def __init__(self, render: Callable):
+        """Create an InlineRenderPool object.
+
+        Args:
+            render (Callable): Renders an alert and returns the image name.
+        """
+        self.render = render
+
+    def submit(self, alert) -> Future:
+        future = Future()
+        try:
+            future.set_result(self.render(alert))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def result(self, future: Future) -> Optional[str]:
+        try:
+            return future.result()
+        except Exception:
+            logging.getLogger("rich").exception("Render failed.")
+            return None
+
+
+def git_commit() -> str:
+    try:
+        r = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_PATH,
+                           capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return r.stdout.strip()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay NWS alert snapshots through the updater.")
+    parser.add_argument("--payload", action="append", default=list(),
+                        help="A recorded /alerts/active response, replayed in the order given.")
+    parser.add_argument("--features", type=int, default=500, help="Alerts in the synthetic outbreak (0 to skip it).")
+    parser.add_argument("--vertices", type=int, default=40, help="Vertices in each synthetic polygon.")
+    parser.add_argument("--rounds", type=int, default=1, help="Times to replay every snapshot.")
+    parser.add_argument("--destinations", type=int, default=1, help="Webhooks every alert is sent to.")
+    parser.add_argument("--no-render", action="store_true", help="Skip drawing the maps.")
+    parser.add_argument("--mongo-latency", type=float, default=0., help="Milliseconds added to each database call.")
+    parser.add_argument("--output", help="Where to save the results (default: benchmarks/results/).")
+    parser.add_argument("--compare", help="Earlier results to compare against.")
+    args = parser.parse_args()
+
+    work = Path(tempfile.mkdtemp(prefix="nws-bench-"))
+    tiles, webhook = TileServer(), WebhookServer()
+    Config.IMAGE_SAVE_PATH = str(work / "images")
+    Config.TILE_CACHE_PATH = str(work / "tiles")
+    Config.WEBHOOK_RETRY_PATH = str(work / "retry.db")
+    Config.MAPBOX_PROVIDER = xyzservices.TileProvider(name="standin", url=tiles.template, attribution="")
+    Config.DESTINATIONS = [
+        {"name": f"bench-{i}", "webhook": f"{webhook.url}/webhook/{i}", "filter": Config.FILTER_RULES}
+        for i in range(args.destinations)
+    ]
+
+    # The updater sets up its clients from the configuration, so it has to come after it.
+    import update
+    update.setup()
+    from alert_index import AlertIndex
+    from counties import county_lines, county_store
+    from dispatcher import get_dispatcher
+    from generate import generate_image, image_name
+    from images import ImageRegistry
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("rich").setLevel(logging.WARNING)
+
+    counties = None
+    if not args.no_render:
+        counties = list(county_store.load())
+        county_lines.load()
+
+    snapshots = [json.dumps(load_payload(p)).encode() for p in args.payload]
+    if args.features:
+        snapshots.append(json.dumps(synthetic_payload(args.features, args.vertices, counties=counties)).encode())
+    if not snapshots:
+        parser.error("Nothing to replay, pass --payload or --features.")
+    nws = NWSServer(snapshots)
+    sizes = [len(json.loads(s)["features"]) for s in snapshots]
+
+    timer = StageTimer()
+    sent: dict[str, float] = dict()
+
+    def notify(alert, image, webhook_url, **kwargs):
+        sent.setdefault(alert.id, time.perf_counter())
+        update_notify(alert, image=image, webhook_url=webhook_url, **kwargs)
+
+    update_notify = update.notify_discord_webhook
+    render = generate_image if not args.no_render else image_name
+    update.poller.url = f"{nws.url}/alerts/active"
+    update.poller.poll = timer.wrap("poll", update.poller.poll)
+    update.router.route = timer.wrap("route_alert", update.router.route)
+    update.add_records = timer.wrap("add_records", update.add_records, items=lambda features: len(features))
+    update.fetch_alerts = timer.wrap("fetch_alerts", update.fetch_alerts)
+    update.notify_discord_webhook = timer.wrap("notify_discord_webhook", notify)
+    update.render_pool = InlineRenderPool(timer.wrap("generate_image", render))
+
+    print(f"Replaying {len(snapshots)} snapshots ({', '.join(map(str, sizes))} alerts), {args.rounds} rounds")
+    for round_number in range(args.rounds):
+        # Every round starts from an empty database, but the tile cache stays warm.
+        shutil.rmtree(Config.IMAGE_SAVE_PATH, ignore_errors=True)
+        Path(Config.IMAGE_SAVE_PATH).mkdir(parents=True)
+        update.db = MemoryDatabase(args.mongo_latency / 1000)
+        update.alert_index = AlertIndex()
+        update.image_registry = ImageRegistry(update.db["images"], Config.IMAGE_SAVE_PATH,
+                                              timedelta(days=Config.IMAGE_RETENTION_DAYS))
+        update.poller.reset()
+        nws.rewind()
+        sent.clear()
+        webhook.received.clear()
+
+        for size in sizes:
+            start = time.perf_counter()
+            count = update.get_alerts()
+            timer.record("get_alerts", time.perf_counter() - start, size)
+            print(f"  round {round_number + 1}: {count} of {size} alerts sent out")
+
+        deadline = time.monotonic() + 60
+        while set(sent) - set(webhook.received) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        for alert_id, sent_at in sent.items():
+            if alert_id in webhook.received:
+                timer.record("webhook_delivery", webhook.received[alert_id] - sent_at)
+        if missing := len(set(sent) - set(webhook.received)):
+            print(f"  round {round_number + 1}: {missing} webhooks never arrived")
+
+    get_dispatcher().close(timeout=10)
+    for server in (nws, tiles, webhook):
+        server.close()
+    shutil.rmtree(work, ignore_errors=True)
+
+    stages = timer.summary()
+    results = {
+        "commit": git_commit(),
+        "created": datetime.now(timezone.utc).isoformat(),
+        "args": vars(args),
+        "snapshots": sizes,
+        "tile_requests": tiles.requests,
+        "webhook_posts": webhook.posts,
+        "stages": stages,
+    }
+    baseline = load_payload(args.compare) if args.compare else None
+    report(stages, baseline)
+
+    output = Path(args.output) if args.output else RESULTS_PATH / f"{datetime.now():%Y%m%d-%H%M%S}-{results['commit']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved results to {output}")
+
+
+def report(stages: dict[str, dict], baseline: Optional[dict] = None) -> None:
+    print(f"{'stage':24}{'calls':>7}{'items/s':>11}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for stage, s in stages.items():
+        line = f"{stage:24}{s['calls']:7d}{s['per_second']:11.1f}{s['p50_ms']:10.3f}{s['p95_ms']:10.3f}{s['p99_ms']:10.3f}"
+        if baseline and stage in baseline["stages"]:
+            before = baseline["stages"][stage]
+            changes = [
+                f"{k[:-3]} {(s[k] - before[k]) / before[k]:+.1%}"
+                for k in ("p50_ms", "p95_ms", "p99_ms") if before[k]
+            ]
+            line += f"   vs {baseline['commit']}: {', '.join(changes)}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
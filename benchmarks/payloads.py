@@ -0,0 +1,99 @@
+import json
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+EVENTS = [
+    "Tornado Warning", "Tornado Watch", "Severe Thunderstorm Warning", "Severe Thunderstorm Watch",
+    "Flash Flood Warning", "Winter Storm Warning", "Special Weather Statement", "Flood Advisory",
+]
+
+DESCRIPTION = (
+    "At 512 PM CDT, a severe thunderstorm capable of producing a tornado was located\n"
+    "near Example, moving northeast at 35 mph.\n\n"
+    "HAZARD...Tornado and quarter size hail.\n\n"
+    "SOURCE...Radar indicated rotation.\n\n"
+    "IMPACT...Flying debris will be dangerous to those caught without\n"
+    "shelter. Mobile homes will be damaged or destroyed."
+)
+
+
+def load_payload(path: str) -> dict:
+    """Load a recorded `/alerts/active` response.
+
+    Args:
+        path (str): The path to the recorded JSON response.
+
+    Returns:
+        dict: The FeatureCollection.
+    """
+    with open(path) as f:
+        return json.load(f)
+
+
+def synthetic_payload(features: int = 500, vertices: int = 40, seed: int = 0,
+                      now: Optional[datetime] = None, counties: Optional[list[str]] = None) -> dict:
+    """Build an `/alerts/active` response shaped like the NWS API during an outbreak.  About a
+    third of the alerts are county-based watches with no geometry.
+
+    Args:
+        features (int, optional): The number of alerts. Defaults to 500.
+        vertices (int, optional): The number of vertices in each warning polygon. Defaults to 40.
+        seed (int, optional): The random seed. Defaults to 0.
+        now (Optional[datetime], optional): The time the alerts were sent. Defaults to the current time.
+        counties (Optional[list[str]], optional): The FIPS codes to pick the alert counties from.
+            Defaults to random codes, which are not real counties.
+
+    Returns:
+        dict: The FeatureCollection.
+    """
+    rng = random.Random(seed)
+    now = now or datetime.now(timezone(timedelta(hours=-5)))
+    collection = {"type": "FeatureCollection", "features": list()}
+    for i in range(features):
+        alert_id = f"urn:oid:2.49.0.1.840.0.synthetic.{seed}.{i}"
+        event = rng.choice(EVENTS)
+        sent = now - timedelta(minutes=rng.randint(0, 120))
+        expires = sent + timedelta(hours=rng.randint(1, 6))
+        if counties:
+            same = [f"0{rng.choice(counties)}" for _ in range(rng.randint(1, 12))]
+        else:
+            same = [f"0{rng.randint(1, 56):02d}{rng.randint(1, 199):03d}" for _ in range(rng.randint(1, 12))]
+
+        geometry = None
+        if "Watch" not in event:
+            lat, lon = rng.uniform(30, 45), rng.uniform(-103, -82)
+            ring = [[lon + rng.uniform(-0.4, 0.4), lat + rng.uniform(-0.3, 0.3)] for _ in range(vertices)]
+            ring.append(ring[0])
+            geometry = {"type": "Polygon", "coordinates": [ring]}
+
+        collection["features"].append({
+            "id": f"https://api.weather.gov/alerts/{alert_id}",
+            "type": "Feature",
+            "geometry": geometry,
+            "properties": {
+                "@id": f"https://api.weather.gov/alerts/{alert_id}",
+                "id": alert_id,
+                "areaDesc": "; ".join(f"County {c}" for c in same),
+                "geocode": {"SAME": same, "UGC": [f"XXC{c[-3:]}" for c in same]},
+                "sent": sent.isoformat(),
+                "effective": sent.isoformat(),
+                "onset": sent.isoformat(),
+                "expires": expires.isoformat(),
+                "ends": expires.isoformat() if rng.random() < 0.5 else None,
+                "status": "Actual",
+                "messageType": rng.choice(["Alert", "Update"]),
+                "category": "Met",
+                "severity": rng.choice(["Extreme", "Severe"]),
+                "certainty": "Observed",
+                "urgency": "Immediate",
+                "event": event,
+                "senderName": "NWS Example",
+                "headline": f"{event} issued {sent:%B %d at %I:%M%p %Z} by NWS Example",
+                "description": DESCRIPTION,
+                "instruction": "TAKE COVER NOW!" if rng.random() < 0.7 else None,
+                "response": "Shelter",
+                "parameters": {"tornadoDetection": ["RADAR INDICATED"]} if "Tornado" in event else {},
+            },
+        })
+    return collection
@@ -0,0 +1,265 @@
+"""Local stand-ins for the services the updater talks to, so the pipeline can be benchmarked
+without the NWS API, MapBox, MongoDB, or Discord.
+"""
+import hashlib
+import io
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Optional
+
+from PIL import Image
+from pymongo.errors import BulkWriteError
+
+
+class StandInServer:
+    """A local HTTP server running on a background thread.
+
+    Attributes:
+        url (str): The base URL of the server.
+    """
+    url: str
+
+    def __init__(self, handler: type[BaseHTTPRequestHandler]):
+        """Create and start a StandInServer object.
+
+        Args:
+            handler (type[BaseHTTPRequestHandler]): The request handler class.
+        """
+        handler.server_state = self
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_port}"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self) -> None:
+        """Stop the server."""
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    server_state: StandInServer
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def _reply(self, status: int, body: bytes = b"", headers: Optional[dict] = None) -> None:
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class NWSServer(StandInServer):
+    """Serves recorded `/alerts/active` snapshots, moving to the next snapshot on every poll.
+    Conditional requests are answered with a 304 like the real API.
+
+    Attributes:
+        snapshots (list[bytes]): The response bodies, in the order they are served.
+    """
+    snapshots: list[bytes]
+
+    def __init__(self, snapshots: list[bytes]):
+        """Create and start an NWSServer object.
+
+        Args:
+            snapshots (list[bytes]): The response bodies, in the order they are served.
+        """
+        self.snapshots = snapshots
+        self._etags = [f'"{hashlib.sha1(s).hexdigest()}"' for s in snapshots]
+        self._position = 0
+        super().__init__(_NWSHandler)
+
+    def rewind(self) -> None:
+        """Serve the first snapshot on the next poll."""
+        self._position = 0
+
+    def _next(self) -> tuple[bytes, str]:
+        i = min(self._position, len(self.snapshots) - 1)
+        self._position += 1
+        return self.snapshots[i], self._etags[i]
+
+
+class _NWSHandler(_QuietHandler):
+    def do_GET(self) -> None:
+        body, etag = self.server_state._next()
+        if self.headers.get("If-None-Match") == etag:
+            self._reply(304, headers={"ETag": etag})
+            return
+        self._reply(200, body, {"Content-Type": "application/geo+json", "ETag": etag})
+
+
+class TileServer(StandInServer):
+    """Serves the same blank PNG for every map tile.
+
+    Attributes:
+        requests (int): The number of tiles requested.
+    """
+    requests: int
+
+    def __init__(self, size: int = 256):
+        """Create and start a TileServer object.
+
+        Args:
+            size (int, optional): The width and height of the tiles in pixels. Defaults to 256.
+        """
+        buffer = io.BytesIO()
+        Image.new("RGB", (size, size), (200, 215, 230)).save(buffer, "PNG")
+        self.tile = buffer.getvalue()
+        self.requests = 0
+        super().__init__(_TileHandler)
+
+    @property
+    def template(self) -> str:
+        """Return the tile URL template for an `xyzservices.TileProvider`.
+
+        Returns:
+            str: The URL template.
+        """
+        return self.url + "/{z}/{x}/{y}.png"
+
+
+class _TileHandler(_QuietHandler):
+    def do_GET(self) -> None:
+        self.server_state.requests += 1
+        self._reply(200, self.server_state.tile, {"Content-Type": "image/png"})
+
+
+class WebhookServer(StandInServer):
+    """Accepts Discord webhook posts and records when each embed arrived, keyed by the alert
+    URL in the embed.
+
+    Attributes:
+        received (dict[str, float]): The `time.perf_counter` value each alert's embed arrived at.
+        posts (int): The number of webhook posts received.
+    """
+    received: dict[str, float]
+    posts: int
+
+    def __init__(self):
+        """Create and start a WebhookServer object."""
+        self.received = dict()
+        self.posts = 0
+        self._lock = threading.Lock()
+        super().__init__(_WebhookHandler)
+
+
+class _WebhookHandler(_QuietHandler):
+    def do_POST(self) -> None:
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        now = time.perf_counter()
+        state = self.server_state
+        with state._lock:
+            state.posts += 1
+            for embed in payload.get("embeds", []):
+                state.received.setdefault(embed.get("url"), now)
+        self._reply(204, headers={"X-RateLimit-Remaining": "5", "X-RateLimit-Reset-After": "0"})
+
+
+class MemoryDatabase:
+    """A stand-in for a Mongo database holding `MemoryCollection` objects.
+
+    Attributes:
+        latency (float): Seconds added to every collection call to stand in for the round trip.
+    """
+    latency: float
+
+    def __init__(self, latency: float = 0.):
+        """Create a MemoryDatabase object.
+
+        Args:
+            latency (float, optional): Seconds added to every collection call. Defaults to 0.0.
+        """
+        self.latency = latency
+        self._collections: dict[str, MemoryCollection] = dict()
+
+    def __getitem__(self, name: str) -> "MemoryCollection":
+        if name not in self._collections:
+            self._collections[name] = MemoryCollection(self.latency)
+        return self._collections[name]
+
+
+class MemoryCollection:
+    """A stand-in for the parts of a Mongo collection used by the updater.  Documents are
+    unique by `id` (or `_id`), and only top-level equality and `$lt`/`$in` queries are supported.
+    """
+
+    def __init__(self, latency: float = 0.):
+        """Create a MemoryCollection object.
+
+        Args:
+            latency (float, optional): Seconds added to every call. Defaults to 0.0.
+        """
+        self.latency = latency
+        self.docs: dict[str, dict] = dict()
+        self._lock = threading.Lock()
+
+    def _wait(self) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+
+    def create_index(self, *args, **kwargs) -> None:
+        self._wait()
+
+    def insert_many(self, documents: list[dict], ordered: bool = True) -> None:
+        self._wait()
+        errors = list()
+        with self._lock:
+            for i, doc in enumerate(documents):
+                key = doc.get("_id", doc.get("id"))
+                if key in self.docs:
+                    errors.append({"index": i, "code": 11000, "errmsg": f"duplicate key: {key}"})
+                    if ordered:
+                        break
+                    continue
+                self.docs[key] = doc
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+    def find(self, query: Optional[dict] = None, projection: Optional[dict] = None, hint=None) -> list[dict]:
+        self._wait()
+        with self._lock:
+            return [doc for doc in self.docs.values() if _matches(doc, query or {})]
+
+    def update_one(self, query: dict, update: dict, upsert: bool = False) -> None:
+        self._wait()
+        with self._lock:
+            key = query["_id"]
+            doc = self.docs.get(key)
+            if doc is None:
+                if not upsert:
+                    return
+                doc = self.docs[key] = {"_id": key}
+            for field, values in update.get("$addToSet", {}).items():
+                if values not in doc.setdefault(field, []):
+                    doc[field].append(values)
+            for field, value in update.get("$max", {}).items():
+                doc[field] = max(doc.get(field, value), value)
+
+    def delete_many(self, query: dict) -> SimpleNamespace:
+        self._wait()
+        with self._lock:
+            keys = [k for k, doc in self.docs.items() if _matches(doc, query)]
+            for k in keys:
+                del self.docs[k]
+        return SimpleNamespace(deleted_count=len(keys))
+
+
+def _matches(doc: dict, query: dict) -> bool:
+    for path, condition in query.items():
+        value = doc
+        for part in path.split("."):
+            value = value.get(part) if isinstance(value, dict) else None
+        if isinstance(condition, dict):
+            if "$lt" in condition and not (value is not None and value < condition["$lt"]):
+                return False
+            if "$in" in condition and value not in condition["$in"]:
+                return False
+        elif value != condition:
+            return False
+    return True
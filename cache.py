@@ -0,0 +1,239 @@
+import json
+import logging
+from datetime import datetime
+from typing import Iterable, Optional
+
+import redis
+
+from alert_index import as_utc
+from alerts import Alert
+
+log = logging.getLogger("rich")
+
+
+class AlertCache:
+    """The active alerts kept in Redis for the read API.  The updater writes every alert it
+    stores and removes them as they expire, the API only reads.  Every change bumps a version
+    number, so the API can answer conditional requests without reading any alerts.
+
+    Keys, all under `prefix`:
+        version: Incremented on every change.
+        alert:<id>: The alert as GeoJSON, keyed by the alert's `properties.id`.
+        expires: The alert IDs scored by their expiration timestamp.
+        event:<event>: The IDs of the alerts for each event, lowercase.
+        area:<code>: The IDs of the alerts for each UGC code, SAME code, and state.
+        response:<etag>: API responses, gzip-compressed.
+
+    Attributes:
+        client (redis.Redis): The Redis client.
+        prefix (str): The prefix of every key.
+        response_ttl (int): How long API responses are cached in seconds.
+    """
+    client: redis.Redis
+    prefix: str
+    response_ttl: int
+
+    def __init__(self, client: redis.Redis, prefix: str = "nws:", response_ttl: int = 300):
+        """Create an AlertCache object.
+
+        Args:
+            client (redis.Redis): The Redis client.
+            prefix (str, optional): The prefix of every key. Defaults to "nws:".
+            response_ttl (int, optional): How long API responses are cached in seconds. Defaults to 300.
+        """
+        self.client = client
+        self.prefix = prefix
+        self.response_ttl = response_ttl
+
+    def _key(self, *parts: str) -> str:
+        return self.prefix + ":".join(parts)
+
+    def _index_keys(self, properties: dict) -> set[str]:
+        keys = {self._key("event", properties.get("event", "").lower())}
+        geocode = properties.get("geocode") or {}
+        for code in geocode.get("UGC", []):
+            keys.add(self._key("area", code.upper()))
+            keys.add(self._key("area", code[:2].upper()))
+        for code in geocode.get("SAME", []):
+            keys.add(self._key("area", code))
+        return keys
+
+    def add(self, alerts: Iterable[Alert]) -> int:
+        """Add alerts to the cache, replacing any with the same ID.
+
+        Args:
+            alerts (Iterable[Alert]): The alerts, with their timestamps already parsed.
+
+        Returns:
+            int: The number of alerts added.
+        """
+        pipe = self.client.pipeline(transaction=True)
+        count = 0
+        for alert in alerts:
+            self._write(pipe, alert)
+            count += 1
+        if count:
+            pipe.incr(self._key("version"))
+            pipe.execute()
+        return count
+
+    def _write(self, pipe: redis.client.Pipeline, alert: Alert) -> str:
+        feature = alert.to_dict()
+        alert_id = alert.properties.id
+        pipe.set(self._key("alert", alert_id), json.dumps(feature, default=json_default))
+        pipe.zadd(self._key("expires"), {alert_id: as_utc(alert.properties.expires).timestamp()})
+        for key in self._index_keys(feature["properties"]):
+            pipe.sadd(key, alert_id)
+        return alert_id
+
+    def expire(self, now: datetime) -> int:
+        """Remove every alert that expired before `now`.
+
+        Args:
+            now (datetime): The current time.
+
+        Returns:
+            int: The number of alerts removed.
+        """
+        expired = [i.decode() for i in self.client.zrangebyscore(self._key("expires"), "-inf", f"({now.timestamp()}")]
+        if not expired:
+            return 0
+
+        documents = self.client.mget([self._key("alert", i) for i in expired])
+        pipe = self.client.pipeline(transaction=True)
+        for alert_id, document in zip(expired, documents):
+            if document is not None:
+                for key in self._index_keys(json.loads(document)["properties"]):
+                    pipe.srem(key, alert_id)
+            pipe.delete(self._key("alert", alert_id))
+        pipe.zrem(self._key("expires"), *expired)
+        pipe.incr(self._key("version"))
+        pipe.execute()
+        return len(expired)
+
+    def rebuild(self, alerts: Iterable[Alert]) -> int:
+        """Replace everything in the cache with a new set of alerts.  The alerts are written over
+        the cached ones and the stale ones removed in a single transaction.
+
+        Args:
+            alerts (Iterable[Alert]): The active alerts.
+
+        Returns:
+            int: The number of alerts cached.
+        """
+        # Alerts added while `alerts` is read are kept, only the ones cached before can be stale.
+        cached = set(self.ids())
+        cached.update(k.decode()[len(self._key("alert", "")):]
+                      for k in self.client.scan_iter(match=self._key("alert", "*"), count=1000))
+        index_keys = list()
+        for kind in ("event", "area"):
+            index_keys += self.client.scan_iter(match=self._key(kind, "*"), count=1000)
+
+        # Written in a single transaction, so the API never sees a partial set of alerts.
+        pipe = self.client.pipeline(transaction=True)
+        active = {self._write(pipe, alert) for alert in alerts}
+        stale = list(cached - active)
+        for i in range(0, len(stale), 1000):
+            chunk = stale[i:i + 1000]
+            pipe.delete(*(self._key("alert", alert_id) for alert_id in chunk))
+            pipe.zrem(self._key("expires"), *chunk)
+            for key in index_keys:
+                pipe.srem(key, *chunk)
+        pipe.incr(self._key("version"))
+        pipe.execute()
+        return len(active)
+
+    def version(self) -> int:
+        """Return the version of the cached alerts.
+
+        Returns:
+            int: The version, which changes every time the alerts do.
+        """
+        return int(self.client.get(self._key("version")) or 0)
+
+    def get(self, alert_id: str) -> Optional[bytes]:
+        """Return a single alert.
+
+        Args:
+            alert_id (str): The alert ID, either the `properties.id` or the full alert URL.
+
+        Returns:
+            Optional[bytes]: The alert as GeoJSON, or None if it isn't active.
+        """
+        return self.client.get(self._key("alert", alert_id.rsplit("/", 1)[-1]))
+
+    def ids(self) -> list[str]:
+        """Return the IDs of the active alerts, ordered by expiration.
+
+        Returns:
+            list[str]: The `properties.id` of each alert.
+        """
+        return [i.decode() for i in self.client.zrange(self._key("expires"), 0, -1)]
+
+    def get_many(self, alert_ids: Iterable[str]) -> list[bytes]:
+        """Return several alerts.  Alerts that aren't active are skipped.
+
+        Args:
+            alert_ids (Iterable[str]): The `properties.id` of each alert.
+
+        Returns:
+            list[bytes]: Each alert as GeoJSON.
+        """
+        keys = [self._key("alert", i) for i in alert_ids]
+        if not keys:
+            return list()
+        return [i for i in self.client.mget(keys) if i is not None]
+
+    def features(self, event: Optional[str] = None, area: Optional[str] = None,
+                 alert_ids: Optional[Iterable[str]] = None) -> list[bytes]:
+        """Return the active alerts, ordered by expiration.
+
+        Args:
+            event (Optional[str], optional): Only return alerts for this event. Defaults to None.
+            area (Optional[str], optional): Only return alerts for this UGC code, SAME code, or
+                state. Defaults to None.
+            alert_ids (Optional[Iterable[str]], optional): Only return the alerts with these IDs.
+                Defaults to None.
+
+        Returns:
+            list[bytes]: Each alert as GeoJSON.
+        """
+        ids = self.client.zrange(self._key("expires"), 0, -1)
+        if alert_ids is not None:
+            wanted = {i.encode() for i in alert_ids}
+            ids = [i for i in ids if i in wanted]
+        filters = list()
+        if event:
+            filters.append(self._key("event", event.lower()))
+        if area:
+            filters.append(self._key("area", area.upper()))
+        if filters:
+            matches = self.client.sinter(filters)
+            ids = [i for i in ids if i in matches]
+        return self.get_many(i.decode() for i in ids)
+
+    def get_response(self, etag: str) -> Optional[bytes]:
+        """Return a cached API response.
+
+        Args:
+            etag (str): The ETag of the response.
+
+        Returns:
+            Optional[bytes]: The gzip-compressed response body, or None if it isn't cached.
+        """
+        return self.client.get(self._key("response", etag))
+
+    def put_response(self, etag: str, body: bytes) -> None:
+        """Cache an API response.
+
+        Args:
+            etag (str): The ETag of the response.
+            body (bytes): The gzip-compressed response body.
+        """
+        self.client.set(self._key("response", etag), body, ex=self.response_ttl)
+
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return as_utc(value).isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
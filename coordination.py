@@ -0,0 +1,342 @@
+import json
+import logging
+import os
+import socket
+import time
+from typing import Iterable, Optional
+
+import redis
+
+from alerts import Alert
+from cache import json_default
+from metrics import Counter, Gauge
+from normalize import normalize_timestamps
+
+log = logging.getLogger("rich")
+
+LEADER = Gauge("cluster_leader", "Whether this node holds the leader lock.")
+WORK_ITEMS = Counter("work_queue_items_total", "Alerts passed through the work queue by result.", ("result",))
+
+# Only renews the lock if this node still holds it.
+_RENEW_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("pexpire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Only releases the lock if this node still holds it.
+_RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+def node_name() -> str:
+    """Return a name for this updater process that is unique across hosts.
+
+    Returns:
+        str: The host name and process ID.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class LeaderLock:
+    """A leased lock that elects a single node to poll the NWS API and run the cleanup jobs.
+    The lock expires after `ttl` unless the leader keeps renewing it, so another node takes
+    over within `ttl` of the leader going away.
+
+    Attributes:
+        client (redis.Redis): The Redis client.
+        key (str): The key holding the name of the leader.
+        owner (str): The name of this node.
+        ttl (float): How long the lease lasts in seconds without being renewed.
+    """
+    client: redis.Redis
+    key: str
+    owner: str
+    ttl: float
+
+    def __init__(self, client: redis.Redis, key: str, owner: str, ttl: float = 30.):
+        """Create a LeaderLock object.
+
+        Args:
+            client (redis.Redis): The Redis client.
+            key (str): The key holding the name of the leader.
+            owner (str): The name of this node.
+            ttl (float, optional): How long the lease lasts in seconds without being renewed. Defaults to 30.0.
+        """
+        self.client = client
+        self.key = key
+        self.owner = owner
+        self.ttl = ttl
+        self._renew = client.register_script(_RENEW_SCRIPT)
+        self._release = client.register_script(_RELEASE_SCRIPT)
+        self._expires = 0.
+
+    def acquire(self) -> bool:
+        """Take the lock, or renew it if this node already holds it.
+
+        Returns:
+            bool: Whether this node is the leader.
+        """
+        ttl_ms = int(self.ttl * 1000)
+        start = time.monotonic()
+        try:
+            held = bool(self._renew(keys=[self.key], args=[self.owner, ttl_ms]))
+            if not held:
+                held = bool(self.client.set(self.key, self.owner, nx=True, px=ttl_ms))
+                if held:
+                    log.info(f'Took the leader lock as "{self.owner}".')
+        except redis.RedisError as e:
+            log.warning(f"Unable to reach Redis for the leader lock: {e}")
+            held = False
+        # Count the lease from before the request, the lock may have been set at any point during it.
+        self._expires = start + self.ttl if held else 0.
+        LEADER.set(int(held))
+        return held
+
+    @property
+    def is_leader(self) -> bool:
+        """Return whether this node held the lock at its last renewal and the lease is still running.
+
+        Returns:
+            bool: Whether this node is the leader.
+        """
+        return time.monotonic() < self._expires
+
+    def release(self) -> None:
+        """Give up the lock so another node can take over right away."""
+        try:
+            self._release(keys=[self.key], args=[self.owner])
+        except redis.RedisError as e:
+            log.warning(f"Unable to release the leader lock: {e}")
+        self._expires = 0.
+        LEADER.set(0)
+
+
+class WorkQueue:
+    """A Redis stream of new alerts waiting to be rendered and sent out.  The leader adds the
+    alerts it polls, and every node reads from the stream as part of one consumer group, so
+    each alert is handed to a single node.  Alerts left unacknowledged by a node that went
+    away are claimed by another node after `claim_idle` seconds.
+
+    Redelivery means an alert can be rendered twice, but `reserve` only lets one node send it
+    out at a time, and `complete` marks it as sent and acknowledges it in a single transaction
+    once it has been handed to the webhook dispatcher.  An alert reserved by a node that goes
+    away before completing it is sent out by whichever node claims it next.
+
+    Attributes:
+        client (redis.Redis): The Redis client.
+        stream (str): The stream key.
+        group (str): The consumer group every node reads with.
+        consumer (str): The name of this node in the consumer group.
+        claim_idle (float): Seconds before another node's unacknowledged alert is claimed.
+        max_length (int): The approximate maximum number of entries kept in the stream.
+        max_attempts (int): The number of times an alert is handed out before `release` gives up on it.
+    """
+    client: redis.Redis
+    stream: str
+    group: str
+    consumer: str
+    claim_idle: float
+    max_length: int
+    max_attempts: int
+
+    def __init__(self, client: redis.Redis, stream: str, consumer: str, group: str = "workers",
+                 claim_idle: float = 120., max_length: int = 10000, max_attempts: int = 3):
+        """Create a WorkQueue object, creating the stream and consumer group if needed.
+
+        Args:
+            client (redis.Redis): The Redis client.
+            stream (str): The stream key.
+            consumer (str): The name of this node in the consumer group.
+            group (str, optional): The consumer group every node reads with. Defaults to "workers".
+            claim_idle (float, optional): Seconds before another node's unacknowledged alert is
+                claimed. Defaults to 120.0.
+            max_length (int, optional): The approximate maximum number of entries kept in the
+                stream. Defaults to 10000.
+            max_attempts (int, optional): The number of times an alert is handed out before
+                `release` gives up on it. Defaults to 3.
+        """
+        self.client = client
+        self.stream = stream
+        self.group = group
+        self.consumer = consumer
+        self.claim_idle = claim_idle
+        self.max_length = max_length
+        self.max_attempts = max_attempts
+        self._entries: dict[str, str] = dict()
+        try:
+            client.xgroup_create(stream, group, id="0", mkstream=True)
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def add(self, alerts: Iterable[Alert]) -> int:
+        """Queue alerts to be rendered and sent out.
+
+        Args:
+            alerts (Iterable[Alert]): The new alerts, with their timestamps already parsed.
+
+        Returns:
+            int: The number of alerts queued.
+        """
+        pipe = self.client.pipeline(transaction=False)
+        count = 0
+        for alert in alerts:
+            # Poll times are per-host monotonic values, so they travel as wall clock times.
+            polled = time.time() - (time.monotonic() - alert.received) if alert.received is not None else ""
+            pipe.xadd(self.stream, {
+                "alert": json.dumps(alert.to_dict(), default=json_default),
+                "destinations": json.dumps(alert.destinations),
+                "polled": str(polled),
+            }, maxlen=self.max_length, approximate=True)
+            count += 1
+        if count:
+            pipe.execute()
+            WORK_ITEMS.inc(count, result="queued")
+        return count
+
+    def claim(self, count: int = 16, block: float = 0.) -> list[Alert]:
+        """Take alerts off the queue for this node, starting with any left behind by nodes that
+        went away.  Every alert returned has to be passed to `complete`.
+
+        Args:
+            count (int, optional): The maximum number of alerts to take. Defaults to 16.
+            block (float, optional): Seconds to wait for new alerts when there are none. Defaults to 0.0.
+
+        Returns:
+            list[Alert]: The alerts.
+        """
+        # Redis 6.2 (and KeyDB) reply with two values, Redis 7 adds a third.
+        entries = self.client.xautoclaim(
+            self.stream, self.group, self.consumer, min_idle_time=int(self.claim_idle * 1000), count=count
+        )[1]
+        if entries:
+            WORK_ITEMS.inc(len(entries), result="reclaimed")
+        else:
+            response = self.client.xreadgroup(
+                self.group, self.consumer, {self.stream: ">"}, count=count, block=int(block * 1000) or None
+            )
+            entries = response[0][1] if response else list()
+
+        alerts = list()
+        for entry_id, fields in entries:
+            if not fields:
+                # The entry was trimmed from the stream before anyone got to it.
+                self.client.xack(self.stream, self.group, entry_id)
+                continue
+            alert = self._decode(fields)
+            self._entries[alert.id] = entry_id
+            alerts.append(alert)
+        return alerts
+
+    def _decode(self, fields: dict) -> Alert:
+        alert = Alert.from_feature(json.loads(fields[b"alert"]))
+        normalize_timestamps(alert.properties)
+        alert.destinations = json.loads(fields[b"destinations"])
+        if polled := fields.get(b"polled"):
+            alert.received = time.monotonic() - (time.time() - float(polled))
+        return alert
+
+    def reserve(self, alert: Alert) -> bool:
+        """Claim an alert taken with `claim` for this node to send out.  The claim runs out after
+        `claim_idle` seconds, when another node may take over the alert.  Duplicates of an alert
+        that was already sent out are acknowledged here.
+
+        Args:
+            alert (Alert): The alert.
+
+        Returns:
+            bool: Whether this node should send the alert out and then pass it to `complete`.
+                False if another node sent it out or is sending it.
+        """
+        pipe = self.client.pipeline(transaction=True)
+        pipe.exists(self._key("sent", alert.id))
+        pipe.set(self._key("sending", alert.id), self.consumer, nx=True, px=max(int(self.claim_idle * 1000), 1))
+        sent, reserved = pipe.execute()
+        if sent:
+            if reserved:
+                self.client.delete(self._key("sending", alert.id))
+            self._ack(alert)
+            WORK_ITEMS.inc(result="duplicate")
+            return False
+        if not reserved:
+            # Left unacknowledged, if the other node goes away this one is claimed again later.
+            self._entries.pop(alert.id, None)
+            WORK_ITEMS.inc(result="busy")
+            return False
+        return True
+
+    def complete(self, alert: Alert, ttl: float = 86400.) -> None:
+        """Record that an alert reserved with `reserve` was sent out, and acknowledge it.
+
+        Args:
+            alert (Alert): The alert.
+            ttl (float, optional): How long to remember that the alert was sent out, in seconds.
+                Defaults to one day.
+        """
+        pipe = self.client.pipeline(transaction=True)
+        pipe.set(self._key("sent", alert.id), self.consumer, ex=int(ttl))
+        pipe.delete(self._key("sending", alert.id))
+        self._ack(alert, pipe)
+        pipe.execute()
+        WORK_ITEMS.inc(result="completed")
+
+    def release(self, alert: Alert, ttl: float = 86400.) -> bool:
+        """Give up the claim on an alert reserved with `reserve` without sending it out, such as
+        when its render failed.  The alert stays on the queue and is claimed again after
+        `claim_idle` seconds, unless it was already handed out `max_attempts` times, when it is
+        acknowledged instead.
+
+        Args:
+            alert (Alert): The alert.
+            ttl (float, optional): How long to remember the number of attempts, in seconds.
+                Defaults to one day.
+
+        Returns:
+            bool: Whether the alert will be handed out again.
+        """
+        pipe = self.client.pipeline(transaction=True)
+        pipe.incr(self._key("attempts", alert.id))
+        pipe.expire(self._key("attempts", alert.id), int(ttl))
+        pipe.delete(self._key("sending", alert.id))
+        attempts = pipe.execute()[0]
+        if attempts >= self.max_attempts:
+            self._ack(alert)
+            WORK_ITEMS.inc(result="failed")
+            return False
+        self._entries.pop(alert.id, None)
+        WORK_ITEMS.inc(result="released")
+        return True
+
+    def _ack(self, alert: Alert, pipe: Optional[redis.client.Pipeline] = None) -> None:
+        # Adds the acknowledgement to `pipe` when given, otherwise sends it right away.
+        entry_id = self._entries.pop(alert.id, None)
+        if entry_id is None:
+            return
+        own = pipe is None
+        if own:
+            pipe = self.client.pipeline(transaction=True)
+        pipe.xack(self.stream, self.group, entry_id)
+        pipe.xdel(self.stream, entry_id)
+        if own:
+            pipe.execute()
+
+    def _key(self, kind: str, alert_id: str) -> str:
+        return f"{self.stream}:{kind}:{alert_id}"
+
+    @property
+    def pending(self) -> int:
+        """Return the number of alerts handed out to nodes and not yet acknowledged.
+
+        Returns:
+            int: The number of alerts.
+        """
+        return self.client.xpending(self.stream, self.group)["pending"]
+
+    def __len__(self) -> int:
+        return self.client.xlen(self.stream)
@@ -0,0 +1,347 @@
+import logging
+import mmap
+import os
+import struct
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterable, Optional
+
+import numpy as np
+import shapely
+
+from config import Config
+
+log = logging.getLogger("rich")
+
+# File layout: header, one index record per county, then the WKB geometries back to back.
+MAGIC = b"NWSC"
+VERSION = 1
+HEADER = struct.Struct("<4sII")         # magic, version, count
+RECORD = struct.Struct("<5s4dQI")       # FIPS, west, south, east, north, offset, length
+
+# County line file layout: header, then the line bounds (float64 west, south, east, north), the
+# offset of each line's first coordinate (int64, one extra for the end of the last line), and
+# the coordinates (float32 lon, lat) of every line back to back.
+LINES_MAGIC = b"NWSL"
+LINES_VERSION = 1
+LINES_HEADER = struct.Struct("<4sIQQ")  # magic, version, line count, coordinate count
+
+
+def build(source: str, dest: str) -> int:
+    """Build the county geometry store from the NWS county shapefile.
+
+    Args:
+        source (str): The path to the NWS county shapefile archive.
+        dest (str): The path to write the store to.
+
+    Returns:
+        int: The number of counties written to the store.
+    """
+    import geopandas as gpd
+
+    gpf_counties = gpd.read_file(source)
+    geometries = dict()
+    for fips, group in gpf_counties.groupby("FIPS"):
+        geometries[fips] = shapely.union_all(group.geometry.values)
+
+    blobs = [shapely.to_wkb(g) for g in geometries.values()]
+    offset = 0
+    records = list()
+    for (fips, geometry), blob in zip(geometries.items(), blobs):
+        records.append(RECORD.pack(fips.encode("ascii"), *geometry.bounds, offset, len(blob)))
+        offset += len(blob)
+
+    # Several render workers can start building at once, so each writes its own temporary file.
+    temp = Path(dest).with_suffix(f".{os.getpid()}.tmp")
+    with open(temp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(records)))
+        f.write(b"".join(records))
+        f.write(b"".join(blobs))
+    _install(temp, dest)
+    return len(records)
+
+
+def _install(temp: Path, dest: str) -> None:
+    # Another worker's copy of the same file landing first is just as good.
+    try:
+        temp.replace(dest)
+    except OSError:
+        temp.unlink(missing_ok=True)
+        if not Path(dest).exists():
+            raise
+
+
+class CountyStore:
+    """A memory-mapped store of the NWS county geometries indexed by FIPS code.  The file is
+    only opened the first time a county is looked up.
+
+    Attributes:
+        path (Path): The path to the store.
+        source (Path): The NWS county shapefile used to build the store if it is missing.
+    """
+    path: Path
+    source: Path
+
+    def __init__(self, path: str, source: str):
+        """Create a CountyStore object.
+
+        Args:
+            path (str): The path to the store.
+            source (str): The NWS county shapefile used to build the store if it is missing.
+        """
+        self.path = Path(path)
+        self.source = Path(source)
+        self._lock = threading.Lock()
+        self._index: Optional[dict[str, tuple]] = None
+        self._data: Optional[mmap.mmap] = None
+        self._data_start = 0
+
+    def load(self) -> dict[str, tuple]:
+        """Open the store, building it first if it is missing.
+
+        Returns:
+            dict[str, tuple]: The FIPS index of bounds and geometry offsets.
+        """
+        with self._lock:
+            if self._index is not None:
+                return self._index
+
+            if not self.path.exists():
+                log.warning(f'County store "{self.path}" is missing, building it from "{self.source}".')
+                build(str(self.source), str(self.path))
+
+            with open(self.path, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, count = HEADER.unpack_from(data, 0)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f'"{self.path}" is not a version {VERSION} county store, rerun populate_data.sh.')
+
+            index = dict()
+            start = HEADER.size
+            end = start + RECORD.size * count
+            for fips, west, south, east, north, offset, length in RECORD.iter_unpack(data[start:end]):
+                index[fips.decode("ascii")] = (west, south, east, north, offset, length)
+
+            self._data = data
+            self._data_start = end
+            self._index = index
+            return index
+
+    def bounds(self, fips_codes: Iterable[str]) -> tuple[float, float, float, float]:
+        """Return the combined bounds of a set of counties.
+
+        Args:
+            fips_codes (Iterable[str]): The FIPS codes of the counties.
+
+        Returns:
+            tuple[float, float, float, float]: The west, south, east, and north bounds.  All values
+                are NaN if none of the counties are in the store.
+        """
+        index = self.load()
+        records = [index[i] for i in fips_codes if i in index]
+        if not records:
+            nan = float("nan")
+            return nan, nan, nan, nan
+        return (
+            min(r[0] for r in records),
+            min(r[1] for r in records),
+            max(r[2] for r in records),
+            max(r[3] for r in records),
+        )
+
+    def geometries(self, fips_codes: Iterable[str]) -> list:
+        """Return the geometries of a set of counties.
+
+        Args:
+            fips_codes (Iterable[str]): The FIPS codes of the counties.
+
+        Returns:
+            list[Geometry]: The county geometries.  Unknown counties are skipped.
+        """
+        index = self.load()
+        return [self._geometry(i) for i in fips_codes if i in index]
+
+    @lru_cache(maxsize=512)
+    def _geometry(self, fips: str):
+        offset, length = self._index[fips][4:]
+        start = self._data_start + offset
+        return shapely.from_wkb(self._data[start:start + length])
+
+    def __contains__(self, fips: str) -> bool:
+        return fips in self.load()
+
+    def __len__(self) -> int:
+        return len(self.load())
+
+
+def build_lines(source: str, dest: str) -> int:
+    """Build the county line store from the county line shapefile.
+
+    Args:
+        source (str): The path to the county line shapefile.
+        dest (str): The path to write the store to.
+
+    Returns:
+        int: The number of lines written to the store.
+    """
+    import cartopy.io.shapereader as shapereader
+
+    lines = shapely.get_parts(np.array(list(shapereader.Reader(source).geometries()), dtype=object))
+    coordinates = shapely.get_coordinates(lines).astype(np.float32)
+    offsets = np.zeros(len(lines) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(shapely.get_num_coordinates(lines))
+    # Bounds come from the stored coordinates so the bounding box checks agree with what is drawn.
+    bounds = np.hstack([
+        np.minimum.reduceat(coordinates, offsets[:-1]),
+        np.maximum.reduceat(coordinates, offsets[:-1]),
+    ]).astype(np.float64)
+
+    # Several render workers can start building at once, so each writes its own temporary file.
+    temp = Path(dest).with_suffix(f".{os.getpid()}.tmp")
+    with open(temp, "wb") as f:
+        f.write(LINES_HEADER.pack(LINES_MAGIC, LINES_VERSION, len(lines), len(coordinates)))
+        f.write(bounds.tobytes())
+        f.write(offsets.tobytes())
+        f.write(coordinates.tobytes())
+    _install(temp, dest)
+    return len(lines)
+
+
+class CountyLines:
+    """The county boundary lines drawn on every map.  The lines are kept as flat coordinate and
+    offset arrays in a memory-mapped file, so every render worker on a host shares one copy
+    through the page cache.  A query checks the bounds of every line at once and only builds
+    shapely geometries for the lines inside of the map's extent.
+
+    Attributes:
+        path (Path): The path to the county line store.
+        source (Path): The county line shapefile used to build the store if it is missing.
+        tolerances (list[tuple[float, float]]): Pairs of minimum extent widths in degrees and
+            the simplification tolerance to use for maps at least that wide.
+    """
+    path: Path
+    source: Path
+    tolerances: list[tuple[float, float]]
+
+    def __init__(self, path: str, source: str, tolerances: Optional[list[tuple[float, float]]] = None):
+        """Create a CountyLines object.  The store is opened the first time it is queried.
+
+        Args:
+            path (str): The path to the county line store.
+            source (str): The county line shapefile used to build the store if it is missing.
+            tolerances (list[tuple[float, float]], optional): Pairs of minimum extent widths in
+                degrees and simplification tolerances. Defaults to no simplification.
+        """
+        self.path = Path(path)
+        self.source = Path(source)
+        self.tolerances = sorted(tolerances or [], reverse=True)
+        self._lock = threading.Lock()
+        self._data: Optional[mmap.mmap] = None
+        self._bounds: Optional[np.ndarray] = None
+        self._offsets: Optional[np.ndarray] = None
+        self._coordinates: Optional[np.ndarray] = None
+
+    def load(self) -> int:
+        """Open the store, building it first if it is missing.
+
+        Returns:
+            int: The number of lines in the store.
+        """
+        with self._lock:
+            if self._bounds is not None:
+                return len(self._bounds)
+
+            if not self.path.exists():
+                log.warning(f'County line store "{self.path}" is missing, building it from "{self.source}".')
+                build_lines(str(self.source), str(self.path))
+
+            with open(self.path, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, count, points = LINES_HEADER.unpack_from(data, 0)
+            if magic != LINES_MAGIC or version != LINES_VERSION:
+                raise ValueError(f'"{self.path}" is not a version {LINES_VERSION} county line store, rerun populate_data.sh.')
+
+            # The arrays are read-only views of the mapped file, nothing is copied.
+            offset = LINES_HEADER.size
+            self._bounds = np.frombuffer(data, np.float64, count * 4, offset).reshape(count, 4)
+            offset += self._bounds.nbytes
+            self._offsets = np.frombuffer(data, np.int64, count + 1, offset)
+            offset += self._offsets.nbytes
+            self._coordinates = np.frombuffer(data, np.float32, points * 2, offset).reshape(points, 2)
+            self._data = data
+            return count
+
+    def tolerance(self, width: float) -> float:
+        """Return the simplification tolerance to use for a map.
+
+        Args:
+            width (float): The width of the map extent in degrees of longitude.
+
+        Returns:
+            float: The simplification tolerance in degrees.
+        """
+        for min_width, tolerance in self.tolerances:
+            if width >= min_width:
+                return tolerance
+        return 0.
+
+    def query(self, west: float, south: float, east: float, north: float) -> list:
+        """Return the county lines that fall inside a bounding box, clipped to the box.
+
+        Args:
+            west (float): The western-most longitude.
+            south (float): The southern-most latitude.
+            east (float): The eastern-most longitude.
+            north (float): The northern-most latitude.
+
+        Returns:
+            list[Geometry]: The clipped county lines.
+        """
+        self.load()
+        bounds = self._bounds
+        indices = np.flatnonzero(
+            (bounds[:, 0] <= east) & (bounds[:, 2] >= west) & (bounds[:, 1] <= north) & (bounds[:, 3] >= south)
+        )
+        if not len(indices):
+            return list()
+
+        # Gather the coordinates of just the matching lines and build them in one call.
+        starts, ends = self._offsets[indices], self._offsets[indices + 1]
+        lengths = ends - starts
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        geometries = shapely.linestrings(
+            self._coordinates[positions].astype(np.float64),
+            indices=np.repeat(np.arange(len(indices)), lengths),
+        )
+
+        tolerance = self.tolerance(east - west)
+        if tolerance:
+            geometries = shapely.simplify(geometries, tolerance, preserve_topology=False)
+
+        clipped = shapely.clip_by_rect(geometries, west, south, east, north)
+        return [g for g in clipped if not g.is_empty]
+
+
+def same_to_fips(same_codes: Iterable[str]) -> list[str]:
+    """Convert SAME location codes into county FIPS codes.
+
+    Args:
+        same_codes (Iterable[str]): The SAME codes from an alert's geocode.
+
+    Returns:
+        list[str]: The FIPS codes.
+    """
+    return [i[1:] for i in same_codes]
+
+
+county_store = CountyStore(Config.COUNTY_STORE_PATH, Config.COUNTY_SOURCE_PATH)
+county_lines = CountyLines(Config.COUNTY_LINES_STORE_PATH, Config.COUNTY_LINES_PATH, Config.COUNTY_LINES_SIMPLIFY)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s', level=logging.INFO)
+    count = build(Config.COUNTY_SOURCE_PATH, Config.COUNTY_STORE_PATH)
+    log.info(f'Wrote {count} counties to "{Config.COUNTY_STORE_PATH}".')
+    count = build_lines(Config.COUNTY_LINES_PATH, Config.COUNTY_LINES_STORE_PATH)
+    log.info(f'Wrote {count} county lines to "{Config.COUNTY_LINES_STORE_PATH}".')
@@ -0,0 +1,384 @@
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import Config
+from metrics import Counter, Histogram
+
+log = logging.getLogger("rich")
+
+# Discord limits for a single webhook message.
+MAX_EMBEDS = 10
+MAX_EMBED_CHARS = 6000
+# Rate limited responses in a row before a payload is moved to the retry queue.
+MAX_RATE_LIMITED = 5
+
+WEBHOOK_SECONDS = Histogram("webhook_seconds", "Time taken by webhook requests.")
+WEBHOOK_POSTS = Counter("webhook_posts_total", "Webhook requests by result.", ("result",))
+WEBHOOK_RETRIES = Counter("webhook_retries_total", "Failed webhook payloads by whether they will be retried.", ("result",))
+DELIVERY_SECONDS = Histogram("alert_delivery_seconds", "Time from the poll that found an alert to its webhook being sent.")
+
+
+class SendResult:
+    """The possible outcomes of posting a payload to a webhook."""
+    SENT = "sent"
+    RETRY = "retry"
+    DROP = "drop"
+
+
+class RetryQueue:
+    """A durable queue of webhook payloads that could not be delivered, backed by SQLite.
+
+    Attributes:
+        path (str): The path to the SQLite database.
+        limit (int): The number of attempts before a payload is given up on.
+    """
+    path: str
+    limit: int
+
+    def __init__(self, path: str, limit: int = 20):
+        """Create a RetryQueue object.
+
+        Args:
+            path (str): The path to the SQLite database.
+            limit (int, optional): The number of attempts before a payload is given up on. Defaults to 20.
+        """
+        self.path = path
+        self.limit = limit
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS retry ("
+            "id INTEGER PRIMARY KEY, url TEXT, payload TEXT, attempts INTEGER, next_attempt REAL)"
+        )
+        self._db.commit()
+        self._lock = threading.Lock()
+
+    def push(self, url: str, payload: dict, attempts: int = 1) -> None:
+        """Add a payload to the queue.
+
+        Args:
+            url (str): The webhook URL.
+            payload (dict): The webhook payload.
+            attempts (int, optional): The number of delivery attempts made so far. Defaults to 1.
+        """
+        if attempts >= self.limit:
+            log.warning(f"Giving up on webhook payload after {attempts} attempts: {json.dumps(payload)}")
+            WEBHOOK_RETRIES.inc(result="abandoned")
+            return
+        WEBHOOK_RETRIES.inc(result="queued")
+        next_attempt = time.time() + min(2 ** attempts, 300)
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO retry (url, payload, attempts, next_attempt) VALUES (?, ?, ?, ?)",
+                (url, json.dumps(payload), attempts, next_attempt),
+            )
+            self._db.commit()
+
+    def pop_due(self) -> list[tuple[str, dict, int]]:
+        """Remove and return every payload that is due for another attempt.
+
+        Returns:
+            list[tuple[str, dict, int]]: The webhook URL, payload, and attempts made for each payload.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, url, payload, attempts FROM retry WHERE next_attempt <= ? ORDER BY id",
+                (time.time(),),
+            ).fetchall()
+            if rows:
+                self._db.executemany("DELETE FROM retry WHERE id = ?", [(r[0],) for r in rows])
+                self._db.commit()
+        return [(url, json.loads(payload), attempts) for _, url, payload, attempts in rows]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM retry").fetchone()[0]
+
+
+class RateLimitBucket:
+    """The rate limit state Discord reported for a webhook.
+
+    Attributes:
+        remaining (int): The number of requests left in the current window.
+        reset_at (float): When the current window resets, as a `time.monotonic` value.
+    """
+    remaining: int
+    reset_at: float
+
+    def __init__(self):
+        """Create a RateLimitBucket object with no known limits."""
+        self.remaining = 1
+        self.reset_at = 0.
+
+    def update(self, headers: dict) -> None:
+        """Update the bucket from the `X-RateLimit-*` headers of a response.
+
+        Args:
+            headers (dict): The response headers.
+        """
+        if "X-RateLimit-Remaining" in headers:
+            self.remaining = int(headers["X-RateLimit-Remaining"])
+        if "X-RateLimit-Reset-After" in headers:
+            self.reset_at = time.monotonic() + float(headers["X-RateLimit-Reset-After"])
+
+    @property
+    def delay(self) -> float:
+        """Return how long to wait before the next request.
+
+        Returns:
+            float: The delay in seconds.
+        """
+        if self.remaining > 0:
+            return 0.
+        return max(self.reset_at - time.monotonic(), 0.)
+
+
+class WebhookDispatcher:
+    """Sends Discord webhook payloads from background threads over a pooled session.  Every
+    webhook gets its own sender thread, so destinations are posted to concurrently while the
+    payloads for a single webhook still go out in order.  The dispatcher waits out Discord's
+    rate limits, merges the embeds of queued payloads going to the same webhook into a single
+    message, and keeps failed payloads in a `RetryQueue`.  When Discord rejects a merged message,
+    its embeds are sent again one at a time so only the bad one is dropped.
+
+    Attributes:
+        timeout (float): The webhook request timeout in seconds.
+        retries (RetryQueue): The payloads waiting on another delivery attempt.
+    """
+    timeout: float
+    retries: RetryQueue
+
+    def __init__(self, retry_path: str, retry_limit: int = 20, timeout: float = 10., concurrency: int = 8):
+        """Create a WebhookDispatcher object.  The background threads start on the first send.
+
+        Args:
+            retry_path (str): The path to the SQLite database holding failed payloads.
+            retry_limit (int, optional): The number of attempts before a payload is given up on. Defaults to 20.
+            timeout (float, optional): The webhook request timeout in seconds. Defaults to 10.0.
+            concurrency (int, optional): The number of webhook requests in flight at once. Defaults to 8.
+        """
+        self.timeout = timeout
+        self.retries = RetryQueue(retry_path, retry_limit)
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=concurrency))
+        self.session.mount("http://", HTTPAdapter(pool_maxsize=concurrency))
+
+        self._lanes: dict[str, queue.Queue] = dict()
+        self._buckets: dict[str, RateLimitBucket] = dict()
+        self._global_reset = 0.
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._closed = threading.Event()
+        self._threads: list[threading.Thread] = list()
+        self._lock = threading.Lock()
+
+    def send(self, url: str, payload: dict, since: Optional[float] = None) -> None:
+        """Queue a payload to be sent to a webhook.
+
+        Args:
+            url (str): The webhook URL.
+            payload (dict): The webhook payload.
+            since (Optional[float], optional): The `time.monotonic` value the payload's alert was
+                polled at, used to measure delivery latency. Defaults to None.
+        """
+        self._enqueue(url, payload, 0, since)
+
+    def _enqueue(self, url: str, payload: dict, attempts: int, since: Optional[float]) -> None:
+        with self._lock:
+            if not self._threads:
+                self._start(self._run_retries, "webhook-retries")
+            lane = self._lanes.get(url)
+            if lane is None:
+                lane = self._lanes[url] = queue.Queue()
+                self._start(self._run, f"webhook-{len(self._lanes)}", lane)
+        lane.put((url, payload, attempts, since))
+
+    def _start(self, target, name: str, *args) -> None:
+        thread = threading.Thread(target=target, args=args, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Send everything still queued and stop the background threads.
+
+        Args:
+            timeout (Optional[float], optional): How long to wait on the queues to drain. Defaults to None.
+        """
+        self._closed.set()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            threads = list(self._threads)
+        for thread in threads:
+            thread.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+
+    def _run_retries(self) -> None:
+        while not self._closed.wait(1):
+            try:
+                for url, payload, attempts in self.retries.pop_due():
+                    self._enqueue(url, payload, attempts, None)
+            except Exception:
+                log.exception("Unable to read the webhook retry queue.")
+
+    def _run(self, lane: queue.Queue) -> None:
+        pending: list[tuple[str, dict, int, Optional[float]]] = list()
+        while True:
+            try:
+                pending.append(lane.get(timeout=1))
+            except queue.Empty:
+                if self._closed.is_set():
+                    break
+                continue
+
+            while pending:
+                # Pick up everything that arrived while waiting so bursts get merged.
+                while True:
+                    try:
+                        pending.append(lane.get_nowait())
+                    except queue.Empty:
+                        break
+                url, payload, attempts, since = merge_payloads(pending)
+                try:
+                    self._deliver(url, payload, attempts, since)
+                except Exception:
+                    # Keep the thread alive, otherwise nothing else queued for this webhook is sent.
+                    log.exception("Unable to deliver webhook payload, queueing a retry.")
+                    try:
+                        self.retries.push(url, payload, attempts + 1)
+                    except Exception:
+                        log.exception(f"Unable to queue a retry, dropping webhook payload: {json.dumps(payload)}")
+
+    def _deliver(self, url: str, payload: dict, attempts: int, since: Optional[float]) -> None:
+        result = self._post(url, payload)
+        WEBHOOK_POSTS.inc(result=result)
+        embeds = payload.get("embeds", [])
+        if result == SendResult.DROP and len(embeds) > 1:
+            # A single bad embed rejects the whole message, so only drop that one.
+            log.info(f"Resending the {len(embeds)} embeds of the rejected message one at a time.")
+            for embed in embeds:
+                self._deliver(url, {**payload, "embeds": [embed]}, attempts, since)
+        elif result == SendResult.SENT and since is not None:
+            DELIVERY_SECONDS.observe(time.monotonic() - since)
+        elif result == SendResult.RETRY:
+            self.retries.push(url, payload, attempts + 1)
+
+    def _post(self, url: str, payload: dict) -> str:
+        bucket = self._buckets.setdefault(url, RateLimitBucket())
+        rate_limited = 0
+        while True:
+            delay = max(bucket.delay, self._global_reset - time.monotonic())
+            if delay > 0:
+                log.debug(f"Waiting {delay:.2f} seconds on the Discord rate limit.")
+                time.sleep(delay)
+
+            try:
+                with self._slots, WEBHOOK_SECONDS.time():
+                    r = self.session.post(url, json=payload, timeout=self.timeout)
+            except requests.exceptions.RequestException as e:
+                log.warning(f"Could not trigger webhook: {e}")
+                return SendResult.RETRY
+            bucket.update(r.headers)
+
+            if r.status_code == 429:
+                try:
+                    body = r.json()
+                except requests.exceptions.JSONDecodeError:
+                    body = dict()
+                if not isinstance(body, dict):
+                    body = dict()
+                retry_after = float(body.get("retry_after", r.headers.get("Retry-After", 1)))
+                if body.get("global") or r.headers.get("X-RateLimit-Global"):
+                    self._global_reset = time.monotonic() + retry_after
+                else:
+                    bucket.remaining, bucket.reset_at = 0, time.monotonic() + retry_after
+                WEBHOOK_POSTS.inc(result="rate_limited")
+                rate_limited += 1
+                if rate_limited > MAX_RATE_LIMITED:
+                    log.warning(f"Discord rate limited the webhook {rate_limited} times in a row, queueing a retry.")
+                    return SendResult.RETRY
+                log.info(f"Discord rate limited the webhook, retrying in {retry_after:.2f} seconds.")
+                continue
+
+            if 200 <= r.status_code < 300:
+                log.info(f"Webhook triggered, return code: {r.status_code}")
+                return SendResult.SENT
+
+            log.warning(f"Could not trigger webhook, status code '{r.status_code}': {r.text}")
+            if r.status_code >= 500:
+                return SendResult.RETRY
+            return SendResult.DROP
+
+
+def embed_length(embed: dict) -> int:
+    """Return the number of characters in an embed that count toward Discord's limit.
+
+    Args:
+        embed (dict): The embed.
+
+    Returns:
+        int: The number of characters.
+    """
+    length = len(embed.get("title", "")) + len(embed.get("description", ""))
+    length += len(embed.get("footer", {}).get("text", "")) + len(embed.get("author", {}).get("name", ""))
+    for field in embed.get("fields", []):
+        length += len(field.get("name", "")) + len(field.get("value", ""))
+    return length
+
+
+def merge_payloads(pending: list[tuple[str, dict, int, Optional[float]]]) -> tuple[str, dict, int, Optional[float]]:
+    """Remove the first payload from `pending` along with the following payloads to the same
+    webhook whose embeds fit into the same message.
+
+    Args:
+        pending (list[tuple[str, dict, int, Optional[float]]]): The webhook URL, payload, attempts
+            made, and poll time for each queued payload.  Merged payloads are removed from the list.
+
+    Returns:
+        tuple[str, dict, int, Optional[float]]: The webhook URL, merged payload, the most attempts
+            made on any of the merged payloads, and the earliest poll time among them.
+    """
+    url, payload, attempts, since = pending.pop(0)
+    if set(payload) != {"embeds"}:
+        return url, payload, attempts, since
+
+    embeds = list(payload["embeds"])
+    length = sum(embed_length(e) for e in embeds)
+    i = 0
+    while i < len(pending) and len(embeds) < MAX_EMBEDS:
+        other_url, other, other_attempts, other_since = pending[i]
+        other_length = sum(embed_length(e) for e in other.get("embeds", []))
+        if (other_url != url or set(other) != {"embeds"}
+                or len(embeds) + len(other["embeds"]) > MAX_EMBEDS
+                or length + other_length > MAX_EMBED_CHARS):
+            i += 1
+            continue
+        embeds.extend(other["embeds"])
+        length += other_length
+        attempts = max(attempts, other_attempts)
+        if other_since is not None:
+            since = other_since if since is None else min(since, other_since)
+        pending.pop(i)
+    return url, {"embeds": embeds}, attempts, since
+
+
+_dispatcher: Optional[WebhookDispatcher] = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher() -> WebhookDispatcher:
+    """Return the webhook dispatcher configured for this process.
+
+    Returns:
+        WebhookDispatcher: The webhook dispatcher.
+    """
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = WebhookDispatcher(Config.WEBHOOK_RETRY_PATH, Config.WEBHOOK_RETRY_LIMIT,
+                                            Config.WEBHOOK_TIMEOUT, Config.WEBHOOK_CONCURRENCY)
+        return _dispatcher
@@ -0,0 +1,85 @@
+import re
+import threading
+from typing import Optional, Union
+
+from alerts import Alert
+from metrics import Counter
+
+FILTERED = Counter("alert_filter_total", "Alerts checked against the filter rules by result.", ("result",))
+
+
+class AlertFilter:
+    """A matcher built from the `FILTER_RULES` configuration.  Every property in a rule is
+    compiled once into a single alternation of all of its regular expressions.  An alert is
+    allowed when every property of every rule matches.
+
+    Attributes:
+        rules (list[tuple[str, re.Pattern]]): The property names and compiled patterns.
+        hits (list[int]): How many alerts matched each entry in `rules`.
+        misses (list[int]): How many alerts did not match each entry in `rules`.
+    """
+    rules: list[tuple[str, re.Pattern]]
+    hits: list[int]
+    misses: list[int]
+
+    def __init__(self, rule_list: list[dict[str, Union[str, list[str]]]]):
+        """Create an AlertFilter object.
+
+        Args:
+            rule_list (list[dict]): The filter rules in the `FILTER_RULES` format.
+        """
+        self.rules = list()
+        for rule in rule_list:
+            for attrib, values in rule.items():
+                if isinstance(values, str):
+                    values = [values]
+                pattern = '|'.join(f"(?:{value})" for value in values)
+                self.rules.append((attrib, re.compile(pattern)))
+        self.hits = [0] * len(self.rules)
+        self.misses = [0] * len(self.rules)
+        self._lock = threading.Lock()
+
+    def match(self, alert: Alert, matches: Optional[dict[tuple[str, str], bool]] = None) -> bool:
+        """Check whether an alert is allowed through the filter.
+
+        Args:
+            alert (Alert): The NWS API alert.
+            matches (Optional[dict[tuple[str, str], bool]], optional): Results of rules already
+                checked against this alert by other filters, keyed by property and pattern.  New
+                results are added to it. Defaults to None.
+
+        Returns:
+            bool: Whether the alert was allowed via the rules.
+        """
+        properties = alert.properties
+        for i, (attrib, pattern) in enumerate(self.rules):
+            key = (attrib, pattern.pattern)
+            if matches is not None and key in matches:
+                matched = matches[key]
+            else:
+                matched = bool(pattern.search(str(properties.get(attrib) or '')))
+                if matches is not None:
+                    matches[key] = matched
+            with self._lock:
+                if matched:
+                    self.hits[i] += 1
+                else:
+                    self.misses[i] += 1
+            if not matched:
+                FILTERED.inc(result="blocked")
+                return False
+        FILTERED.inc(result="allowed")
+        return True
+
+    @property
+    def stats(self) -> list[dict]:
+        """Return the hit counts for every rule.
+
+        Returns:
+            list[dict]: The property, pattern, hits, and misses for each rule.
+        """
+        with self._lock:
+            return [
+                {"property": attrib, "pattern": pattern.pattern, "hits": hits, "misses": misses}
+                for (attrib, pattern), hits, misses in zip(self.rules, self.hits, self.misses)
+            ]
@@ -1,34 +1,45 @@
+import hashlib
 import json
 import logging
-import time
+import os
+import threading
+from pathlib import Path
+from time import perf_counter
 from typing import Optional, Union
-from uuid import uuid4
 
 import cartopy.crs as ccrs
-import cartopy.feature as cfeature
-import cartopy.io.shapereader as shapereader
-import contextily as cx
-import geopandas as gpd
 import matplotlib
 import matplotlib.pyplot as plt
-import requests
-from box import Box
+import numpy as np
 from jinja2 import Environment, FileSystemLoader, select_autoescape
-from shapely import Polygon
+from PIL import Image
 
+import geometry
+from alerts import Alert, as_alert
 from config import Config
+from counties import county_lines, county_store, same_to_fips
+from dispatcher import get_dispatcher
+from images import thumbnail_name
+from metrics import Counter, Histogram
+from tiles import add_basemap
 
 # We don't need an interactive backend, so we will use 'agg'.
 matplotlib.use('agg')
 
-# Load the NWS county definitions.  These are needed for watches as they aren't defined
-# by polygons directly in the message.
-gpf_counties = gpd.read_file("data/c_05mr24.zip")
+# Bump this whenever the look of the rendered maps changes so cached images aren't reused.
+RENDER_VERSION = 3
 
-# Load the county shapes to draw the county lines on the generated map.
-reader = shapereader.Reader("data/countyl010g.shp")
-counties = list(reader.geometries())
-COUNTIES = cfeature.ShapelyFeature(counties, ccrs.PlateCarree())
+# Size of the rendered maps in inches at 100 dpi.
+FIGURE_SIZE = (16, 9)
+
+# Embed template used when a destination doesn't set its own.
+DEFAULT_TEMPLATE = "embeds_01.j2"
+
+# File extension of each supported image format.
+IMAGE_EXTENSIONS = {"png": "png", "webp": "webp", "jpeg": "jpg"}
+
+RENDER_SECONDS = Histogram("render_seconds", "Time taken by each phase of drawing a map.", ("phase",))
+RENDERS = Counter("renders_total", "Map renders by result.", ("result",))
 
 # Load the embeds templates
 env = Environment(
@@ -64,31 +75,19 @@ class Bounds:
         self.east = east
         self.west = west
 
-    def generate_bounds(self, alert: Union[dict, Box]) -> None:
+    def generate_bounds(self, alert: Union[dict, Alert]) -> None:
         """Generate the bounds of the alert polygon(s) from a given NWS alert.
 
         Args:
-            alert (Box): The alert from the NWS service.
+            alert (Union[dict, Alert]): The alert from the NWS service.
         """
-        alert = Box(alert)
-        lat, lon = list(), list()
-        if alert.geometry == None:
-            counties = [i[1:] for i in alert.properties.geocode.SAME]
-            c = tuple(
-                gpf_counties[gpf_counties['FIPS'].isin(counties)].total_bounds)
-            self.north = max([c[1], c[3]])
-            self.south = min([c[1], c[3]])
-            self.east = max(c[0], c[2])
-            self.west = min(c[0], c[2])
-        else:
-            for coordinates in alert.geometry.coordinates:
-                for coordinate in coordinates:
-                    lat.append(coordinate[1])
-                    lon.append(coordinate[0])
-            self.north = max(lat)
-            self.south = min(lat)
-            self.east = max(lon)
-            self.west = min(lon)
+        self._set(geometry.alert_bounds([as_alert(alert)])[0])
+
+    def _array(self) -> np.ndarray:
+        return np.array([[self.west, self.south, self.east, self.north]])
+
+    def _set(self, bounds: np.ndarray) -> None:
+        self.west, self.south, self.east, self.north = (float(i) for i in bounds)
 
     @property
     def lat_center(self) -> float:
@@ -114,16 +113,7 @@ class Bounds:
         Args:
             zoom (float): The zoom level to use to adjust the bounding box.  Values below 1 zoom out, above 1 zoom in.
         """
-        lat_adjust = abs(self.north - self.south) / zoom / 2
-        lon_adjust = abs(self.east - self.west) / zoom / 2
-
-        lat_center = self.lat_center
-        lon_center = self.lon_center
-
-        self.north = lat_center + lat_adjust
-        self.south = lat_center - lat_adjust
-        self.east = lon_center + lon_adjust
-        self.west = lon_center - lon_adjust
+        self._set(geometry.zoom(self._array(), zoom)[0])
 
     def set_aspect(self, ratio: float) -> None:
         """Change the bounding box aspect ratio.  This only works with PlateCarree coordinate system.
@@ -131,21 +121,7 @@ class Bounds:
         Args:
             ratio (float): The aspect ratio to use.
         """
-        lat_range = abs(self.north - self.south)
-        lon_range = abs(self.east - self.west)
-
-        lat_center = self.lat_center
-        lon_center = self.lon_center
-
-        current_ratio = lon_range / lat_range
-        if current_ratio >= ratio:
-            lat_adjust = (lon_range / ratio / 2)
-            self.north = lat_center + lat_adjust
-            self.south = lat_center - lat_adjust
-        else:
-            lon_adjust = (lat_range * ratio / 2)
-            self.west = lon_center - lon_adjust
-            self.east = lon_center + lon_adjust
+        self._set(geometry.set_aspect(self._array(), ratio)[0])
 
     def get_lons(self) -> list[float]:
         """Get all of the longitude values for a bounding box.
@@ -163,6 +139,19 @@ class Bounds:
         """
         return [self.north, self.north, self.south, self.south, self.north]
 
+    def mercator_extent(self, ratio: float) -> list[float]:
+        """Return the bounding box in web Mercator coordinates, grown to an aspect ratio.  A map
+        drawn with this extent fills the whole figure, so nothing has to be cropped afterwards.
+
+        Args:
+            ratio (float): The aspect ratio (width / height) of the map.
+
+        Returns:
+            list[float]: The extent in meters in the order of west, east, south, and north.
+        """
+        west, south, east, north = geometry.mercator_extent(self._array(), ratio)[0]
+        return [west, east, south, north]
+
     @property
     def bounds(self) -> list[float]:
         """Return the bounds of the bounding box in a format for `ax.set_extent`
@@ -185,46 +174,145 @@ class Bounds:
         return f'<Bounds(north={self.north:.3f}, south={self.south:.3f}, east={self.east:.3f}, west={self.west:.3f})>'
 
 
-def generate_image(alert: Union[dict, Box]) -> Optional[str]:
+def render_key(alert: Alert) -> str:
+    """Return a key that identifies the map an alert renders to.  Alerts with the same polygons
+    (or the same set of counties) and the same render settings produce the same key.
+
+    Args:
+        alert (Alert): The NWS alert.
+
+    Returns:
+        str: The hex digest identifying the rendered map.
+    """
+    key = hashlib.sha256(
+        f"{RENDER_VERSION}|{Config.MAPBOX_PROVIDER.name}|{Config.MAPBOX_ZOOM}|"
+        f"{Config.IMAGE_FORMAT}|{Config.IMAGE_QUALITY}|{Config.IMAGE_OPTIMIZE_PNG}|"
+        f"{Config.COUNTY_LINES_SIMPLIFY}|{sorted(Config.IMAGE_THUMBNAIL_WIDTHS)}|".encode()
+    )
+    if alert.geometry:
+        for polygon in alert.geometry.polygons:
+            for ring in polygon:
+                key.update(np.round(ring, 4).tobytes())
+                key.update(b"|")
+            key.update(b";")
+    else:
+        counties = same_to_fips(alert.properties.geocode.get("SAME", []))
+        key.update(','.join(sorted(set(counties))).encode())
+    return key.hexdigest()[:32]
+
+
+def image_name(alert: Alert) -> str:
+    """Return the file name an alert's map is saved under.
+
+    Args:
+        alert (Alert): The NWS alert.
+
+    Returns:
+        str: The file name, with the extension of the configured image format.
+    """
+    return f"{render_key(alert)}.{IMAGE_EXTENSIONS[Config.IMAGE_FORMAT.lower()]}"
+
+
+_local = threading.local()
+
+
+def _get_template():
+    """Return this thread's map figure, creating it on first use.  Building a figure and a
+    GeoAxes is a large part of a render, so every render on a thread draws on the same one and
+    removes what it added afterwards.
+
+    Returns:
+        tuple[Figure, GeoAxes, set]: The figure, the axes, and the artists every map starts with.
+    """
+    template = getattr(_local, "template", None)
+    if template is None:
+        fig = plt.figure(figsize=FIGURE_SIZE, dpi=100)
+        ax = fig.add_axes((0, 0, 1, 1), projection=ccrs.Mercator.GOOGLE)
+        ax.set_axis_off()
+        template = _local.template = (fig, ax, set(ax.get_children()))
+    return template
+
+
+def save_image(image: Image.Image, file_path: Path) -> None:
+    """Encode a rendered map in the configured format, along with its thumbnails.  Every file
+    is written to a temporary name first so a half written image is never served.
+
+    Args:
+        image (Image.Image): The rendered map.
+        file_path (Path): Where to save the full size image.
+    """
+    fmt = Config.IMAGE_FORMAT.lower()
+    if fmt == "png":
+        options = dict(optimize=Config.IMAGE_OPTIMIZE_PNG, compress_level=6)
+        if Config.IMAGE_OPTIMIZE_PNG:
+            image = image.quantize(256, method=Image.Quantize.FASTOCTREE)
+    elif fmt == "webp":
+        # Method 2 encodes several times faster than the default of 4 for the same size on maps.
+        options = dict(quality=Config.IMAGE_QUALITY, method=2)
+    elif fmt == "jpeg":
+        options = dict(quality=Config.IMAGE_QUALITY, optimize=True)
+    else:
+        raise ValueError(f"Unsupported image format '{Config.IMAGE_FORMAT}'.")
+
+    # The full size image goes last, its existence means the thumbnails are there too.
+    outputs = list()
+    for width in sorted(Config.IMAGE_THUMBNAIL_WIDTHS):
+        height = round(image.height * width / image.width)
+        outputs.append((image.resize((width, height), Image.Resampling.LANCZOS),
+                        file_path.with_name(thumbnail_name(file_path.name, width))))
+    outputs.append((image, file_path))
+
+    for img, path in outputs:
+        temp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        img.save(temp_path, format=fmt, **options)
+        os.replace(temp_path, path)
+
+
+def generate_image(alert: Union[dict, Alert]) -> Optional[str]:
     """Generate an image containing the polygon(s) in the NWS alert message.
 
     Args:
-        alert (Box): The NWS alert message.
+        alert (Union[dict, Alert]): The NWS alert message.
 
     Returns:
         Optional[str]: Returns the filename of the image generated from the alert message, or None if unable to render the image.
     """
-    alert = Box(alert)
-    fig, ax = plt.subplots(subplot_kw=dict(projection=ccrs.Mercator()))
-    fig.set_size_inches(16, 9)
-    plt.subplots_adjust(left=0, right=1, bottom=0, top=1)
-
+    alert = as_alert(alert)
+    file_name = image_name(alert)
+    file_path = Path(Config.IMAGE_SAVE_PATH) / file_name
+    if file_path.exists():
+        # Bump the modification time so the image cleanup treats it as freshly used.
+        os.utime(file_path)
+        logging.info(f'Reusing image "{file_name}" for identical alert geometry.')
+        RENDERS.inc(result="reused")
+        return file_name
+
+    start = perf_counter()
     bounds = Bounds()
     bounds.generate_bounds(alert=alert)
 
     if not bounds.valid:
+        RENDERS.inc(result="invalid")
         return None
 
-    bounds.zoom(0.7)
-    ax.set_extent(bounds.bounds)
+    fig, ax, baseline = _get_template()
+    try:
+        bounds.zoom(0.7)
+        ax.set_extent(bounds.mercator_extent(FIGURE_SIZE[0] / FIGURE_SIZE[1]), crs=ccrs.Mercator.GOOGLE)
 
-    if alert.geometry:
-        poly = Polygon(alert.geometry.coordinates[0])
-        ax.add_geometries(
-            [poly], 
-            crs=ccrs.PlateCarree(),
-            fc='red', 
-            alpha=0.3, 
-            ec='red', 
-            linewidth=2
-        )
-    else:
-        counties = [i[1:] for i in alert.properties.geocode.SAME]
-        counties = gpf_counties[gpf_counties['FIPS'].isin(counties)]
-        for _, c in counties.iterrows():
-            geometry = c.geometry if isinstance(c.geometry, list) else [c.geometry]
+        if alert.geometry:
             ax.add_geometries(
-                geometry,
+                geometry.shapes(alert),
+                crs=ccrs.PlateCarree(),
+                fc='red', 
+                alpha=0.3, 
+                ec='red', 
+                linewidth=2
+            )
+        else:
+            counties = same_to_fips(alert.properties.geocode.get("SAME", []))
+            ax.add_geometries(
+                county_store.geometries(counties),
                 crs=ccrs.PlateCarree(),
                 fc='red',
                 ec='red',
@@ -232,65 +320,101 @@ def generate_image(alert: Union[dict, Box]) -> Optional[str]:
                 linewidth=2,
             )
 
-    ax.add_feature(COUNTIES, facecolor='none', edgecolor='gray', alpha=0.2)
-    cx.add_basemap(
-        ax=ax,
-        crs=ccrs.Mercator(),
-        source=Config.MAPBOX_PROVIDER,
-        zoom=Config.MAPBOX_ZOOM,
-    )
+        west, east, south, north = ax.get_extent(crs=ccrs.PlateCarree())
+        ax.add_geometries(
+            county_lines.query(west, south, east, north),
+            crs=ccrs.PlateCarree(),
+            facecolor='none',
+            edgecolor='gray',
+            alpha=0.2,
+        )
+        RENDER_SECONDS.observe(perf_counter() - start, phase="geometry")
+
+        with RENDER_SECONDS.time(phase="basemap"):
+            add_basemap(ax, provider=Config.MAPBOX_PROVIDER, zoom=Config.MAPBOX_ZOOM)
 
-    plt.axis('off')
-    file_name = f"{str(uuid4())}.png"
-    plt.savefig(f"{Config.IMAGE_SAVE_PATH}" + "/" +
-                file_name, dpi=100, bbox_inches='tight')
+        with RENDER_SECONDS.time(phase="draw"):
+            fig.canvas.draw()
+            # The map is opaque, dropping the alpha channel makes every format cheaper to encode.
+            image = Image.fromarray(np.asarray(fig.canvas.buffer_rgba())).convert("RGB")
+    finally:
+        for artist in ax.get_children():
+            if artist not in baseline:
+                artist.remove()
 
-    plt.close()
+    with RENDER_SECONDS.time(phase="encode"):
+        save_image(image, file_path)
+
+    RENDER_SECONDS.observe(perf_counter() - start, phase="total")
+    RENDERS.inc(result="rendered")
 
     return file_name
 
 
-def get_color_from_event(alert: Union[dict, Box]) -> int:
+def get_color_from_event(alert: Union[dict, Alert], colors: Optional[dict[str, list[int]]] = None) -> int:
     """Return the color for the associated event as defined in the configuration file.
 
     Args:
-        alert (Union[dict, Box]): The NWS API alert.
+        alert (Union[dict, Alert]): The NWS API alert.
+        colors (Optional[dict[str, list[int]]], optional): The event colors in the `ALERT_COLORS`
+            format. Defaults to `Config.ALERT_COLORS`.
 
     Returns:
         int: The color code associated with the event.
     """
-    alert = Box(alert)
+    alert = as_alert(alert)
 
-    if "expire" in alert.properties.description.lower() and alert.properties.instruction == None:
+    if "expire" in (alert.properties.description or "").lower() and alert.properties.instruction == None:
         return Config.ALERT_COLOR_EXPIRED
     
-    for wtype, colors in Config.ALERT_COLORS.items():
+    for wtype, event_colors in (Config.ALERT_COLORS if colors is None else colors).items():
         if wtype in alert.properties.event:
-            return colors[0] if "Watch" in alert.properties.event else colors[1]
+            return event_colors[0] if "Watch" in alert.properties.event else event_colors[1]
 
     return Config.ALERT_COLOR_DEFAULT
 
 
-def notify_discord_webhook(alert: Union[dict, Box], image: str, webhook_url: str) -> int:
-    """Notify a Discord channel via webhook.
+def notify_discord_webhook(alert: Union[dict, Alert], image: str, webhook_url: str,
+                           template: str = DEFAULT_TEMPLATE, colors: Optional[dict[str, list[int]]] = None) -> None:
+    """Notify a Discord channel via webhook.  The message is queued on the webhook dispatcher,
+    which handles rate limits and retries.
 
     Args:
-        alert (Union[dict, Box]): The NWS alert.
+        alert (Union[dict, Alert]): The NWS alert.
         image (str): The name to the rendered image.
         webhook_url (str): The Discord webhook to use.
+        template (str, optional): The name of the embed template. Defaults to `DEFAULT_TEMPLATE`.
+        colors (Optional[dict[str, list[int]]], optional): The event colors in the `ALERT_COLORS`
+            format. Defaults to `Config.ALERT_COLORS`.
+    """
+    alert = as_alert(alert)
+    payload = build_discord_embed(alert, image=image, template=template, colors=colors)
+    get_dispatcher().send(webhook_url, payload, since=alert.received)
+
+
+def build_discord_embed(alert: Union[dict, Alert], image: str, template: str = DEFAULT_TEMPLATE,
+                        colors: Optional[dict[str, list[int]]] = None) -> dict:
+    """Build the Discord webhook payload for an alert.
+
+    Args:
+        alert (Union[dict, Alert]): The NWS alert.
+        image (str): The name to the rendered image.
+        template (str, optional): The name of the embed template. Defaults to `DEFAULT_TEMPLATE`.
+        colors (Optional[dict[str, list[int]]], optional): The event colors in the `ALERT_COLORS`
+            format. Defaults to `Config.ALERT_COLORS`.
 
     Returns:
-        int: The status code returned from calling the Discord webhook.
+        dict: The webhook payload.
     """
-    alert = Box(alert)
+    alert = as_alert(alert)
 
     title = alert.properties.event.upper()
     if alert.properties.messageType.lower() == "update":
         title += " (UPDATE)"
 
-    color = get_color_from_event(alert)
+    color = get_color_from_event(alert, colors)
 
-    description = alert.properties.description
+    description = alert.properties.description or ""
     if len(description) > 1010:
         description = description[:1007]
         if description[-1] in ' \\':
@@ -299,8 +423,7 @@ def notify_discord_webhook(alert: Union[dict, Box], image: str, webhook_url: str
     
     description = f"```\n{description}\n```"
 
-    template = env.get_template("embeds_01.j2")
-    content = template.render(
+    content = env.get_template(template).render(
         title=title,
         headline=alert.properties.headline,
         url=alert.id,
@@ -311,21 +434,4 @@ def notify_discord_webhook(alert: Union[dict, Box], image: str, webhook_url: str
         description=description,
         tornado_possible=alert.properties.parameters.get("tornadoDetection", False),
     )
-    content=json.loads(content, strict=False)
-
-    for i in range(3):
-        r = requests.post(webhook_url, json=content)
-        if r.status_code != 204:
-            logging.info(f"Could not trigger webhook, status code '{r.status_code}', retrying.")
-            time.sleep(2)
-        else:
-            logging.info(f"Webhook triggered, return code: {r.status_code}")
-            return r.status_code
-
-    logging.warning(f"Failed to send Discord webhook! Response: {r.content.decode()}")
-    error_file = f"error_{str(uuid4())}.txt"
-    with open(error_file, "w") as f:
-        f.write(json.dumps(content))
-        
-    logging.warning(f'Embed content saved as "{error_file}"')
-    return r.status_code
+    return json.loads(content, strict=False)
@@ -0,0 +1,132 @@
+import math
+from typing import Sequence
+
+import numpy as np
+import shapely
+from shapely.geometry.polygon import orient
+
+from alerts import Alert
+from counties import CountyStore, county_store, same_to_fips
+
+# Radius of the web Mercator sphere in meters, and the latitude where the projection is square.
+EARTH_RADIUS = 6378137.
+MAX_LATITUDE = 85.0511287798
+
+# Every function works on (N, 4) arrays of west, south, east, and north bounds, one row per
+# alert, so a whole poll's worth of alerts is handled at once.
+
+
+def alert_bounds(alerts: Sequence[Alert], counties: CountyStore = county_store) -> np.ndarray:
+    """Return the bounds of every alert.  Alerts with polygons are bounded by the exterior ring
+    of every polygon, whether the geometry was a Polygon, MultiPolygon, or GeometryCollection.
+    Alerts without polygons are bounded by the counties in their SAME codes.
+
+    Args:
+        alerts (Sequence[Alert]): The NWS alerts.
+        counties (CountyStore, optional): The county geometries. Defaults to `county_store`.
+
+    Returns:
+        np.ndarray: The (N, 4) bounds.  Rows are NaN for alerts that have no known area.
+    """
+    result = np.full((len(alerts), 4), np.nan)
+    rings, owners = list(), list()
+    for i, alert in enumerate(alerts):
+        if alert.geometry is None:
+            result[i] = counties.bounds(same_to_fips(alert.properties.geocode.get("SAME", [])))
+            continue
+        for polygon in alert.geometry.polygons:
+            if len(polygon[0]):
+                rings.append(polygon[0])
+                owners.append(i)
+    if not rings:
+        return result
+
+    # Reduce every coordinate to a bound per ring, then every ring to a bound per alert.
+    lengths = np.fromiter(map(len, rings), dtype=np.int64, count=len(rings))
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    coordinates = np.concatenate(rings)
+    lower = np.minimum.reduceat(coordinates, starts)
+    upper = np.maximum.reduceat(coordinates, starts)
+
+    owners = np.asarray(owners)
+    first = np.flatnonzero(np.concatenate(([True], owners[1:] != owners[:-1])))
+    result[owners[first], :2] = np.minimum.reduceat(lower, first)
+    result[owners[first], 2:] = np.maximum.reduceat(upper, first)
+    return result
+
+
+def zoom(bounds: np.ndarray, factor: float) -> np.ndarray:
+    """Scale bounds around their centers.
+
+    Args:
+        bounds (np.ndarray): The (N, 4) bounds.
+        factor (float): The zoom factor.  Values below 1 zoom out, above 1 zoom in.
+
+    Returns:
+        np.ndarray: The zoomed (N, 4) bounds.
+    """
+    bounds = np.asarray(bounds, dtype=np.float64)
+    center = (bounds[:, :2] + bounds[:, 2:]) / 2
+    half = np.abs(bounds[:, 2:] - bounds[:, :2]) / factor / 2
+    return np.hstack([center - half, center + half])
+
+
+def set_aspect(bounds: np.ndarray, ratio: float) -> np.ndarray:
+    """Grow bounds to an aspect ratio in degrees.  This only suits maps drawn in the
+    PlateCarree coordinate system.
+
+    Args:
+        bounds (np.ndarray): The (N, 4) bounds.
+        ratio (float): The aspect ratio (width / height).
+
+    Returns:
+        np.ndarray: The (N, 4) bounds.
+    """
+    return _set_aspect(np.asarray(bounds, dtype=np.float64), ratio)
+
+
+def mercator_extent(bounds: np.ndarray, ratio: float) -> np.ndarray:
+    """Project bounds into web Mercator coordinates and grow them to an aspect ratio.  A map
+    drawn with this extent fills the whole figure.
+
+    Args:
+        bounds (np.ndarray): The (N, 4) bounds in degrees.
+        ratio (float): The aspect ratio (width / height) of the map.
+
+    Returns:
+        np.ndarray: The (N, 4) extents in meters, as west, south, east, and north.
+    """
+    bounds = np.asarray(bounds, dtype=np.float64)
+    projected = np.empty_like(bounds)
+    projected[:, 0::2] = np.radians(bounds[:, 0::2]) * EARTH_RADIUS
+    lat = np.radians(np.clip(bounds[:, 1::2], -MAX_LATITUDE, MAX_LATITUDE))
+    projected[:, 1::2] = EARTH_RADIUS * np.log(np.tan(math.pi / 4 + lat / 2))
+    return _set_aspect(projected, ratio)
+
+
+def _set_aspect(bounds: np.ndarray, ratio: float) -> np.ndarray:
+    center = (bounds[:, :2] + bounds[:, 2:]) / 2
+    width = np.abs(bounds[:, 2] - bounds[:, 0])
+    height = np.abs(bounds[:, 3] - bounds[:, 1])
+    wide = width >= height * ratio
+    width, height = np.where(wide, width, height * ratio), np.where(wide, width / ratio, height)
+    half = np.column_stack([width, height]) / 2
+    return np.hstack([center - half, center + half])
+
+
+def shapes(alert: Alert) -> list[shapely.Polygon]:
+    """Return every polygon of an alert, holes included.  Polygons with holes are oriented
+    so the holes wind the opposite way from the exterior and stay unfilled when drawn.
+
+    Args:
+        alert (Alert): The NWS alert.
+
+    Returns:
+        list[shapely.Polygon]: The polygons, empty for alerts without any.
+    """
+    if alert.geometry is None:
+        return list()
+    return [
+        orient(shapely.Polygon(polygon[0], polygon[1:])) if len(polygon) > 1 else shapely.Polygon(polygon[0])
+        for polygon in alert.geometry.polygons
+    ]
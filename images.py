@@ -0,0 +1,128 @@
+import heapq
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterable
+
+from pymongo.collection import Collection
+
+from alert_index import as_utc
+
+
+def thumbnail_name(file_name: str, width: int) -> str:
+    """Return the name of a thumbnail of a rendered image.
+
+    Args:
+        file_name (str): The name of the full size image.
+        width (int): The width of the thumbnail in pixels.
+
+    Returns:
+        str: The name of the thumbnail.
+    """
+    path = Path(file_name)
+    return f"{path.stem}_{width}{path.suffix}"
+
+
+class ImageRegistry:
+    """Tracks which alerts use each rendered image and when the image can be deleted.  An image
+    is kept until the last alert using it has been expired for `retention`.  Deletions are
+    scheduled on a min-heap so a cleanup only touches the images that are due.
+
+    Attributes:
+        coll (Collection): The collection the registry is persisted to.
+        path (Path): The directory the images are saved in.
+        retention (timedelta): How long to keep an image after its last alert expires.
+        thumbnail_widths (list[int]): The widths of the thumbnails saved next to each image.
+    """
+    coll: Collection
+    path: Path
+    retention: timedelta
+    thumbnail_widths: list[int]
+
+    def __init__(self, coll: Collection, path: str, retention: timedelta, thumbnail_widths: Iterable[int] = ()):
+        """Create an ImageRegistry object.
+
+        Args:
+            coll (Collection): The collection to persist the registry to.
+            path (str): The directory the images are saved in.
+            retention (timedelta): How long to keep an image after its last alert expires.
+            thumbnail_widths (Iterable[int], optional): The widths of the thumbnails saved next to
+                each image, which are deleted along with it. Defaults to none.
+        """
+        self.coll = coll
+        self.path = Path(path)
+        self.retention = retention
+        self.thumbnail_widths = list(thumbnail_widths)
+        self._heap: list[tuple[datetime, str]] = list()
+        self._delete_after: dict[str, datetime] = dict()
+        self._lock = threading.Lock()
+
+    def load(self) -> int:
+        """Rebuild the deletion schedule from the collection.
+
+        Returns:
+            int: The number of images being tracked.
+        """
+        delete_after = {
+            doc["_id"]: as_utc(doc["delete_after"])
+            for doc in self.coll.find({}, {"delete_after": 1})
+        }
+        with self._lock:
+            self._delete_after = delete_after
+            self._heap = [(v, k) for k, v in delete_after.items()]
+            heapq.heapify(self._heap)
+        return len(delete_after)
+
+    def register(self, image: str, alert_id: str, expires: datetime) -> None:
+        """Record that an alert uses an image.
+
+        Args:
+            image (str): The name of the image.
+            alert_id (str): The NWS alert ID.
+            expires (datetime): When the alert expires.
+        """
+        delete_after = as_utc(expires) + self.retention
+        with self._lock:
+            current = self._delete_after.get(image)
+            if current is None or delete_after > current:
+                self._delete_after[image] = delete_after
+                heapq.heappush(self._heap, (delete_after, image))
+        self.coll.update_one(
+            {"_id": image},
+            {"$addToSet": {"alerts": alert_id}, "$max": {"delete_after": delete_after}},
+            upsert=True,
+        )
+
+    def __contains__(self, image: str) -> bool:
+        return image in self._delete_after
+
+    def __len__(self) -> int:
+        return len(self._delete_after)
+
+    def clean(self, now: datetime) -> int:
+        """Delete every image that is due for deletion.
+
+        Args:
+            now (datetime): The current time.
+
+        Returns:
+            int: The number of images deleted.
+        """
+        due = list()
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                delete_after, image = heapq.heappop(self._heap)
+                # Images that were reused get a new heap entry, skip the stale ones.
+                if self._delete_after.get(image) == delete_after:
+                    del self._delete_after[image]
+                    due.append(image)
+
+        for image in due:
+            # Remove the image along with its thumbnails.  Thumbnails of widths no longer
+            # configured are left to `clean_untracked_images`.
+            for name in [image, *(thumbnail_name(image, w) for w in self.thumbnail_widths)]:
+                (self.path / name).unlink(missing_ok=True)
+        if due:
+            self.coll.delete_many({"_id": {"$in": due}})
+        return len(due)
+
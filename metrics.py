@@ -0,0 +1,270 @@
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter
+from typing import Iterator, Optional
+
+log = logging.getLogger("rich")
+
+# Default histogram buckets in seconds, sized around the 10 second poll interval.
+SECONDS_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10., 30., 60.)
+
+_metrics: dict[str, "Metric"] = dict()
+_local = threading.local()
+
+
+class Metric:
+    """A metric exposed in the Prometheus text format, with one value per set of label values.
+
+    Attributes:
+        name (str): The metric name.
+        help (str): The description of the metric.
+        labels (tuple[str, ...]): The label names.
+    """
+    name: str
+    help: str
+    labels: tuple[str, ...]
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        """Create and register a Metric object.
+
+        Args:
+            name (str): The metric name.
+            help (str): The description of the metric.
+            labels (tuple[str, ...], optional): The label names. Defaults to no labels.
+        """
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: dict[tuple[str, ...], object] = dict()
+        self._lock = threading.Lock()
+        _metrics[name] = self
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"Metric '{self.name}' takes the labels {self.labels}, got {tuple(labels)}.")
+        return tuple(str(labels[i]) for i in self.labels)
+
+    def _record(self, value: float, labels: dict[str, str]) -> bool:
+        # Inside `capture` the value is kept for the caller instead of being applied here.
+        captured = getattr(_local, "captured", None)
+        if captured is None:
+            return False
+        captured.append((self.name, labels, value))
+        return True
+
+    def _label_text(self, key: tuple[str, ...], extra: str = "") -> str:
+        pairs = [f'{k}="{_escape(v)}"' for k, v in zip(self.labels, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> list[str]:
+        """Return the metric in the Prometheus text format.
+
+        Returns:
+            list[str]: The lines of the metric.
+        """
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key: tuple[str, ...], value) -> list[str]:
+        return [f"{self.name}{self._label_text(key)} {_number(value)}"]
+
+
+class Counter(Metric):
+    """A count that only goes up."""
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """Increase the count.
+
+        Args:
+            amount (float, optional): The amount to add. Defaults to 1.
+            **labels (str): The label values.
+        """
+        if self._record(amount, labels):
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    _apply = inc
+
+
+class Gauge(Metric):
+    """A value that can go up and down."""
+    type = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        """Set the value.
+
+        Args:
+            value (float): The new value.
+            **labels (str): The label values.
+        """
+        if self._record(value, labels):
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    _apply = set
+
+
+class Histogram(Metric):
+    """The distribution of observed values, counted into cumulative buckets.
+
+    Attributes:
+        buckets (tuple[float, ...]): The upper bounds of the buckets.
+    """
+    buckets: tuple[float, ...]
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = SECONDS_BUCKETS):
+        """Create and register a Histogram object.
+
+        Args:
+            name (str): The metric name.
+            help (str): The description of the metric.
+            labels (tuple[str, ...], optional): The label names. Defaults to no labels.
+            buckets (tuple[float, ...], optional): The upper bounds of the buckets. Defaults to `SECONDS_BUCKETS`.
+        """
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels: str) -> None:
+        """Record a value.
+
+        Args:
+            value (float): The observed value.
+            **labels (str): The label values.
+        """
+        if self._record(value, labels):
+            return
+        key = self._key(labels)
+        with self._lock:
+            # Bucket counts, then the sum and count of every observation.
+            state = self._values.setdefault(key, [0] * len(self.buckets) + [0., 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    _apply = observe
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe how long the body of a `with` block takes in seconds.
+
+        Args:
+            **labels (str): The label values.
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start, **labels)
+
+    def _render_value(self, key: tuple[str, ...], value) -> list[str]:
+        *counts, total, count = value
+        lines = [
+            f"{self.name}_bucket{self._label_text(key, f'le="{_number(bound)}"')} {n}"
+            for bound, n in zip(self.buckets, counts)
+        ]
+        lines.append(f"{self.name}_bucket{self._label_text(key, 'le="+Inf"')} {count}")
+        lines.append(f"{self.name}_sum{self._label_text(key)} {_number(total)}")
+        lines.append(f"{self.name}_count{self._label_text(key)} {count}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+@contextmanager
+def capture() -> Iterator[list[tuple[str, dict, float]]]:
+    """Hold back every metric recorded by this thread inside of the `with` block.  Render workers
+    use this to send their metrics back to the updater process, which passes them to `replay`.
+
+    Yields:
+        list[tuple[str, dict, float]]: The metric name, labels, and value of each recorded metric.
+    """
+    previous = getattr(_local, "captured", None)
+    _local.captured = list()
+    try:
+        yield _local.captured
+    finally:
+        _local.captured = previous
+
+
+def replay(captured: list[tuple[str, dict, float]]) -> None:
+    """Apply metrics held back by `capture` in another process.
+
+    Args:
+        captured (list[tuple[str, dict, float]]): The metrics yielded by `capture`.
+    """
+    for name, labels, value in captured:
+        metric = _metrics.get(name)
+        if metric is not None:
+            metric._apply(value, **labels)
+
+
+def render() -> str:
+    """Return every registered metric in the Prometheus text format.
+
+    Returns:
+        str: The metrics page.
+    """
+    lines = list()
+    for metric in list(_metrics.values()):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+def serve(port: int, address: str = "0.0.0.0") -> Optional[ThreadingHTTPServer]:
+    """Serve the metrics page at `/metrics` from a background thread.
+
+    Args:
+        port (int): The port to listen on.
+        address (str, optional): The address to listen on. Defaults to "0.0.0.0".
+
+    Returns:
+        Optional[ThreadingHTTPServer]: The server, or None if the port could not be opened.
+    """
+    try:
+        server = ThreadingHTTPServer((address, port), _MetricsHandler)
+    except OSError as e:
+        log.warning(f"Unable to serve metrics on port {port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    log.info(f"Serving metrics on http://{address}:{port}/metrics")
+    return server
@@ -0,0 +1,67 @@
+import logging
+from datetime import datetime
+from typing import Union
+
+from dateutil.parser import parse
+
+log = logging.getLogger("rich")
+
+TIMESTAMP_FIELDS = ["sent", "effective", "onset", "expires", "ends"]
+
+
+def parse_timestamp(value: Union[str, datetime]) -> datetime:
+    """Parse a timestamp from the NWS API.  The NWS always sends ISO-8601 timestamps with an
+    offset, so `datetime.fromisoformat` is tried before falling back to dateutil.
+
+    Args:
+        value (Union[str, datetime]): The timestamp.  Datetimes are returned as-is.
+
+    Raises:
+        TypeError: The value was None.
+
+    Returns:
+        datetime: The parsed timestamp.
+    """
+    if isinstance(value, datetime):
+        return value
+    if value is None:
+        raise TypeError("Timestamp is None.")
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return parse(value)
+
+
+def normalize_timestamps(properties: dict) -> bool:
+    """Convert the timestamp properties of an alert into datetimes in place.  Properties that
+    are already datetimes are left alone.
+
+    Args:
+        properties (dict): The alert properties.
+
+    Returns:
+        bool: Whether the alert had all of the required timestamps (only 'ends' may be missing).
+    """
+    for field in TIMESTAMP_FIELDS:
+        try:
+            properties[field] = parse_timestamp(properties[field])
+        except (TypeError, KeyError):
+            if field != "ends":
+                return False
+    return True
+
+
+def process_description(desc: str) -> str:
+    """Remove all unneeded newlines from the string and replace with spaces.
+
+    Args:
+        desc (str): The string to process.
+
+    Returns:
+        str: The description with all the single newlines being replaced with spaces.
+    """
+    try:
+        return "\n\n".join([i.replace("\n", ' ') for i in desc.split("\n\n")])
+    except AttributeError:
+        log.debug("Alert contained no description!")
+        return str()
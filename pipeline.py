@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import signal
+from typing import Callable, Optional
+
+from alerts import Alert
+from metrics import Gauge
+from renderer import RenderPool
+
+log = logging.getLogger("rich")
+
+QUEUE_DEPTH = Gauge("pipeline_queue_depth", "Alerts waiting in front of each pipeline stage.", ("stage",))
+
+
+class Pipeline:
+    """An asyncio pipeline that moves alerts from the NWS API through rendering and on to
+    notification.  A single poller feeds bounded queues, so a slow stage holds back the
+    stages in front of it instead of piling up work.
+
+    Stages:
+        poll:   `fetch` is called every `interval` seconds and never overlaps itself.
+        render: Alerts are submitted to the render pool in the order they were received.
+        notify: `notify` is called with each alert and its rendered image.
+
+    Attributes:
+        interval (float): Seconds between polls.
+        notify_concurrency (int): The number of notifications sent at once.  Values above 1
+            no longer guarantee notifications go out in order.
+    """
+    interval: float
+    notify_concurrency: int
+
+    def __init__(self, fetch: Callable[[], list[Alert]], notify: Callable[[Alert, Optional[str]], None],
+                 render_pool: RenderPool, interval: float = 10., queue_size: int = 64,
+                 notify_concurrency: int = 1):
+        """Create a Pipeline object.
+
+        Args:
+            fetch (Callable[[], list[Alert]]): Polls the API and returns the new alerts to render.
+            notify (Callable[[Alert, Optional[str]], None]): Sends the notification for an alert and
+                its image, which is None if the render failed.
+            render_pool (RenderPool): The pool used to render the alert maps.
+            interval (float, optional): Seconds between polls. Defaults to 10.0.
+            queue_size (int, optional): The size of the queues between stages. Defaults to 64.
+            notify_concurrency (int, optional): The number of notifications sent at once. Defaults to 1.
+        """
+        self.fetch = fetch
+        self.notify = notify
+        self.render_pool = render_pool
+        self.interval = interval
+        self.notify_concurrency = notify_concurrency
+
+        self.render_queue: asyncio.Queue = asyncio.Queue(queue_size)
+        self.notify_queue: asyncio.Queue = asyncio.Queue(queue_size)
+        self._periodic: list[tuple[float, Callable[[], object]]] = list()
+        self._stop: Optional[asyncio.Event] = None
+
+    def every(self, interval: float, func: Callable[[], object]) -> None:
+        """Run a blocking job periodically while the pipeline runs.  Runs never overlap.
+
+        Args:
+            interval (float): Seconds between runs.
+            func (Callable[[], object]): The job to run.
+        """
+        self._periodic.append((interval, func))
+
+    @property
+    def depths(self) -> dict[str, int]:
+        """Return the number of alerts waiting in front of each stage.
+
+        Returns:
+            dict[str, int]: The queue depths keyed by stage.
+        """
+        return {"render": self.render_queue.qsize(), "notify": self.notify_queue.qsize()}
+
+    def stop(self) -> None:
+        """Stop polling and let the alerts already in the pipeline drain."""
+        if self._stop is not None:
+            self._stop.set()
+
+    async def _sleep(self, seconds: float) -> bool:
+        # Returns True when the pipeline was stopped while sleeping.
+        try:
+            await asyncio.wait_for(self._stop.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def _poll(self) -> None:
+        while not self._stop.is_set():
+            try:
+                alerts = await asyncio.to_thread(self.fetch)
+            except Exception:
+                log.exception("Polling the NWS API failed.")
+                alerts = list()
+            for alert in alerts:
+                await self.render_queue.put(alert)
+            if await self._sleep(self.interval):
+                break
+
+    async def _render(self) -> None:
+        while True:
+            alert = await self.render_queue.get()
+            QUEUE_DEPTH.set(self.render_queue.qsize(), stage="render")
+            try:
+                # Submitting blocks while the render pool is full, so keep it off the event loop.
+                future = await asyncio.to_thread(self.render_pool.submit, alert)
+                await self.notify_queue.put((alert, future))
+            except Exception:
+                log.exception(f"Unable to queue render for alert: {alert.id}")
+            finally:
+                self.render_queue.task_done()
+
+    async def _notify(self) -> None:
+        while True:
+            alert, future = await self.notify_queue.get()
+            QUEUE_DEPTH.set(self.notify_queue.qsize(), stage="notify")
+            try:
+                image = await asyncio.to_thread(self.render_pool.result, future)
+                await asyncio.to_thread(self.notify, alert, image)
+            except Exception:
+                log.exception(f"Unable to send notification for alert: {alert.id}")
+            finally:
+                self.notify_queue.task_done()
+
+    async def _run_periodic(self, interval: float, func: Callable[[], object]) -> None:
+        while not await self._sleep(interval):
+            try:
+                await asyncio.to_thread(func)
+            except Exception:
+                log.exception(f"Periodic job '{func.__name__}' failed.")
+
+    async def run(self) -> None:
+        """Run the pipeline until SIGINT or SIGTERM, then drain the alerts already queued."""
+        self._stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stop)
+
+        workers = [asyncio.create_task(self._render())]
+        workers += [asyncio.create_task(self._notify()) for _ in range(self.notify_concurrency)]
+        periodic = [asyncio.create_task(self._run_periodic(i, f)) for i, f in self._periodic]
+
+        await self._poll()
+
+        log.info(f"Shutting down, draining queued alerts: {self.depths}")
+        await self.render_queue.join()
+        await self.notify_queue.join()
+        for task in workers + periodic:
+            task.cancel()
+        await asyncio.gather(*workers, *periodic, return_exceptions=True)
+        await asyncio.to_thread(self.render_pool.shutdown)
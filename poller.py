@@ -0,0 +1,140 @@
+import hashlib
+import logging
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import Counter, Histogram
+
+log = logging.getLogger("rich")
+
+POLL_SECONDS = Histogram("nws_poll_seconds", "Time taken by NWS API requests.")
+POLLS = Counter("nws_polls_total", "NWS API polls by result.", ("result",))
+
+
+class PollResult:
+    """The possible outcomes of a single poll against the NWS API."""
+    FETCHED = "fetched"
+    NOT_MODIFIED = "not_modified"
+    UNCHANGED = "unchanged"
+    ERROR = "error"
+
+
+class AlertPoller:
+    """A polling client for the NWS API that keeps a persistent, pooled session and only
+    hands back a payload when the data has actually changed.  A fetched payload only counts as
+    seen once the caller has processed it and called `commit`, until then every poll fetches it
+    again.
+
+    Attributes:
+        url (str): The URL to poll.
+        headers (dict): The headers to send with every request.
+        params (dict): The query parameters to send with every request.
+        stats (dict[str, int]): The number of times each `PollResult` has occurred.
+    """
+    url: str
+    headers: dict
+    params: dict
+    stats: dict[str, int]
+
+    def __init__(self, url: str, headers: Optional[dict] = None, params: Optional[dict] = None,
+                 pool_size: int = 4, timeout: float = 10.):
+        """Create an AlertPoller object.
+
+        Args:
+            url (str): The URL to poll.
+            headers (dict, optional): The headers to send with every request. Defaults to None.
+            params (dict, optional): The query parameters to send with every request. Defaults to None.
+            pool_size (int, optional): The number of pooled connections to keep alive. Defaults to 4.
+            timeout (float, optional): The request timeout in seconds. Defaults to 10.0.
+        """
+        self.url = url
+        self.headers = dict(headers or {})
+        self.params = dict(params or {})
+        self.timeout = timeout
+        self.stats = {i: 0 for i in (PollResult.FETCHED, PollResult.NOT_MODIFIED,
+                                     PollResult.UNCHANGED, PollResult.ERROR)}
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._etag: Optional[str] = None
+        self._last_modified: Optional[str] = None
+        self._digest: Optional[str] = None
+        self._fetched: Optional[tuple[Optional[str], Optional[str], str]] = None
+
+    def reset(self) -> None:
+        """Forget the cached validators so the next poll always returns a payload."""
+        self._etag = None
+        self._last_modified = None
+        self._digest = None
+        self._fetched = None
+
+    def commit(self) -> None:
+        """Save the validators of the last fetched payload once it has been processed, so later
+        polls skip it until the data changes.
+        """
+        if self._fetched is not None:
+            self._etag, self._last_modified, self._digest = self._fetched
+            self._fetched = None
+
+    def poll(self) -> tuple[str, Optional[bytes]]:
+        """Poll the API once using a conditional request.
+
+        Returns:
+            tuple[str, Optional[bytes]]: The `PollResult` of the poll and the response body.  The
+                body is only returned when the result is `PollResult.FETCHED`, and `commit` has
+                to be called once it is processed.
+        """
+        headers = dict(self.headers)
+        if self._etag:
+            headers["If-None-Match"] = self._etag
+        if self._last_modified:
+            headers["If-Modified-Since"] = self._last_modified
+
+        try:
+            with POLL_SECONDS.time():
+                r = self.session.get(self.url, headers=headers, params=self.params, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            log.warning(f"Unable to connect to the National Weather Service API: {e}")
+            return self._record(PollResult.ERROR), None
+
+        if r.status_code == 304:
+            return self._record(PollResult.NOT_MODIFIED), None
+
+        if r.status_code != 200:
+            log.warning(f"NWS API returned status code '{r.status_code}'.")
+            return self._record(PollResult.ERROR), None
+
+        digest = hashlib.sha1(r.content).hexdigest()
+        if digest == self._digest:
+            self._update_validators(r)
+            return self._record(PollResult.UNCHANGED), None
+
+        self._fetched = (r.headers.get("ETag", self._etag), r.headers.get("Last-Modified", self._last_modified), digest)
+        return self._record(PollResult.FETCHED), r.content
+
+    def _update_validators(self, r: requests.Response) -> None:
+        self._etag = r.headers.get("ETag", self._etag)
+        self._last_modified = r.headers.get("Last-Modified", self._last_modified)
+
+    def _record(self, result: str) -> str:
+        self.stats[result] += 1
+        POLLS.inc(result=result)
+        return result
+
+    @property
+    def total(self) -> int:
+        """Return the total number of polls made.
+
+        Returns:
+            int: The number of polls.
+        """
+        return sum(self.stats.values())
+
+    def __str__(self) -> str:
+        stats = ', '.join(f"{k}={v}" for k, v in self.stats.items())
+        return f'<AlertPoller(total={self.total}, {stats})>'
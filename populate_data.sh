@@ -6,3 +6,7 @@ wget https://prd-tnm.s3.amazonaws.com/StagedProducts/Small-scale/data/Boundaries
 
 tar zxvf countyl010g_shp_nt00964.tar.gz
 rm *tar.gz *xml
+
+# Build the county geometry and county line stores used by the renderer.
+cd ..
+poetry run python counties.py || echo "Unable to build the county stores, they will be built on first use."
@@ -0,0 +1,78 @@
+import json
+import zlib
+from typing import Union
+
+from alerts import Alert
+from bson import Binary
+from pymongo import ASCENDING
+from pymongo.collection import Collection
+
+# Alert properties stored as regular fields.  Everything else, including the geometry, is
+# compressed into the 'details' field since it is only needed to rebuild the full alert.
+SLIM_PROPERTIES = [
+    "id", "areaDesc", "geocode", "sent", "effective", "onset", "expires", "ends", "status",
+    "messageType", "category", "severity", "certainty", "urgency", "event", "senderName",
+    "headline", "response",
+]
+# The index `AlertIndex.load` scans instead of the collection, it holds every field the scan reads.
+ID_EXPIRES_INDEX = [("id", ASCENDING), ("properties.expires", ASCENDING)]
+
+
+def create_indexes(coll: Collection) -> None:
+    """Create the indexes used by the updater on the alerts collection.
+
+    Args:
+        coll (Collection): The alerts collection.
+    """
+    coll.create_index("id", unique=True)
+    # Mongo removes alerts on its own once they expire.
+    coll.create_index("properties.expires", expireAfterSeconds=0)
+    coll.create_index(ID_EXPIRES_INDEX)
+
+
+def slim_record(feature: Union[dict, Alert]) -> dict:
+    """Build the document stored in the database for an alert.
+
+    Args:
+        feature (Union[dict, Alert]): The NWS alert, with its timestamps already parsed.
+
+    Returns:
+        dict: The document with the bulky fields compressed.
+    """
+    if isinstance(feature, Alert):
+        feature = feature.to_dict()
+    properties = feature["properties"]
+
+    details = {
+        "geometry": feature.get("geometry"),
+        "properties": {k: v for k, v in properties.items() if k not in SLIM_PROPERTIES},
+    }
+    return {
+        "id": feature["id"],
+        "type": feature.get("type", "Feature"),
+        "properties": {k: properties[k] for k in SLIM_PROPERTIES if k in properties},
+        "details": Binary(zlib.compress(json.dumps(details, default=str).encode())),
+    }
+
+
+def expand_record(doc: dict) -> Alert:
+    """Rebuild the full alert from a document stored in the database.
+
+    Args:
+        doc (dict): The stored document.
+
+    Returns:
+        Alert: The NWS alert.
+    """
+    if "details" not in doc:
+        # Documents stored before the slim format are already complete.
+        return Alert.from_feature(doc)
+
+    details = json.loads(zlib.decompress(doc["details"]))
+    properties = dict(doc["properties"])
+    properties.update(details["properties"])
+    return Alert.from_feature({
+        "id": doc["id"],
+        "geometry": details["geometry"],
+        "properties": properties,
+    })
@@ -0,0 +1,194 @@
+import cProfile
+import logging
+import multiprocessing
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Optional
+
+import metrics
+from alerts import Alert
+from config import Config
+
+log = logging.getLogger("rich")
+
+
+def _init_worker() -> None:
+    """Load the county data once when a render worker starts."""
+    from counties import county_lines, county_store
+    county_store.load()
+    county_lines.load()
+
+
+def _render(alert: Alert) -> tuple[Optional[str], list]:
+    """Render a single alert inside of a worker process.  A `RENDER_PROFILE_RATE` share of the
+    renders are run under cProfile when `RENDER_PROFILE_PATH` is set.
+
+    Args:
+        alert (Alert): The NWS alert.
+
+    Returns:
+        tuple[Optional[str], list]: The filename of the rendered image, or None if unable to render
+            the image, and the metrics recorded while rendering.
+    """
+    from generate import generate_image
+    with metrics.capture() as captured:
+        if Config.RENDER_PROFILE_PATH and random.random() < Config.RENDER_PROFILE_RATE:
+            profiler = cProfile.Profile()
+            image = profiler.runcall(generate_image, alert)
+            path = Path(Config.RENDER_PROFILE_PATH)
+            path.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(path / f"render-{time.time_ns()}-{os.getpid()}.prof")
+        else:
+            image = generate_image(alert)
+    return image, captured
+
+
+class RenderPool:
+    """A fixed pool of worker processes that render alert maps.  Every worker has its own
+    copy of matplotlib, so renders never share pyplot state.
+
+    Attributes:
+        workers (int): The number of worker processes.
+        timeout (float): How long to wait on a single render in seconds.
+        max_pending (int): The maximum number of queued and running render jobs.
+    """
+    workers: int
+    timeout: float
+    max_pending: int
+
+    def __init__(self, workers: int = 2, timeout: float = 60., max_pending: int = 16):
+        """Create a RenderPool object.  The worker processes are started on the first submit.
+
+        Args:
+            workers (int, optional): The number of worker processes. Defaults to 2.
+            timeout (float, optional): How long to wait on a single render in seconds. Defaults to 60.0.
+            max_pending (int, optional): The maximum number of queued and running render jobs. Defaults to 16.
+        """
+        self.workers = workers
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                )
+            return self._executor
+
+    def _reset_executor(self, executor: ProcessPoolExecutor, terminate: bool = False) -> None:
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        if terminate:
+            # A hung render never returns on its own, the worker has to be killed to free it.
+            for process in list((executor._processes or {}).values()):
+                process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, alert: Alert, retry: bool = True) -> Future:
+        """Queue an alert to be rendered.  Blocks while `max_pending` jobs are already queued.
+        The render's `timeout` starts counting when it is submitted.
+
+        Args:
+            alert (Alert): The NWS alert.
+            retry (bool, optional): Whether `result` renders the alert again if its worker
+                process dies. Defaults to True.
+
+        Returns:
+            Future: The future to pass to `result`.
+        """
+        self._slots.acquire()
+        executor = self._get_executor()
+        try:
+            future = executor.submit(_render, alert)
+        except BrokenProcessPool:
+            log.warning("Render pool broke, restarting the worker processes.")
+            self._reset_executor(executor)
+            try:
+                executor = self._get_executor()
+                future = executor.submit(_render, alert)
+            except Exception:
+                self._slots.release()
+                raise
+        except Exception:
+            self._slots.release()
+            raise
+        # The slot is released when the job finishes, or by `result` if it times out.
+        released = threading.Lock()
+
+        def release(_=None):
+            if released.acquire(blocking=False):
+                self._slots.release()
+
+        future.deadline = time.monotonic() + self.timeout
+        future.executor = executor
+        future.alert = alert
+        future.retry = retry
+        future.release = release
+        future.add_done_callback(release)
+        return future
+
+    def result(self, future: Future) -> Optional[str]:
+        """Wait on a render job submitted to the pool, up to `timeout` after it was submitted.
+        A job that times out has its worker processes killed and replaced, since a hung render
+        would otherwise hold a worker and a pending slot forever.  The other jobs running in the
+        killed workers, or beside a worker that crashed, are rendered again once.
+
+        Args:
+            future (Future): The future returned by `submit`.
+
+        Returns:
+            Optional[str]: The filename of the rendered image, or None if the render failed or timed out.
+        """
+        try:
+            image, captured = future.result(timeout=max(future.deadline - time.monotonic(), 0))
+            metrics.replay(captured)
+            return image
+        except FutureTimeoutError:
+            log.warning(f"Render job timed out after {self.timeout} seconds, restarting the worker processes.")
+            if not future.cancel():
+                self._reset_executor(future.executor, terminate=True)
+            future.release()
+        except BrokenProcessPool:
+            self._reset_executor(future.executor)
+            if future.retry:
+                log.warning(f"Render worker died while rendering, rendering again: {future.alert.id}")
+                return self.result(self.submit(future.alert, retry=False))
+            log.warning("Render worker died while rendering.")
+        except Exception as e:
+            log.warning(f"Render job failed: {e}")
+        return None
+
+    def render(self, alert: Alert) -> Optional[str]:
+        """Render an alert and wait on the result.
+
+        Args:
+            alert (Alert): The NWS alert.
+
+        Returns:
+            Optional[str]: The filename of the rendered image, or None if unable to render the image.
+        """
+        return self.result(self.submit(alert))
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop all of the worker processes.
+
+        Args:
+            wait (bool, optional): Whether to wait on the running jobs to finish. Defaults to True.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=not wait)
@@ -0,0 +1,123 @@
+from typing import Optional, Union
+
+from alerts import Alert
+from config import Config
+from filters import AlertFilter
+from generate import DEFAULT_TEMPLATE
+from metrics import Counter
+
+ROUTED = Counter("alert_routes_total", "Alerts routed to each destination.", ("destination",))
+
+
+class Destination:
+    """A webhook that alerts are sent to, with its own filter, colors, and embed template.
+
+    Attributes:
+        name (str): The name of the destination, used in logs and metrics.
+        webhook (str): The Discord webhook URL.
+        filter (AlertFilter): The alerts sent to this destination.
+        colors (dict[str, list[int]]): The event colors in the `ALERT_COLORS` format.
+        template (str): The name of the embed template.
+    """
+    name: str
+    webhook: str
+    filter: AlertFilter
+    colors: dict[str, list[int]]
+    template: str
+
+    def __init__(self, name: str, webhook: str, filter: AlertFilter,
+                 colors: dict[str, list[int]], template: str = DEFAULT_TEMPLATE):
+        """Create a Destination object.
+
+        Args:
+            name (str): The name of the destination.
+            webhook (str): The Discord webhook URL.
+            filter (AlertFilter): The alerts sent to this destination.
+            colors (dict[str, list[int]]): The event colors in the `ALERT_COLORS` format.
+            template (str, optional): The name of the embed template. Defaults to `DEFAULT_TEMPLATE`.
+        """
+        self.name = name
+        self.webhook = webhook
+        self.filter = filter
+        self.colors = colors
+        self.template = template
+
+    @classmethod
+    def from_config(cls, entry: dict) -> "Destination":
+        """Create a Destination from an entry of the `DESTINATIONS` configuration.  Anything the
+        entry leaves out comes from `FILTER_RULES`, `ALERT_COLORS`, and `DEFAULT_TEMPLATE`.
+
+        Args:
+            entry (dict): The destination configuration.
+
+        Returns:
+            Destination: The destination.
+        """
+        return cls(
+            name=entry["name"],
+            webhook=entry["webhook"],
+            filter=AlertFilter(entry.get("filter", Config.FILTER_RULES)),
+            colors=entry.get("colors", Config.ALERT_COLORS),
+            template=entry.get("template", DEFAULT_TEMPLATE),
+        )
+
+    def __repr__(self) -> str:
+        return f"<Destination(name={self.name!r})>"
+
+
+class Router:
+    """Decides which destinations each alert is sent to.  Every destination's filter is checked
+    in a single pass over the alert, and a rule shared by several destinations is only matched
+    once.
+
+    Attributes:
+        destinations (list[Destination]): The destinations, in the order they were configured.
+    """
+    destinations: list[Destination]
+
+    def __init__(self, destinations: list[Union[dict, Destination]]):
+        """Create a Router object.
+
+        Args:
+            destinations (list[Union[dict, Destination]]): The destinations, either as
+                `DESTINATIONS` entries or Destination objects.
+
+        Raises:
+            ValueError: Two destinations have the same name.
+        """
+        self.destinations = [d if isinstance(d, Destination) else Destination.from_config(d) for d in destinations]
+        self._by_name = {d.name: d for d in self.destinations}
+        if len(self._by_name) != len(self.destinations):
+            raise ValueError("Every destination needs a unique name.")
+
+    def route(self, alert: Alert) -> list[str]:
+        """Return the destinations an alert should be sent to.
+
+        Args:
+            alert (Alert): The NWS alert.
+
+        Returns:
+            list[str]: The names of the destinations whose filter allows the alert.
+        """
+        matches: dict[tuple[str, str], bool] = dict()
+        names = [d.name for d in self.destinations if d.filter.match(alert, matches)]
+        for name in names:
+            ROUTED.inc(destination=name)
+        return names
+
+    def get(self, name: str) -> Optional[Destination]:
+        """Return a destination by name.
+
+        Args:
+            name (str): The name of the destination.
+
+        Returns:
+            Optional[Destination]: The destination, or None if there is no destination by that name.
+        """
+        return self._by_name.get(name)
+
+    def __iter__(self):
+        return iter(self.destinations)
+
+    def __len__(self) -> int:
+        return len(self.destinations)
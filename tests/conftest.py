@@ -0,0 +1,68 @@
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import pytest
+import redis
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# Run against the example configuration when no config.py has been set up.
+try:
+    import config  # noqa: F401
+except ImportError:
+    import config_example
+    sys.modules["config"] = config_example
+
+from alerts import Alert  # noqa: E402
+from config import Config  # noqa: E402
+from normalize import normalize_timestamps  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    client = redis.Redis.from_url(Config.REDIS_URI, socket_connect_timeout=1)
+    try:
+        client.ping()
+    except redis.RedisError:
+        pytest.skip(f"Redis isn't reachable at {Config.REDIS_URI}")
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def key(client):
+    prefix = f"test:{uuid.uuid4().hex}:"
+    yield prefix
+    keys = list(client.scan_iter(match=prefix + "*"))
+    if keys:
+        client.delete(*keys)
+
+
+@pytest.fixture
+def make_alert():
+    return _make_alert
+
+
+def _make_alert(alert_id: str = "urn:oid:2.49.0.1.840.0.test", event: str = "Tornado Warning",
+                ugc: tuple[str, ...] = ("OKC109",)) -> Alert:
+    alert = Alert.from_feature({
+        "id": f"https://api.weather.gov/alerts/{alert_id}",
+        "type": "Feature",
+        "geometry": None,
+        "properties": {
+            "id": alert_id,
+            "event": event,
+            "geocode": {"UGC": list(ugc), "SAME": list()},
+            "sent": "2024-05-01T12:00:00-05:00",
+            "effective": "2024-05-01T12:00:00-05:00",
+            "onset": "2024-05-01T12:00:00-05:00",
+            "expires": "2099-05-01T12:45:00-05:00",
+            "parameters": {},
+        },
+    })
+    normalize_timestamps(alert.properties)
+    alert.destinations = ["default"]
+    alert.received = time.monotonic()
+    return alert
@@ -0,0 +1,32 @@
+import json
+
+import pytest
+
+from alerts import decode_features
+
+
+def feature(alert_id: str) -> dict:
+    return {"id": alert_id, "type": "Feature", "geometry": None, "properties": {"id": alert_id, "event": "Test"}}
+
+
+def test_decode_features():
+    content = json.dumps({"type": "FeatureCollection", "features": [feature("a"), feature("b")], "title": "x"})
+    assert [a.id for a in decode_features(content.encode())] == ["a", "b"]
+
+
+def test_decode_features_skips_before_building():
+    # The skipped feature would fail to build, so it must never be turned into an Alert.
+    content = json.dumps({"features": [feature("a"), {"id": "known"}, feature("b")]})
+    seen = list()
+
+    def skip(alert_id):
+        seen.append(alert_id)
+        return alert_id == "known"
+
+    assert [a.id for a in decode_features(content, skip=skip)] == ["a", "b"]
+    assert seen == ["a", "known", "b"]
+
+
+def test_decode_features_not_an_object():
+    with pytest.raises(ValueError):
+        list(decode_features(b"[]"))
@@ -0,0 +1,58 @@
+import json
+
+from cache import AlertCache
+
+
+def ids(features: list[bytes]) -> list[str]:
+    return sorted(json.loads(f)["properties"]["id"] for f in features)
+
+
+def test_add_and_filter(client, key, make_alert):
+    cache = AlertCache(client, prefix=key)
+    cache.add([make_alert("one"), make_alert("two", event="Flood Warning", ugc=("TXC201",))])
+    assert ids(cache.features()) == ["one", "two"]
+    assert ids(cache.features(event="flood warning")) == ["two"]
+    assert ids(cache.features(area="OK")) == ["one"]
+    assert cache.get("https://api.weather.gov/alerts/one") is not None
+
+
+def test_rebuild_replaces_alerts(client, key, make_alert):
+    cache = AlertCache(client, prefix=key)
+    cache.add([make_alert("stale", ugc=("KSC001",)), make_alert("kept")])
+    version = cache.version()
+    assert cache.rebuild([make_alert("kept"), make_alert("new")]) == 2
+    assert cache.version() > version
+    assert ids(cache.features()) == ["kept", "new"]
+    assert cache.get("stale") is None
+    assert cache.features(area="KS") == []
+    assert not client.exists(key + "area:KSC001")
+
+
+def test_rebuild_serves_full_set_while_reading(client, key, make_alert):
+    cache = AlertCache(client, prefix=key)
+    cache.add([make_alert("one"), make_alert("two")])
+    version = cache.version()
+    seen = list()
+
+    def alerts():
+        for alert_id in ("one", "two", "three"):
+            # The old alerts are served, unchanged, until the rebuild is done.
+            seen.append((ids(cache.features()), cache.version()))
+            yield make_alert(alert_id)
+
+    cache.rebuild(alerts())
+    assert seen == [(["one", "two"], version)] * 3
+    assert ids(cache.features()) == ["one", "three", "two"]
+
+
+def test_rebuild_keeps_alerts_added_while_reading(client, key, make_alert):
+    cache = AlertCache(client, prefix=key)
+    cache.add([make_alert("one")])
+
+    def alerts():
+        yield make_alert("one")
+        # Stored and cached after the database cursor passed it.
+        cache.add([make_alert("late")])
+
+    cache.rebuild(alerts())
+    assert ids(cache.features()) == ["late", "one"]
@@ -0,0 +1,113 @@
+import time
+
+from cache import AlertCache
+from coordination import LeaderLock, WorkQueue
+
+
+def test_leader_lock(client, key):
+    a = LeaderLock(client, key + "leader", "a", ttl=10)
+    b = LeaderLock(client, key + "leader", "b", ttl=10)
+    assert a.acquire() and a.is_leader
+    assert not b.acquire() and not b.is_leader
+    assert a.acquire()
+    a.release()
+    assert not a.is_leader
+    assert b.acquire()
+
+
+def test_leader_lock_expires(client, key):
+    a = LeaderLock(client, key + "leader", "a", ttl=0.2)
+    b = LeaderLock(client, key + "leader", "b", ttl=0.2)
+    assert a.acquire()
+    time.sleep(0.3)
+    assert not a.is_leader
+    assert b.acquire()
+    assert not a.acquire()
+    # A node that lost the lock can't release it from the new leader.
+    a.release()
+    assert client.get(key + "leader") == b"b"
+
+
+def test_round_trip(client, key, make_alert):
+    queue = WorkQueue(client, key + "work", "a")
+    alert = make_alert()
+    assert queue.add([alert]) == 1
+    [claimed] = queue.claim()
+    assert claimed.id == alert.id
+    assert claimed.destinations == alert.destinations
+    assert claimed.properties.expires == alert.properties.expires
+    assert abs(claimed.received - alert.received) < 1
+    assert queue.pending == 1
+    assert queue.reserve(claimed)
+    queue.complete(claimed)
+    assert queue.pending == 0
+    assert len(queue) == 0
+    assert queue.claim() == []
+
+
+def test_reclaims_from_node_that_went_away(client, key, make_alert):
+    a = WorkQueue(client, key + "work", "a", claim_idle=0.2)
+    b = WorkQueue(client, key + "work", "b", claim_idle=0.2)
+    a.add([make_alert()])
+    [claimed] = a.claim()
+    assert b.claim() == []
+    time.sleep(0.3)
+    [reclaimed] = b.claim()
+    assert reclaimed.id == claimed.id
+
+
+def test_reclaims_after_unfinished_send(client, key, make_alert):
+    a = WorkQueue(client, key + "work", "a", claim_idle=0.2)
+    b = WorkQueue(client, key + "work", "b", claim_idle=0.2)
+    a.add([make_alert()])
+    assert a.reserve(a.claim()[0])
+    # The node went away before its webhooks were queued, so the alert still goes out.
+    time.sleep(0.3)
+    [reclaimed] = b.claim()
+    assert b.reserve(reclaimed)
+    b.complete(reclaimed)
+    assert b.pending == 0
+
+
+def test_duplicates_sent_once(client, key, make_alert):
+    a = WorkQueue(client, key + "work", "a", claim_idle=0.2)
+    b = WorkQueue(client, key + "work", "b", claim_idle=0.2)
+    a.add([make_alert(), make_alert()])
+    [first] = a.claim(1)
+    [second] = b.claim(1)
+    assert a.reserve(first)
+    assert not b.reserve(second)
+    a.complete(first)
+    time.sleep(0.3)
+    [again] = b.claim()
+    assert not b.reserve(again)
+    assert a.pending == 0
+    assert len(a) == 0
+
+
+def test_cache_rebuild_keeps_cluster_keys(client, key, make_alert):
+    # The cluster keys share the cache's prefix, a rebuild must leave them alone.
+    lock = LeaderLock(client, key + "leader", "a", ttl=10)
+    queue = WorkQueue(client, key + "work", "a")
+    cache = AlertCache(client, prefix=key)
+    assert lock.acquire()
+    queue.add([make_alert("one")])
+    cache.add([make_alert("stale")])
+    assert cache.rebuild([make_alert("two")]) == 1
+    assert cache.ids() == ["two"]
+    assert client.get(key + "leader") == b"a"
+    assert [a.id for a in queue.claim()] == [make_alert("one").id]
+
+
+def test_release_retries_then_gives_up(client, key, make_alert):
+    queue = WorkQueue(client, key + "work", "a", claim_idle=0.2, max_attempts=2)
+    queue.add([make_alert()])
+    [claimed] = queue.claim()
+    assert queue.reserve(claimed)
+    assert queue.release(claimed)
+    assert queue.pending == 1
+    time.sleep(0.3)
+    [again] = queue.claim()
+    assert queue.reserve(again)
+    assert not queue.release(again)
+    assert queue.pending == 0
@@ -0,0 +1,118 @@
+import json
+import threading
+import time
+
+import pytest
+
+import dispatcher
+from benchmarks.standins import StandInServer, _QuietHandler
+from dispatcher import WebhookDispatcher
+
+
+class StubWebhook(StandInServer):
+    """Records the embed titles it accepts.  Embeds titled "bad" get a 400, "binary" a 400 with
+    a body that isn't UTF-8, "slow" holds the lane up long enough for the following payloads to
+    be merged, and the first `rate_limited` posts get a 429."""
+
+    def __init__(self, rate_limited: int = 0):
+        self.titles = list()
+        self.posts = 0
+        self.rate_limited = rate_limited
+        self._lock = threading.Lock()
+        super().__init__(_StubHandler)
+
+
+class _StubHandler(_QuietHandler):
+    def do_POST(self) -> None:
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        titles = [e["title"] for e in payload["embeds"]]
+        state = self.server_state
+        with state._lock:
+            state.posts += 1
+            if state.rate_limited:
+                state.rate_limited -= 1
+                self._reply(429, json.dumps({"retry_after": 0.01}).encode(), {"Content-Type": "application/json"})
+                return
+            if "bad" in titles:
+                self._reply(400, b'{"message": "Invalid Form Body"}')
+                return
+            if "binary" in titles:
+                self._reply(400, b"\xff\xfe")
+                return
+            state.titles.extend(titles)
+        if "slow" in titles:
+            time.sleep(0.5)
+        self._reply(204)
+
+
+@pytest.fixture
+def server():
+    server = StubWebhook()
+    yield server
+    server.close()
+
+
+def send_all(tmp_path, server, titles):
+    sender = WebhookDispatcher(str(tmp_path / "retry.db"))
+    for i, title in enumerate(titles):
+        sender.send(server.url, {"embeds": [{"title": title}]})
+        if title == "slow":
+            while server.posts <= i:
+                time.sleep(0.01)
+    sender.close(timeout=10)
+    return sender
+
+
+def test_merges_queued_payloads(tmp_path, server):
+    send_all(tmp_path, server, ["slow", "a", "b", "c"])
+    assert server.titles == ["slow", "a", "b", "c"]
+    assert server.posts == 2
+
+
+def test_rejected_merge_sends_embeds_one_at_a_time(tmp_path, server):
+    sender = send_all(tmp_path, server, ["slow", "a", "bad", "b"])
+    assert server.titles == ["slow", "a", "b"]
+    assert server.posts == 5
+    assert len(sender.retries) == 0
+
+
+def test_rate_limit_waited_out(tmp_path, server):
+    server.rate_limited = 2
+    sender = send_all(tmp_path, server, ["a"])
+    assert server.titles == ["a"]
+    assert server.posts == 3
+    assert len(sender.retries) == 0
+
+
+def test_rate_limit_retries_capped(tmp_path, server):
+    server.rate_limited = 100
+    sender = send_all(tmp_path, server, ["a"])
+    assert server.titles == []
+    assert server.posts == dispatcher.MAX_RATE_LIMITED + 1
+    assert len(sender.retries) == 1
+
+
+def test_undecodable_error_body(tmp_path, server):
+    send_all(tmp_path, server, ["binary", "a"])
+    assert server.titles == ["a"]
+
+
+def test_lane_survives_errors(tmp_path, server, monkeypatch):
+    post = WebhookDispatcher._post
+    failed = list()
+
+    def flaky_post(self, url, payload):
+        if not failed:
+            failed.append(payload)
+            raise RuntimeError("unexpected")
+        return post(self, url, payload)
+
+    monkeypatch.setattr(WebhookDispatcher, "_post", flaky_post)
+    sender = WebhookDispatcher(str(tmp_path / "retry.db"))
+    sender.send(server.url, {"embeds": [{"title": "a"}]})
+    while not failed:
+        time.sleep(0.01)
+    sender.send(server.url, {"embeds": [{"title": "b"}]})
+    sender.close(timeout=10)
+    assert server.titles == ["b"]
+    assert len(sender.retries) == 1
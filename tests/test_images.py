@@ -0,0 +1,25 @@
+from datetime import datetime, timedelta
+
+import pytz
+
+from benchmarks.standins import MemoryDatabase
+from images import ImageRegistry, thumbnail_name
+
+
+def test_thumbnail_name():
+    assert thumbnail_name("abc.webp", 400) == "abc_400.webp"
+
+
+def test_clean_removes_due_images_and_thumbnails(tmp_path):
+    registry = ImageRegistry(MemoryDatabase()["images"], str(tmp_path), timedelta(hours=1), [200, 400])
+    now = datetime(2024, 5, 1, 12, tzinfo=pytz.UTC)
+    for name in ("old.png", "new.png"):
+        for path in (name, thumbnail_name(name, 200), thumbnail_name(name, 400)):
+            (tmp_path / path).touch()
+    registry.register("old.png", "a", now - timedelta(hours=2))
+    registry.register("new.png", "b", now)
+
+    assert registry.clean(now) == 1
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["new.png", "new_200.png", "new_400.png"]
+    assert "old.png" not in registry and "new.png" in registry
+    assert registry.load() == 1
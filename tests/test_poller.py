@@ -0,0 +1,36 @@
+import pytest
+
+from benchmarks.standins import NWSServer
+from poller import AlertPoller, PollResult
+
+
+@pytest.fixture
+def server():
+    server = NWSServer([b'{"features": [1]}', b'{"features": [1]}', b'{"features": [1]}', b'{"features": [2]}'])
+    yield server
+    server.close()
+
+
+def test_fetched_until_committed(server):
+    poller = AlertPoller(server.url)
+    assert poller.poll() == (PollResult.FETCHED, server.snapshots[0])
+    # The payload wasn't processed, so it is handed back again.
+    assert poller.poll() == (PollResult.FETCHED, server.snapshots[1])
+    poller.commit()
+    assert poller.poll() == (PollResult.NOT_MODIFIED, None)
+    assert poller.poll() == (PollResult.FETCHED, server.snapshots[3])
+
+
+def test_reset(server):
+    poller = AlertPoller(server.url)
+    poller.poll()
+    poller.commit()
+    poller.reset()
+    assert poller.poll() == (PollResult.FETCHED, server.snapshots[1])
+
+
+def test_unreachable(server):
+    server.close()
+    poller = AlertPoller(server.url, timeout=1)
+    assert poller.poll() == (PollResult.ERROR, None)
+    assert poller.stats[PollResult.ERROR] == 1
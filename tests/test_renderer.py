@@ -0,0 +1,49 @@
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+import renderer
+from renderer import RenderPool
+
+
+def render(alert) -> tuple:
+    # Stands in for `renderer._render` inside the worker processes.
+    if alert.id == "hang":
+        time.sleep(1000)
+    if alert.id == "slow":
+        # Still running, within its own deadline, when the hung render is killed.
+        marker = Path(alert.marker)
+        if not marker.exists():
+            marker.touch()
+            time.sleep(5)
+    return f"{alert.id}.png", []
+
+
+def init_worker() -> None:
+    pass
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(renderer, "_render", render)
+    monkeypatch.setattr(renderer, "_init_worker", init_worker)
+    pool = RenderPool(workers=2, timeout=6, max_pending=3)
+    yield pool
+    pool.shutdown(wait=False)
+
+
+def test_render(pool):
+    assert pool.render(SimpleNamespace(id="one")) == "one.png"
+
+
+def test_timeout_spares_other_jobs(pool, tmp_path):
+    hung = pool.submit(SimpleNamespace(id="hang"))
+    time.sleep(2)
+    slow = pool.submit(SimpleNamespace(id="slow", marker=str(tmp_path / "slow")))
+    assert pool.result(hung) is None
+    assert pool.result(slow) == "slow.png"
+    # The pool is replaced and every pending slot is free again.
+    assert [pool.render(SimpleNamespace(id=str(i))) for i in range(3)] == ["0.png", "1.png", "2.png"]
+    assert pool._slots._value == pool.max_pending
@@ -0,0 +1,93 @@
+import os
+
+import mercantile
+import pytest
+import xyzservices
+
+from benchmarks.standins import TileServer
+from tiles import TileCache
+
+
+@pytest.fixture
+def server():
+    server = TileServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def provider(server):
+    return xyzservices.TileProvider(name="standin", url=server.template, attribution="")
+
+
+def test_get_downloads_once(tmp_path, server, provider):
+    cache = TileCache(str(tmp_path), max_bytes=10 ** 6)
+    assert cache.get(provider, 5, 7, 12) == server.tile
+    assert cache.get(provider, 5, 7, 12) == server.tile
+    assert server.requests == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.tile_path(provider, 5, 7, 12).read_bytes() == server.tile
+
+
+def test_get_unreachable(tmp_path, server, provider):
+    server.close()
+    cache = TileCache(str(tmp_path), max_bytes=10 ** 6, timeout=1)
+    assert cache.get(provider, 5, 7, 12) is None
+    assert len(cache) == 0
+
+
+def test_evicts_least_recently_used(tmp_path, server, provider):
+    cache = TileCache(str(tmp_path), max_bytes=len(server.tile) * 3)
+    for x in range(3):
+        cache.get(provider, 5, x, 0)
+    # Touch the oldest tile so the second one is evicted next.
+    cache.get(provider, 5, 0, 0)
+    cache.get(provider, 5, 3, 0)
+    assert len(cache) == 3
+    assert cache.size <= cache.max_bytes
+    assert not cache.tile_path(provider, 5, 1, 0).exists()
+    assert cache.tile_path(provider, 5, 0, 0).exists()
+
+
+def test_limit_shared_between_processes(tmp_path, server, provider):
+    # Each render worker has its own TileCache on the same directory.
+    limit = len(server.tile) * 10
+    workers = [TileCache(str(tmp_path), max_bytes=limit) for _ in range(4)]
+    for x in range(40):
+        workers[x % 4].get(provider, 5, x, 0)
+    on_disk = sum(os.path.getsize(p) for p in tmp_path.glob("*/*/*/*.tile"))
+    assert on_disk <= limit * 1.25
+
+
+def test_prefetch(tmp_path, server, provider):
+    cache = TileCache(str(tmp_path), max_bytes=10 ** 7)
+    count = cache.prefetch(provider, -94.6, 33.6, -89.6, 36.5, zoom=6)
+    assert count == len(cache) == server.requests
+    assert cache.prefetch(provider, -94.6, 33.6, -89.6, 36.5, zoom=6) == count
+    assert server.requests == count
+
+
+@pytest.mark.parametrize("size", [256, 512])
+def test_add_basemap_keeps_tile_resolution(tmp_path, monkeypatch, size):
+    import cartopy.crs as ccrs
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    import tiles
+
+    server = TileServer(size)
+    try:
+        provider = xyzservices.TileProvider(name="standin", url=server.template, attribution="")
+        monkeypatch.setattr(tiles, "_cache", TileCache(str(tmp_path), max_bytes=10 ** 7))
+        ax = plt.axes(projection=ccrs.Mercator.GOOGLE)
+        ax.set_extent((-94.6, -89.6, 33.6, 36.5), crs=ccrs.PlateCarree())
+        tiles.add_basemap(ax, provider, zoom=6)
+        west, east, south, north = ax.get_extent(crs=ccrs.PlateCarree())
+        covered = list(mercantile.tiles(west, south, east, north, 6))
+        rows, cols = ax.get_images()[0].get_array().shape[:2]
+        assert rows == len({t.y for t in covered}) * size
+        assert cols == len({t.x for t in covered}) * size
+        plt.close(ax.figure)
+    finally:
+        server.close()
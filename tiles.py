@@ -0,0 +1,283 @@
+import argparse
+import io
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+import cartopy.crs as ccrs
+import mercantile
+import numpy as np
+import requests
+from PIL import Image
+from requests.adapters import HTTPAdapter
+
+from config import Config
+
+log = logging.getLogger("rich")
+
+# Share of the size limit a process writes before it rescans the cache for other processes' tiles.
+RESCAN_FRACTION = 0.05
+
+
+class TileCache:
+    """An on-disk cache of map tiles keyed by provider, zoom, x, and y.  The least recently
+    used tiles are evicted once the cache grows past its size limit.  Every render worker
+    writes to the same directory, so the cache is rescanned from disk before evicting and
+    after each `RESCAN_FRACTION` of the limit this process writes, which keeps the whole
+    directory within about `RESCAN_FRACTION` of the limit per process.
+
+    Attributes:
+        path (Path): The root directory of the cache.
+        max_bytes (int): The maximum size of the cache in bytes.
+        timeout (float): The tile server request timeout in seconds.
+    """
+    path: Path
+    max_bytes: int
+    timeout: float
+
+    def __init__(self, path: str, max_bytes: int, timeout: float = 5.):
+        """Create a TileCache object.
+
+        Args:
+            path (str): The root directory of the cache.
+            max_bytes (int): The maximum size of the cache in bytes.
+            timeout (float, optional): The tile server request timeout in seconds. Defaults to 5.0.
+        """
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=8))
+        self.session.mount("http://", HTTPAdapter(pool_maxsize=8))
+
+        self._lock = threading.Lock()
+        self._entries: Optional[OrderedDict[Path, int]] = None
+        self._size = 0
+        self._written = 0
+
+    def _load(self) -> OrderedDict:
+        # Rebuild the LRU order from the modification times, which are bumped on every hit.
+        if self._entries is None:
+            files = list()
+            for f in self.path.glob("*/*/*/*.tile"):
+                try:
+                    st = f.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((st.st_mtime, f, st.st_size))
+            files.sort()
+            self._entries = OrderedDict((f, size) for _, f, size in files)
+            self._size = sum(self._entries.values())
+            self._written = 0
+        return self._entries
+
+    def tile_path(self, provider, z: int, x: int, y: int) -> Path:
+        """Return the path of a cached tile.
+
+        Args:
+            provider (TileProvider): The tile provider.
+            z (int): The zoom level.
+            x (int): The tile column.
+            y (int): The tile row.
+
+        Returns:
+            Path: The location of the tile in the cache.
+        """
+        name = re.sub(r"[^\w.-]", "_", provider.name)
+        return self.path / name / str(z) / str(x) / f"{y}.tile"
+
+    def get(self, provider, z: int, x: int, y: int) -> Optional[bytes]:
+        """Return a tile from the cache, downloading it from the provider on a miss.
+
+        Args:
+            provider (TileProvider): The tile provider.
+            z (int): The zoom level.
+            x (int): The tile column.
+            y (int): The tile row.
+
+        Returns:
+            Optional[bytes]: The encoded tile image, or None if it could not be downloaded.
+        """
+        path = self.tile_path(provider, z, x, y)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            data = None
+
+        if data is not None:
+            self.hits += 1
+            with self._lock:
+                entries = self._load()
+                entries[path] = len(data)
+                entries.move_to_end(path)
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+            return data
+
+        self.misses += 1
+        url = provider.build_url(x=x, y=y, z=z)
+        try:
+            r = self.session.get(url, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            log.warning(f"Unable to download tile {z}/{x}/{y}: {e}")
+            return None
+        if r.status_code != 200:
+            log.warning(f"Unable to download tile {z}/{x}/{y}, status code '{r.status_code}'.")
+            return None
+
+        self._put(path, r.content)
+        return r.content
+
+    def _put(self, path: Path, data: bytes) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp = path.with_suffix(f".{os.getpid()}.tmp")
+        temp.write_bytes(data)
+        os.replace(temp, path)
+
+        with self._lock:
+            entries = self._load()
+            self._size += len(data) - entries.get(path, 0)
+            entries[path] = len(data)
+            entries.move_to_end(path)
+            self._written += len(data)
+            if self._size > self.max_bytes or self._written > self.max_bytes * RESCAN_FRACTION:
+                # Pick up the tiles the other processes wrote (or evicted) since the last scan.
+                self._entries = None
+                self._load()
+            self._evict()
+
+    def _evict(self) -> None:
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            path, size = self._entries.popitem(last=False)
+            self._size -= size
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    @property
+    def size(self) -> int:
+        """Return the size of the cache.
+
+        Returns:
+            int: The size of all cached tiles in bytes.
+        """
+        with self._lock:
+            self._load()
+            return self._size
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._load())
+
+    def prefetch(self, provider, west: float, south: float, east: float, north: float, zoom: int) -> int:
+        """Download every tile covering a bounding box into the cache.
+
+        Args:
+            provider (TileProvider): The tile provider.
+            west (float): The western-most longitude.
+            south (float): The southern-most latitude.
+            east (float): The eastern-most longitude.
+            north (float): The northern-most latitude.
+            zoom (int): The zoom level.
+
+        Returns:
+            int: The number of tiles now available in the cache.
+        """
+        count = 0
+        for t in mercantile.tiles(west, south, east, north, zoom):
+            if self.get(provider, t.z, t.x, t.y) is not None:
+                count += 1
+        return count
+
+
+_cache: Optional[TileCache] = None
+
+
+def get_cache() -> TileCache:
+    """Return the tile cache configured for this process.
+
+    Returns:
+        TileCache: The tile cache.
+    """
+    global _cache
+    if _cache is None:
+        _cache = TileCache(Config.TILE_CACHE_PATH, Config.TILE_CACHE_MAX_BYTES, Config.TILE_FETCH_TIMEOUT)
+    return _cache
+
+
+def add_basemap(ax, provider, zoom: int) -> None:
+    """Draw the basemap tiles covering the extent of a map, pulling them through the tile cache.
+    Tiles that can't be downloaded are left blank.  The mosaic keeps the resolution of the
+    provider's tiles, such as MapBox's 512 pixel tiles.  Maps drawn in the web Mercator projection
+    (`ccrs.Mercator.GOOGLE`) take the tiles as-is, any other projection has to warp them.
+
+    Args:
+        ax (GeoAxes): The axes to draw the basemap on.
+        provider (TileProvider): The tile provider.
+        zoom (int): The zoom level of the tiles.
+    """
+    west, east, south, north = ax.get_extent(crs=ccrs.PlateCarree())
+    tiles = list(mercantile.tiles(west, south, east, north, zoom))
+    if not tiles:
+        return
+
+    cache = get_cache()
+    min_x, max_x = min(t.x for t in tiles), max(t.x for t in tiles)
+    min_y, max_y = min(t.y for t in tiles), max(t.y for t in tiles)
+    mosaic, size = None, 0
+
+    for t in tiles:
+        data = cache.get(provider, t.z, t.x, t.y)
+        if data is None:
+            continue
+        img = Image.open(io.BytesIO(data)).convert("RGBA")
+        if mosaic is None:
+            # Sized from the first tile, every provider's tiles are square.
+            size = img.width
+            mosaic = np.zeros(((max_y - min_y + 1) * size, (max_x - min_x + 1) * size, 4), dtype=np.uint8)
+        if img.size != (size, size):
+            img = img.resize((size, size))
+        row, col = (t.y - min_y) * size, (t.x - min_x) * size
+        mosaic[row:row + size, col:col + size] = np.asarray(img)
+    if mosaic is None:
+        return
+
+    upper_left = mercantile.xy_bounds(min_x, min_y, zoom)
+    lower_right = mercantile.xy_bounds(max_x, max_y, zoom)
+    extent = (upper_left.left, lower_right.right, lower_right.bottom, upper_left.top)
+
+    xlim, ylim = ax.get_xlim(), ax.get_ylim()
+    ax.imshow(mosaic, extent=extent, origin="upper", transform=ccrs.Mercator.GOOGLE,
+              interpolation="bilinear", zorder=0)
+    ax.set_xlim(xlim)
+    ax.set_ylim(ylim)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s', level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Manage the basemap tile cache.")
+    parser.add_argument("--prefetch", action="store_true",
+                        help="Download the tiles for every box in TILE_PREFETCH_BOUNDS.")
+    parser.add_argument("--zoom", type=int, default=Config.MAPBOX_ZOOM,
+                        help="The zoom level to prefetch (default: MAPBOX_ZOOM).")
+    args = parser.parse_args()
+
+    cache = get_cache()
+    if args.prefetch:
+        for bounds in Config.TILE_PREFETCH_BOUNDS:
+            count = cache.prefetch(Config.MAPBOX_PROVIDER, *bounds, zoom=args.zoom)
+            log.info(f"Prefetched {count} tiles for {bounds} at zoom {args.zoom}.")
+        log.info(f"Cache hits: {cache.hits}, downloaded: {cache.misses}")
+
+    log.info(f"Tile cache: {len(cache)} tiles, {cache.size / 1048576:.1f} MiB")
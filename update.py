@@ -1,161 +1,478 @@
+import asyncio
+import functools
 import logging
-import re
-import threading
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
+from typing import Optional
 
 import pytz
-import requests
-import schedule
-from box import Box
-from dateutil.parser import parse
+import redis
 from pymongo import MongoClient
-from pymongo.errors import DuplicateKeyError
+from pymongo.database import Database
+from pymongo.errors import BulkWriteError
 from rich.logging import RichHandler
 
+import metrics
+from alert_index import AlertIndex
+from alert_locator import AlertLocator
+from alerts import Alert, decode_features
+from cache import AlertCache
 from config import Config
-from generate import generate_image, notify_discord_webhook
+from coordination import LeaderLock, WorkQueue, node_name
+from counties import county_store
+from dispatcher import get_dispatcher
+from generate import IMAGE_EXTENSIONS, notify_discord_webhook
+from images import ImageRegistry
+from metrics import Counter, Histogram
+from normalize import normalize_timestamps, parse_timestamp, process_description
+from pipeline import Pipeline
+from poller import AlertPoller, PollResult
+from records import create_indexes, expand_record, slim_record
+from renderer import RenderPool
+from routing import Router
 
-m = MongoClient(Config.MONGO_URI)
-db = m[Config.MONGO_ALERTS_DB]
+log = logging.getLogger("rich")
 
-FORMAT = "%(message)s"
-logging.basicConfig(level="INFO", format=FORMAT, datefmt='[%X]', handlers=[RichHandler()])
+# Render workers are spawned and run this module's top level again, so everything that connects
+# to MongoDB or Redis or sets up logging is created by `setup` when the updater starts instead.
+m: Optional[MongoClient] = None
+db: Optional[Database] = None
+image_registry: Optional[ImageRegistry] = None
+poller: Optional[AlertPoller] = None
+router: Optional[Router] = None
+redis_client: Optional[redis.Redis] = None
+alert_cache: Optional[AlertCache] = None
+
+alert_index = AlertIndex()
+alert_locator = AlertLocator(county_store)
+# Set when a cache write fails, the next `refresh_cache` rebuilds the cache from the database.
+cache_stale = True
+
+# With CLUSTER_ENABLED, the node holding the leader lock polls the NWS API and runs the cleanup
+# jobs, and every node renders and sends out the alerts on the shared work queue.
+leader_lock: Optional[LeaderLock] = None
+work_queue: Optional[WorkQueue] = None
+# The `time.monotonic` value of this node's next attempt at polling as the leader.
+next_poll = 0.
+# Alerts this node polled that couldn't be added to the work queue yet.  They are already in
+# the alert index, so they would never be polled again.
+unqueued: list[Alert] = list()
+
+render_pool = RenderPool(
+    workers=Config.RENDER_WORKERS,
+    timeout=Config.RENDER_TIMEOUT,
+    max_pending=Config.RENDER_MAX_PENDING,
+)
+
+POLL_FEATURES = Histogram("nws_poll_features", "Alerts in each changed NWS API response.",
+                          buckets=(0, 10, 25, 50, 100, 250, 500, 1000, 2500))
+ALERTS = Counter("alerts_total", "Alerts in NWS API responses by how they were handled.", ("result",))
+CLEANUP_SECONDS = Histogram("cleanup_seconds", "Time taken by the cleanup jobs.", ("job",))
+
+
+def setup() -> None:
+    """Set up logging and create the database and Redis clients, the NWS API poller, and the
+    router, plus the leader lock and work queue with CLUSTER_ENABLED.
+    """
+    global m, db, image_registry, poller, router, redis_client, alert_cache, leader_lock, work_queue
+    FORMAT = "%(message)s"
+    logging.basicConfig(level="INFO", format=FORMAT, datefmt='[%X]', handlers=[RichHandler()])
+
+    m = MongoClient(Config.MONGO_URI)
+    db = m[Config.MONGO_ALERTS_DB]
+    image_registry = ImageRegistry(db["images"], Config.IMAGE_SAVE_PATH, timedelta(days=Config.IMAGE_RETENTION_DAYS),
+                                   Config.IMAGE_THUMBNAIL_WIDTHS)
+
+    poller = AlertPoller(
+        f"{Config.NWS_API_URL}/alerts/active",
+        headers=Config.NWS_API_HEADERS,
+        params=Config.NWS_API_PARAMS,
+    )
+    router = Router(Config.DESTINATIONS)
+
+    redis_client = redis.Redis.from_url(Config.REDIS_URI)
+    alert_cache = AlertCache(
+        redis_client,
+        prefix=Config.REDIS_PREFIX,
+        response_ttl=Config.API_RESPONSE_CACHE_SECONDS,
+    )
+    if Config.CLUSTER_ENABLED:
+        leader_lock = LeaderLock(redis_client, Config.REDIS_PREFIX + "cluster:leader", node_name(), ttl=Config.CLUSTER_LEADER_TTL)
+        work_queue = WorkQueue(
+            redis_client,
+            Config.REDIS_PREFIX + "cluster:work",
+            consumer=node_name(),
+            claim_idle=Config.CLUSTER_CLAIM_IDLE,
+            max_length=Config.CLUSTER_QUEUE_MAX_LENGTH,
+        )
 
-log = logging.getLogger("rich")
 
-def run_threaded(job_func) -> None:
-    """Quick function to pass to scheduler to run everything multithreaded.
+def get_alerts(initial: bool = False) -> int:
+    """Poll the NWS API for all current active alerts, then render and send out every new
+    alert that is routed to at least one destination.
 
     Args:
-        job_func (function): The function to send into the thread.
+        initial (bool, optional): Only store the alerts, don't send any out. Defaults to False.
+
+    Returns:
+        int: The number of new alerts sent out.
     """
-    job_thread = threading.Thread(target=job_func)
-    job_thread.start()
+    new_alerts = fetch_alerts(initial=initial)
+    jobs = [(f, render_pool.submit(f)) for f in new_alerts]
+    for f, job in jobs:
+        notify_alert(f, render_pool.result(job))
+    return len(new_alerts)
 
 
-def filter_alert(rule_list: list[str], alert: Box) -> bool:
-    """Filter events based on regular expressions compared against the properties data.
+def fetch_alerts(initial: bool = False) -> list[Alert]:
+    """Poll the NWS API for all current active alerts and store the new ones in the database.
+    The response is only marked as seen once every alert in it has been stored, so a failure
+    part way through is picked up again on the next poll.
 
     Args:
-        rule_list (list[str]): A list of rules.
-        alert (Box): The NWS API event to process.
+        initial (bool, optional): Only store the alerts, don't return any to notify on. Defaults to False.
 
     Returns:
-        bool: Whether the alert was allowed via the rules.
+        list[Alert]: The new alerts routed to at least one destination, which need to be rendered
+            and sent out.
     """
-    results = list()
-    for rule in rule_list:
-        for attrib, values in rule.items():
-            temp_results = list()
-            if isinstance(values, str):
-                values = [values]
-            for value in values:
-                result = re.search(value, alert.properties[attrib])
-                temp_results.append(bool(result))
-            results.append(any(temp_results))
-    return all(results)
+    received = time.monotonic()
+    result, content = poller.poll()
+    if result != PollResult.FETCHED:
+        log.debug(f"No new data from the NWS ({result}).")
+        return list()
+
+    known = 0
+
+    def is_known(alert_id: str) -> bool:
+        # Most of every poll is alerts already stored, they are skipped before being decoded.
+        nonlocal known
+        if alert_id in alert_index:
+            known += 1
+            return True
+        return False
+
+    try:
+        features = list(decode_features(content, skip=is_known))
+    except ValueError as e:
+        log.warning("Could not decode NWS API response.")
+        log.warning(f"Error: {e}")
+        return list()
 
+    for f in features:
+        f.received = received
+    POLL_FEATURES.observe(len(features) + known)
+    ALERTS.inc(known, result="known")
 
-def get_alerts(initial: bool = False) -> int:
-    """Poll the NWS API for all current active alerts.
+    log.debug(f"Pulled {len(features)} new alerts from the NWS.")
+
+    for f in features:
+        f.destinations = router.route(f)
+    allowed = {f.id for f in features if f.destinations}
+    if not Config.STORE_FILTERED_ALERTS:
+        ignore_records([f for f in features if f.id not in allowed])
+        features = [f for f in features if f.id in allowed]
+
+    new_alerts = list()
+    new_messages = 0
+    for f in add_records(features):
+        new_messages += 1
+        if initial:
+            continue
+        if f.id in allowed:
+            new_alerts.append(f)
+        else:
+            log.info(f"Skipping generating image for event: {f.properties.event}")
+
+    if new_messages:
+        log.info(f"Processed {new_messages} alerts from the NWS.")
+    poller.commit()
+    return new_alerts
+
+
+def fetch_work() -> list[Alert]:
+    """Poll the NWS API if this node is the leader, queueing the new alerts on the work queue,
+    then take alerts off the work queue for this node.  Used in place of `fetch_alerts` when
+    CLUSTER_ENABLED is set.  Waits on the work queue until the next poll is due.  Alerts that
+    couldn't be queued are kept and queued on the next call.
 
     Returns:
-        int: The number of alerts added to the database.
+        list[Alert]: The alerts this node needs to render and send out.
     """
-    url = f"{Config.NWS_API_URL}/alerts/active"
-    try:
-        r = requests.get(url,
-                        headers=Config.NWS_API_HEADERS,
-                        params=Config.NWS_API_PARAMS)
-    except ConnectionError as e:
-        log.warning(f"Unable to connect to the National Weather Service API: {e.strerror}")
-        return 0
-    
+    global next_poll
+    now = time.monotonic()
+    if now >= next_poll:
+        next_poll = now + Config.POLL_INTERVAL
+        was_leader = leader_lock.is_leader
+        if leader_lock.acquire():
+            if not was_leader:
+                take_over()
+            unqueued.extend(fetch_alerts())
+
+    if unqueued:
+        try:
+            work_queue.add(unqueued)
+            unqueued.clear()
+        except redis.RedisError as e:
+            log.warning(f"Unable to add {len(unqueued)} alerts to the work queue, retrying: {e}")
+
     try:
-        data = Box(r.json())
-    except requests.exceptions.JSONDecodeError as e:
-        log.warning("Could not decode NWS API response.")
-        log.warning(f"Error: {e.strerror}")
-        return 0
-    
-    log.debug(f"Pulled {len(data.features)} alerts from the NWS.")
-    
-    new_messages = 0
-    for f in data.features:
-        if add_record(f) and not initial:
-            if filter_alert(Config.FILTER_RULES, f):
-                image = generate_image(f)
-                if image is None:
-                    log.warning(f"Unable to generate image for event: {f.properties.event}")
-                    log.warning(f" - ID: {f.id}")
-                    log.warning(f" - Area: {f.properties.areaDesc}")
-                    continue
-                log.info(f'Event: "{f.properties.event}"')
-                log.info(f' - Area: {f.properties.areaDesc}')
-                if td := f.properties.parameters.get("tornadoDetection", False):
-                    log.info(f' - Tornado: {', '.join(td).title()}')
-                log.info(f' - Generating image: "{image}"')
-                notify_discord_webhook(f, image=image, webhook_url=Config.DISCORD_WEBHOOK)
-            else:
-                log.info(f"Skipping generating image for event: {f.properties.event}")
-            new_messages += 1
-
-    if not new_messages:
-        return 0
+        return work_queue.claim(Config.PIPELINE_QUEUE_SIZE, block=max(next_poll - time.monotonic(), 0))
+    except redis.RedisError as e:
+        log.warning(f"Unable to read from the work queue: {e}")
+        time.sleep(max(next_poll - time.monotonic(), 0))
+        return list()
+
+
+def take_over() -> None:
+    """Catch up on what the previous leader did before polling as the new leader."""
+    global cache_stale
+    coll = db["test"]
+    alert_index.load(coll)
+    alert_locator.update(expand_record(doc) for doc in coll.find())
+    image_registry.load()
+    poller.reset()
+    cache_stale = True
+
+
+def renew_leadership() -> None:
+    """Renew the leader lock between polls, so the lease doesn't run out while a poll or the
+    wait for the next one takes longer than CLUSTER_LEADER_TTL.  A node that isn't the leader
+    only tries to take over when its next poll is due, in `fetch_work`.
+    """
+    if leader_lock.is_leader:
+        leader_lock.acquire()
+
+
+def leader_only(func):
+    """Wrap a periodic job so it only runs on the leader when CLUSTER_ENABLED is set.
+
+    Args:
+        func (Callable[[], object]): The job.
+
+    Returns:
+        Callable[[], object]: The wrapped job.
+    """
+    @functools.wraps(func)
+    def run():
+        if leader_lock is None or leader_lock.is_leader:
+            return func()
+    return run
 
-    log.info(f"Processed {new_messages} alerts from the NWS.")
-    return new_messages
 
+def notify_alert(f: Alert, image: Optional[str]) -> None:
+    """Send out the Discord notifications for a new alert, one to each destination it was
+    routed to.  Every destination shares the same image.  With CLUSTER_ENABLED, the alert is
+    only acknowledged on the work queue once its webhooks are queued, so another node sends it
+    out if this one goes away first.  An alert whose render failed is left on the work queue to
+    be rendered again, up to the work queue's `max_attempts`.
 
-def add_record(feature: Box, generate_image: bool = False) -> bool:
+    Args:
+        f (Alert): The NWS alert.
+        image (Optional[str]): The name of the rendered image, or None if the render failed.
+    """
+    if work_queue is None:
+        send_alert(f, image)
+        return
+    if not work_queue.reserve(f):
+        log.info(f"Skipping alert another node sent out: {f.id}")
+        return
+    if image is not None:
+        send_alert(f, image)
+        work_queue.complete(f)
+    elif work_queue.release(f):
+        log.warning(f"Unable to generate image, leaving the alert on the work queue to retry: {f.id}")
+    else:
+        send_alert(f, image)
+
+
+def send_alert(f: Alert, image: Optional[str]) -> None:
+    """Queue the Discord webhooks for a new alert, one to each destination it was routed to.
+
+    Args:
+        f (Alert): The NWS alert.
+        image (Optional[str]): The name of the rendered image, or None if the render failed.
+    """
+    if image is None:
+        log.warning(f"Unable to generate image for event: {f.properties.event}")
+        log.warning(f" - ID: {f.id}")
+        log.warning(f" - Area: {f.properties.areaDesc}")
+        return
+    log.info(f'Event: "{f.properties.event}"')
+    log.info(f' - Area: {f.properties.areaDesc}')
+    if td := f.properties.parameters.get("tornadoDetection", False):
+        log.info(f' - Tornado: {', '.join(td).title()}')
+    log.info(f' - Generating image: "{image}"')
+    image_registry.register(image, f.id, f.properties.expires)
+    for name in f.destinations:
+        destination = router.get(name)
+        if destination is None:
+            log.warning(f' - Unknown destination: "{name}"')
+            continue
+        log.info(f' - Sending to: "{name}"')
+        notify_discord_webhook(f, image=image, webhook_url=destination.webhook,
+                               template=destination.template, colors=destination.colors)
+
+
+def log_stats() -> None:
+    """Log how often each poll result and filter rule has occurred since startup."""
+    if not poller.total:
+        return
+    log.info(f"NWS API polls: {poller.total}")
+    for result, count in poller.stats.items():
+        log.info(f" - {result}: {count} ({count / poller.total:.1%})")
+
+    for destination in router:
+        log.info(f'Filter rule hits for "{destination.name}":')
+        for rule in destination.filter.stats:
+            log.info(f' - {rule["property"]} "{rule["pattern"]}": {rule["hits"]} hits, {rule["misses"]} misses')
+
+
+def add_record(feature: Alert) -> bool:
     """Add a feature record from the NWS alerts to the Mongo database.
 
     Args:
-        feature (Box): The record to add to the database.
+        feature (Alert): The record to add to the database.
 
     Returns:
         bool: Whether the record was added to the database (True) or already in the DB (False)
     """
+    return bool(add_records([feature]))
+
+
+def add_records(features: list[Alert]) -> list[Alert]:
+    """Add all new feature records from the NWS alerts to the Mongo database in a single batch.
+    Features already in the alert index are skipped without touching the database.
+
+    Args:
+        features (list[Alert]): The records to add to the database.
+
+    Returns:
+        list[Alert]: The records that were added to the database.
+    """
     now = datetime.now(pytz.UTC)
-    if parse(feature.properties['expires']) < now:
-        log.debug(f"Skipped record '{feature.id}'.")
-        return False
+    records = list()
+    for feature in features:
+        if feature.id in alert_index:
+            continue
 
-    dt_list = ["sent", "effective", "onset", "expires", "ends"]
-    for field in dt_list:
+        # Just the expiration for now, the rest is only parsed for records worth storing.
         try:
-            feature.properties[field] = parse(feature.properties[field])
-        except TypeError:
-            if field != "ends":
-                return
-
-    feature.properties.description = process_description(feature.properties.description)
+            feature.properties.expires = parse_timestamp(feature.properties.expires)
+        except (TypeError, ValueError):
+            log.debug(f"Skipped record '{feature.id}' with a bad expiration.")
+            ALERTS.inc(result="invalid")
+            continue
+        if feature.properties.expires < now:
+            log.debug(f"Skipped record '{feature.id}'.")
+            ALERTS.inc(result="expired")
+            continue
+
+        if not prepare_record(feature):
+            ALERTS.inc(result="invalid")
+            continue
+        records.append(feature)
+
+    if not records:
+        return records
 
     coll = db["test"]
+    duplicates, rejected = set(), set()
     try:
-        coll.insert_one(feature)
-    except DuplicateKeyError:
-        log.debug(f"Key {feature.id} already present in DB, skipping.")
-        return False
-    return True
+        coll.insert_many([slim_record(f) for f in records], ordered=False)
+    except BulkWriteError as e:
+        for error in e.details["writeErrors"]:
+            if error["code"] == 11000:
+                duplicates.add(error["index"])
+                continue
+            rejected.add(error["index"])
+            log.warning(f"Could not store record '{records[error['index']].id}': {error['errmsg']}")
+    if duplicates:
+        log.debug(f"{len(duplicates)} records already present in DB, skipping.")
+    ALERTS.inc(len(duplicates), result="duplicate")
+    ALERTS.inc(len(rejected), result="rejected")
+    ALERTS.inc(len(records) - len(duplicates) - len(rejected), result="new")
+
+    # Duplicates still go into the index, they are in the database after all.
+    alert_index.update((f.id, f.properties.expires) for i, f in enumerate(records) if i not in rejected)
+    failed = duplicates | rejected
+    added = [f for i, f in enumerate(records) if i not in failed]
+    alert_locator.update(added)
+    cache_alerts(added)
+    return added
+
+
+def cache_alerts(features: list[Alert]) -> None:
+    """Add new alerts to the read API cache.
 
+    Args:
+        features (list[Alert]): The alerts that were added to the database.
+    """
+    global cache_stale
+    if cache_stale or not features:
+        return
+    try:
+        alert_cache.add(features)
+    except redis.RedisError as e:
+        log.warning(f"Unable to update the alert cache, it will be rebuilt: {e}")
+        cache_stale = True
 
-def process_description(desc: str) -> str:
-    """Remove all unneeded newlines from the string and replace with spaces.
 
-    Args:
-        desc (str): The string to process.
+def refresh_cache() -> int:
+    """Rebuild the read API cache from the database if a write to it failed.
 
     Returns:
-        str: The description with all the single newlines being replaced with spaces.
+        int: The number of alerts cached, or 0 if the cache was already current.
     """
+    global cache_stale
+    if not cache_stale:
+        return 0
+    # Clear the flag before reading the database so alerts added while the rebuild runs are
+    # still written to the cache by `cache_alerts`, even after the cursor has passed them.
+    cache_stale = False
     try:
-        return "\n\n".join([i.replace("\n", ' ') for i in desc.split("\n\n")])
-    except AttributeError:
-        log.debug("Alert contained no description!")
-        return str()
+        count = alert_cache.rebuild(expand_record(doc) for doc in db["test"].find())
+    except redis.RedisError as e:
+        log.warning(f"Unable to rebuild the alert cache: {e}")
+        cache_stale = True
+        return 0
+    log.info(f"Rebuilt the alert cache with {count} alerts.")
+    return count
+
+
+def ignore_records(features: list[Alert]) -> None:
+    """Add features to the alert index without storing them so they are skipped on later polls.
+
+    Args:
+        features (list[Alert]): The features to ignore.  Features with a bad expiration are
+            skipped, the same as `add_records` does.
+    """
+    ignored = list()
+    for f in features:
+        try:
+            ignored.append((f.id, parse_timestamp(f.properties.expires)))
+        except (TypeError, ValueError):
+            log.debug(f"Skipped record '{f.id}' with a bad expiration.")
+            ALERTS.inc(result="invalid")
+    alert_index.update(ignored)
+
+
+def prepare_record(feature: Alert) -> bool:
+    """Convert the timestamps and description of a feature into the format stored in the database.
+
+    Args:
+        feature (Alert): The feature to process in place.
+
+    Returns:
+        bool: Whether the feature had all of the required timestamps.
+    """
+    if not normalize_timestamps(feature.properties):
+        return False
+
+    feature.properties.description = process_description(feature.properties.description)
+    return True
+
 
 def clean_records() -> int:
     """Remove all expired alerts from the database.
@@ -163,17 +480,44 @@ def clean_records() -> int:
     Returns:
         int: Number of records removed from the database.
     """
+    global cache_stale
     coll = db["test"]
     now = datetime.now(pytz.UTC)
     query = {"properties.expires": {"$lt": now}}
-    results = coll.delete_many(query)
+    with CLEANUP_SECONDS.time(job="records"):
+        results = coll.delete_many(query)
+        alert_index.expire(now)
+        alert_locator.expire(now)
+        if not cache_stale:
+            try:
+                alert_cache.expire(now)
+            except redis.RedisError as e:
+                log.warning(f"Unable to expire cached alerts, the cache will be rebuilt: {e}")
+                cache_stale = True
     if results.deleted_count:
         log.info(f"Removed {results.deleted_count} expired alerts.")
     return results.deleted_count
 
 
-def clean_images(days: int = 7) -> int:
-    """Delete all images older than 'days' in the image directory.
+def clean_images() -> int:
+    """Delete all images whose alerts expired longer than `IMAGE_RETENTION_DAYS` ago.
+
+    Returns:
+        int: The number of images deleted.
+    """
+    with CLEANUP_SECONDS.time(job="images"):
+        if work_queue is not None:
+            # Every node registers the images it renders, pick up the ones from other nodes.
+            image_registry.load()
+        count = image_registry.clean(datetime.now(pytz.UTC))
+    if count:
+        log.info(f"Removed {count} stale images.")
+    return count
+
+
+def clean_untracked_images(days: int = 7) -> int:
+    """Delete all images older than 'days' in the image directory that aren't in the image
+    registry, such as images rendered before the registry existed.
 
     Args:
         days (int): The age of the image to delete in days.
@@ -181,46 +525,80 @@ def clean_images(days: int = 7) -> int:
     Returns:
         int: The number of images deleted.
     """
-    files = Path(Config.IMAGE_SAVE_PATH).glob('*.png')
+    suffixes = {f".{i}" for i in IMAGE_EXTENSIONS.values()}
+    files = [f for f in Path(Config.IMAGE_SAVE_PATH).iterdir() if f.suffix in suffixes]
     count = 0
     current_time = time.time() - (86400 * days)
-    for f in files:
-        if f.stat().st_mtime < current_time:
-            f.unlink()
-            count += 1
+    with CLEANUP_SECONDS.time(job="untracked_images"):
+        for f in files:
+            # Thumbnails are tracked under the name of their full size image.
+            name = f.stem.split("_")[0] + f.suffix
+            if name not in image_registry and f.stat().st_mtime < current_time:
+                f.unlink()
+                count += 1
     if count:
-        log.info(f"Removed {count} stale images.")
+        log.info(f"Removed {count} untracked images.")
 
     return count
 
 
 if __name__ == "__main__":
-    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s',
-                        level=logging.INFO)
-    
+    setup()
+
     # Initial DB load
     coll = db["test"]
-    coll.create_index("id", unique=True)
+    create_indexes(coll)
+    alert_index.load(coll)
+    alert_locator.update(expand_record(doc) for doc in coll.find())
 
     log.info(f"NWS API Updater")
     log.info(f' - Version........: "{Config.VERSION}"')
     log.info(f' - NWS API URL....: "{Config.NWS_API_URL}"')
     log.info(f' - Image URL......: "{Config.IMAGE_SERVER_URL}"')
     log.info(f' - Image save path: "{Path(Config.IMAGE_SAVE_PATH).resolve()}"')
-
-    log.info("Populating database.")
-    get_alerts(initial=True)
-    
-    log.info("Cleaning stale watches/warnings.")
-    clean_records()
-
-    log.info("Cleaning stale images.")
-    clean_images()
-
-    schedule.every(10).seconds.do(run_threaded, get_alerts)
-    schedule.every(1).minutes.do(run_threaded, clean_records)
-    schedule.every(20).minutes.do(run_threaded, clean_images)
-
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+    log.info(f' - Render workers.: {Config.RENDER_WORKERS}')
+    log.info(f' - Destinations...: {", ".join(d.name for d in router)}')
+    if Config.CLUSTER_ENABLED:
+        log.info(f' - Cluster node...: "{node_name()}"')
+
+    if Config.METRICS_PORT:
+        metrics.serve(Config.METRICS_PORT)
+
+    image_registry.load()
+    # Without the leader lock another node is already polling and cleaning up, just render.
+    if leader_lock is None or leader_lock.acquire():
+        log.info("Populating database.")
+        get_alerts(initial=True)
+
+        log.info("Cleaning stale watches/warnings.")
+        clean_records()
+
+        log.info("Building the alert cache.")
+        refresh_cache()
+
+        log.info("Cleaning stale images.")
+        clean_images()
+        clean_untracked_images(Config.IMAGE_RETENTION_DAYS)
+        next_poll = time.monotonic() + Config.POLL_INTERVAL
+
+    pipeline = Pipeline(
+        fetch=fetch_alerts if work_queue is None else fetch_work,
+        notify=notify_alert,
+        render_pool=render_pool,
+        # `fetch_work` waits on the work queue between polls itself.
+        interval=Config.POLL_INTERVAL if work_queue is None else 0,
+        queue_size=Config.PIPELINE_QUEUE_SIZE,
+        notify_concurrency=Config.NOTIFY_CONCURRENCY,
+    )
+    if leader_lock is not None:
+        pipeline.every(Config.CLUSTER_LEADER_TTL / 3, renew_leadership)
+    pipeline.every(60, leader_only(clean_records))
+    pipeline.every(60, leader_only(refresh_cache))
+    pipeline.every(60, leader_only(clean_images))
+    pipeline.every(60 * 60, log_stats)
+    pipeline.every(60, lambda: log.debug(f"Queue depths: {pipeline.depths}"))
+
+    asyncio.run(pipeline.run())
+    get_dispatcher().close()
+    if leader_lock is not None:
+        leader_lock.release()